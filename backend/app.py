@@ -11,40 +11,103 @@
 """
 
 import os
+import signal
 import sys
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, request, jsonify, session
+# 以脚本方式运行 (python backend/app.py) 时将项目根目录加入搜索路径
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# 启动耗时统计从这里开始
+from backend.startup import StartupReport
+startup_report = StartupReport()
+
+from flask import Flask, Response, g, request, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import atexit
+import click
+import contextlib
+import importlib.util
 import json
+import math
 import threading
 import time
+import uuid
 
-# 日期解析辅助函数
-def parse_datetime(date_str):
-    """解析 ISO 格式日期字符串，支持带 Z 后缀的格式"""
-    if not date_str:
-        return None
-    # 替换 Z 为 +00:00，或直接去掉
-    if date_str.endswith('Z'):
-        date_str = date_str[:-1] + '+00:00'
-    try:
-        return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-    except:
-        # 尝试去掉时区信息
-        return datetime.fromisoformat(date_str.split('+')[0].split('Z')[0])
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
 
 # 导入配置
-try:
-    from config import EMQX_CONFIG, SECRET_KEY, SQLALCHEMY_DATABASE_URI, MQTT_TOPICS
-except ImportError:
-    from config.example import EMQX_CONFIG, SECRET_KEY, SQLALCHEMY_DATABASE_URI, MQTT_TOPICS
-
-# 导入 MQTT 客户端
-from utils.mqtt.mqtt_client import MqttClient
+def load_config():
+    """加载 config.py，不存在时回退到 config.example.py (文件名含点，不能直接 import)"""
+    try:
+        import config
+        return config
+    except ModuleNotFoundError as e:
+        if e.name != 'config':
+            raise
+    path = os.path.join(ROOT_DIR, 'config.example.py')
+    spec = importlib.util.spec_from_file_location('config_example', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    print("[配置] 未找到 config.py，使用 config.example.py")
+    return module
+
+
+app_config = load_config()
+EMQX_CONFIG = app_config.EMQX_CONFIG
+if not EMQX_CONFIG.get('clean', True) and EMQX_CONFIG.get('protocol', 4) != 5:
+    # 3.1.1 的持久会话没有过期时间，每个进程的客户端 ID 都不同，进程退出后会话会永远留在代理上
+    raise ValueError("EMQX_CONFIG: 'clean': False (持久会话) 需要 'protocol': 5 以设置会话过期时间")
+SECRET_KEY = app_config.SECRET_KEY
+SQLALCHEMY_DATABASE_URI = app_config.SQLALCHEMY_DATABASE_URI
+MQTT_TOPICS = app_config.MQTT_TOPICS
+# 共享清单事件发布到 <lists>/<清单 ID>，每个清单一个主题
+LIST_TOPIC_PREFIX = MQTT_TOPICS.get('lists', 'todo/lists')
+# 用户统计快照以保留消息发布到 <stats>/<用户 ID>
+STATS_TOPIC_PREFIX = MQTT_TOPICS.get('stats', 'todo/stats')
+
+
+def get_config(name, default=None):
+    """读取可选配置项 (旧版 config.py 中可能不存在)"""
+    return getattr(app_config, name, default)
+
+
+METRICS_CONFIG = get_config('METRICS_CONFIG', {'enabled': True})
+ARCHIVE_CONFIG = get_config('ARCHIVE_CONFIG', {'enabled': False})
+WRITE_BEHIND_CONFIG = get_config('WRITE_BEHIND_CONFIG', {'enabled': False})
+SSE_CONFIG = get_config('SSE_CONFIG', {})
+RATE_LIMIT_CONFIG = get_config('RATE_LIMIT_CONFIG', {})
+STARTUP_CONFIG = get_config('STARTUP_CONFIG', {})
+SHARD_CONFIG = get_config('SHARD_CONFIG', {'enabled': False})
+SYNC_CONFIG = get_config('SYNC_CONFIG', {})
+LIST_CONFIG = get_config('LIST_CONFIG', {})
+MQTT_RELAY_CONFIG = get_config('MQTT_RELAY_CONFIG', {'enabled': False})
+MQTT_EVENT_POLICY = get_config('MQTT_EVENT_POLICY', {})
+
+# MQTT 客户端 (paho) 和写回缓冲在用到时才导入
+from backend import metrics
+from backend.events import EventHub, peek_fields
+from backend import hierarchy
+from backend.hierarchy import InvalidHierarchy
+from backend.mqtt_policy import PolicyTable
+from backend.intervals import IntervalIndexCache, event_span
+from backend.permissions import InvalidRole, MembershipCache, parse_role
+from backend.ranking import InvalidPriority, PriorityType, parse_priority, smart_rank
+from backend.ratelimit import Debouncer, RateLimiter, TrailingDebouncer
+from backend.rollups import RollupDelta, TREND_BUCKETS, apply_rollup_delta, build_trends, task_contribution
+from backend.sharding import (
+    DEFAULT_SHARD, IdAllocator, ShardRouter, ShardUnavailable, copy_user_rows,
+    current_shard, delete_user_rows, shard_scope, sharded_session
+)
+from backend.tagindex import InvalidTag, TAG_LENGTH, TAG_MODES, TagIndexCache, parse_tag_names
+from backend.timeutil import InvalidDatetime, format_datetime, parse_datetime
+startup_report.mark('imports')
 
 # 创建 Flask 应用 - 同时服务前端静态文件
 app = Flask(__name__, 
@@ -64,7 +127,31 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 CORS(app, supports_credentials=True, origins=['http://localhost:5000', 'http://127.0.0.1:5000', 'null'])
 
 # 初始化数据库
-db = SQLAlchemy(app)
+# 按用户分片的表，其余表 (用户、分片分配等) 只在主库
+SHARDED_TABLES = (
+    'task', 'calendar_event', 'task_archive', 'archive_summary', 'task_tombstone', 'task_daily_stats',
+    'tag', 'task_tag'
+)
+
+if SHARD_CONFIG.get('enabled'):
+    # 每个分片对应一个 bind，主库 (default) 可同时作为分片
+    app.config['SQLALCHEMY_BINDS'] = {
+        name: uri for name, uri in SHARD_CONFIG['shards'].items() if name != DEFAULT_SHARD
+    }
+    db = SQLAlchemy(app, session_options={'class_': sharded_session(SHARDED_TABLES)})
+else:
+    db = SQLAlchemy(app)
+
+# 请求级监控埋点
+if METRICS_CONFIG.get('enabled', True):
+    metrics.install(
+        app,
+        profile_slow_ms=METRICS_CONFIG.get('profile_slow_ms'),
+        profile_interval_ms=METRICS_CONFIG.get('profile_interval_ms', 5),
+        profile_dir=METRICS_CONFIG.get('profile_dir', 'profiles')
+    )
+
+startup_report.mark('app')
 
 # ============== 数据模型 ==============
 
@@ -87,22 +174,62 @@ class User(db.Model):
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'created_at': self.created_at.isoformat()
+            'created_at': format_datetime(self.created_at)
         }
 
 
 class Task(db.Model):
     """任务模型"""
+    __table_args__ = (
+        db.Index('ix_task_user_completed', 'user_id', 'completed', 'completed_at'),
+        # sort=priority / due / smart 对应的索引
+        db.Index('ix_task_user_priority', 'user_id', 'priority', 'created_at'),
+        db.Index('ix_task_user_due', 'user_id', 'due_date'),
+        db.Index('ix_task_user_rank', 'user_id', 'completed', 'smart_rank'),
+        # 增量同步 /api/tasks/changes
+        db.Index('ix_task_user_updated', 'user_id', 'updated_at'),
+        # 子树查询: 路径前缀范围扫描
+        db.Index('ix_task_user_path', 'user_id', 'path'),
+        db.Index('ix_task_list_created', 'list_id', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     completed = db.Column(db.Boolean, default=False)
+    completed_at = db.Column(db.DateTime, nullable=True)
     due_date = db.Column(db.DateTime, nullable=True)
-    priority = db.Column(db.String(20), default='normal')  # low, normal, high
+    # low, normal, high；库中为小整数列 priority_level (旧的字符串列 priority 不再使用)
+    priority = db.Column('priority_level', PriorityType, key='priority', default='normal')
+    # 智能排序键，写入时由 update_smart_rank 维护
+    smart_rank = db.Column(db.BigInteger, nullable=True)
+    # 所属共享清单 (空为个人任务)；清单中的任务 user_id 为清单所有者，数据在所有者的分片
+    list_id = db.Column(db.Integer, nullable=True)
+    # 层级 (物化路径，见 backend/hierarchy.py)；不加外键，父任务可能已被归档
+    parent_id = db.Column(db.Integer, nullable=True)
+    path = db.Column(db.String(hierarchy.PATH_LENGTH), nullable=True)
+    depth = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 只读: 标签经 set_task_tags 写入；批量加载任务时一次 IN 查询取出全部标签
+    tags = db.relationship(
+        'Tag', secondary='task_tag',
+        primaryjoin='Task.id == foreign(TaskTag.task_id)',
+        secondaryjoin='Tag.id == foreign(TaskTag.tag_id)',
+        viewonly=True, lazy='selectin', order_by='Tag.name'
+    )
     
+    def set_completed(self, completed):
+        """切换完成状态并记录完成时间"""
+        completed = bool(completed)
+        if completed and not self.completed:
+            self.completed_at = datetime.utcnow()
+        elif not completed:
+            self.completed_at = None
+        self.completed = completed
+    
+    @metrics.timed_serializer
     def to_dict(self):
         return {
             'id': self.id,
@@ -110,15 +237,139 @@ class Task(db.Model):
             'title': self.title,
             'description': self.description,
             'completed': self.completed,
-            'due_date': self.due_date.isoformat() if self.due_date else None,
+            'completed_at': format_datetime(self.completed_at),
+            'due_date': format_datetime(self.due_date),
+            'priority': self.priority,
+            'list_id': self.list_id,
+            'parent_id': self.parent_id,
+            'path': self.path,
+            'depth': self.depth,
+            'tags': [tag.name for tag in self.tags],
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at)
+        }
+
+
+def subtree_filter(path):
+    """路径为 path 的任务及其所有后代 (走 ix_task_user_path 范围扫描)"""
+    lower, upper = hierarchy.subtree_bounds(path)
+    return db.and_(Task.path >= lower, Task.path < upper)
+
+
+@event.listens_for(Task, 'before_insert')
+@event.listens_for(Task, 'before_update')
+def update_smart_rank(mapper, connection, target):
+    """写入任务时重新计算智能排序键"""
+    target.smart_rank = smart_rank(target.due_date, target.priority, target.created_at)
+
+
+class TaskArchive(db.Model):
+    """已归档任务 (冷存储): 完成较久的任务从 task 表移入此表"""
+    __tablename__ = 'task_archive'
+    __table_args__ = (
+        db.Index('ix_task_archive_user_completed', 'user_id', 'completed_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)  # 沿用原任务 ID
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    due_date = db.Column(db.DateTime, nullable=True)
+    priority = db.Column('priority_level', PriorityType, key='priority', default='normal')
+    created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @metrics.timed_serializer
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'title': self.title,
+            'description': self.description,
+            'completed': True,
+            'completed_at': format_datetime(self.completed_at),
+            'due_date': format_datetime(self.due_date),
             'priority': self.priority,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at),
+            'archived_at': format_datetime(self.archived_at)
+        }
+
+
+class TaskTombstone(db.Model):
+    """已删除 (或已归档) 任务的墓碑，供增量同步告知客户端移除，保留 SYNC_CONFIG['tombstone_days'] 天"""
+    __tablename__ = 'task_tombstone'
+    __table_args__ = (
+        db.Index('ix_task_tombstone_user_deleted', 'user_id', 'deleted_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)  # 原任务 ID
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Tag(db.Model):
+    """任务标签，名称在用户内唯一"""
+    __tablename__ = 'tag'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_tag_user_name'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(TAG_LENGTH), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self, count=0):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'count': count,
+            'created_at': format_datetime(self.created_at)
         }
 
 
+class TaskTag(db.Model):
+    """任务与标签的关联，带 user_id 以便按用户加载索引和迁移分片 (不加外键，迁移时逐表复制)"""
+    __tablename__ = 'task_tag'
+    __table_args__ = (
+        db.Index('ix_task_tag_user_tag', 'user_id', 'tag_id'),
+    )
+    
+    task_id = db.Column(db.Integer, primary_key=True)
+    tag_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+
+
+class ArchiveSummary(db.Model):
+    """每用户归档计数，统计接口直接读取，无需扫描归档表"""
+    __tablename__ = 'archive_summary'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    task_count = db.Column(db.Integer, default=0, nullable=False)
+
+
+class TaskDailyStats(db.Model):
+    """每用户每日任务汇总 (UTC 日期)，趋势统计只读此表；写入任务时增量维护，见 backend/rollups.py"""
+    __tablename__ = 'task_daily_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    created = db.Column(db.Integer, default=0, nullable=False)
+    completed = db.Column(db.Integer, default=0, nullable=False)
+    completion_seconds = db.Column(db.BigInteger, default=0, nullable=False)
+    due = db.Column(db.Integer, default=0, nullable=False)
+    late = db.Column(db.Integer, default=0, nullable=False)
+
+
 class CalendarEvent(db.Model):
     """日历事件模型"""
+    __table_args__ = (
+        db.Index('ix_calendar_event_user_start', 'user_id', 'start_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
@@ -129,62 +380,736 @@ class CalendarEvent(db.Model):
     color = db.Column(db.String(20), default='#667eea')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @metrics.timed_serializer
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
             'description': self.description,
-            'start_time': self.start_time.isoformat(),
-            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'start_time': format_datetime(self.start_time),
+            'end_time': format_datetime(self.end_time),
             'all_day': self.all_day,
             'color': self.color,
-            'created_at': self.created_at.isoformat()
+            'created_at': format_datetime(self.created_at)
+        }
+
+
+class TaskList(db.Model):
+    """共享清单 (只在主库)"""
+    __tablename__ = 'task_list'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self, role=None):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'owner_id': self.owner_id,
+            'role': role,
+            'created_at': format_datetime(self.created_at)
         }
 
 
+class ListMember(db.Model):
+    """清单成员与角色 (只在主库)，所有者也有一条 owner 记录"""
+    __tablename__ = 'list_member'
+    __table_args__ = (
+        db.Index('ix_list_member_user', 'user_id'),
+    )
+    
+    list_id = db.Column(db.Integer, db.ForeignKey('task_list.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    role = db.Column(db.String(20), nullable=False, default='editor')
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ShardAssignment(db.Model):
+    """用户所在分片 (只在主库)，无记录的老用户数据在主库"""
+    __tablename__ = 'shard_assignment'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    shard = db.Column(db.String(50), nullable=False)
+    moving = db.Column(db.Boolean, default=False, nullable=False)  # 迁移中，暂停读写
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IdBlock(db.Model):
+    """分片表的全局 ID 号段 (只在主库)"""
+    __tablename__ = 'id_block'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+
+startup_report.mark('models')
+
+# ============== 清单成员缓存 ==============
+
+def load_list_members(list_id):
+    """一次查询读取清单所有者和全部成员 (始终查主库)"""
+    rows = db.session.execute(
+        db.select(TaskList.owner_id, ListMember.user_id, ListMember.role)
+        .outerjoin(ListMember, ListMember.list_id == TaskList.id)
+        .where(TaskList.id == list_id)
+    ).all()
+    if not rows:
+        return None
+    return rows[0].owner_id, {row.user_id: row.role for row in rows if row.user_id is not None}
+
+
+list_members = MembershipCache(
+    load_list_members,
+    ttl=LIST_CONFIG.get('membership_ttl', 30),
+    max_lists=LIST_CONFIG.get('max_cached_lists', 10000)
+)
+
+
+# ============== 分片路由 ==============
+
+def load_shard_assignment(user_id):
+    """读取用户的分片分配记录 (始终查主库)"""
+    row = db.session.execute(
+        db.select(ShardAssignment.shard, ShardAssignment.moving)
+        .where(ShardAssignment.user_id == user_id)
+    ).first()
+    return (row.shard, row.moving) if row else None
+
+
+shard_router = None
+id_allocator = None
+if SHARD_CONFIG.get('enabled'):
+    shard_router = ShardRouter(
+        SHARD_CONFIG['shards'],
+        load_shard_assignment,
+        vnodes=SHARD_CONFIG.get('vnodes', 64),
+        ttl=SHARD_CONFIG.get('cache_ttl', 5)
+    )
+    id_allocator = IdAllocator(lambda: db.engine, IdBlock.__table__, SHARD_CONFIG.get('id_block', 1000))
+    
+    @event.listens_for(db.session, 'before_flush')
+    def assign_global_ids(session, flush_context, instances):
+        """分片表的新记录在写入前分配全局 ID，迁移用户时 ID 不会冲突"""
+        for obj in session.new:
+            if isinstance(obj, (Task, CalendarEvent, Tag)) and obj.id is None:
+                obj.id = id_allocator.next_id(obj.__tablename__)
+
+
+def shard_engine(shard):
+    """分片对应的数据库引擎"""
+    return db.engine if shard in (None, DEFAULT_SHARD) else db.engines[shard]
+
+
+def sharded_tables():
+    return [db.metadata.tables[name] for name in SHARDED_TABLES]
+
+
+@contextlib.contextmanager
+def user_shard(user_id):
+    """在 with 块内访问用户所在分片 (未启用分片时不做任何事)"""
+    if shard_router is None:
+        yield None
+        return
+    with shard_scope(shard_router.shard_for(user_id)) as shard:
+        yield shard
+
+
+def each_shard():
+    """依次切换到每个分片，用于归档等跨用户的后台任务 (需在应用上下文内调用)"""
+    for shard in shard_router.all_shards() if shard_router else [None]:
+        with shard_scope(shard):
+            yield shard
+        # 不同分片的 ID 可能相同，切换前清空会话
+        db.session.remove()
+
+
+def route_user_shard():
+    """请求开始时按登录用户切换到其所在分片；共享清单的接口切换到清单所有者的分片"""
+    user_id = session.get('user_id')
+    if shard_router is not None and user_id:
+        list_id = (request.view_args or {}).get('list_id')
+        owner_id = list_members.owner(list_id) if list_id is not None else None
+        g.shard_token = current_shard.set(shard_router.shard_for(owner_id or user_id))
+
+
+@app.teardown_request
+def reset_user_shard(exc):
+    token = g.pop('shard_token', None)
+    if token is not None:
+        current_shard.reset(token)
+
+
+def assign_new_user_shard(user_id):
+    """新用户按哈希环落到分片"""
+    shard = shard_router.place(user_id)
+    db.session.add(ShardAssignment(user_id=user_id, shard=shard))
+    db.session.commit()
+    shard_router.remember(user_id, shard)
+
+
+
+# ============== 数据库初始化 ==============
+
+def upgrade_schema(engine=None, tables=None):
+    """为已存在的表补齐新增的列和索引 (仅追加，不修改已有列)"""
+    engine = engine or db.engine
+    inspector = db.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in tables or db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(db.text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                ))
+                print(f"[数据库] 新增列 {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def init_db():
+    """创建缺失的表并升级已有表结构"""
+    db.create_all()
+    upgrade_schema()
+    migrate_task_priority()
+    fill_completed_at()
+    fill_task_paths()
+    if shard_router:
+        init_shards()
+    print("[数据库] 表已创建")
+
+
+def migrate_task_priority(engine=None):
+    """
+    旧版的字符串优先级迁移到 priority_level 列，并为旧任务补算智能排序键
+
+    只处理新列为空的行，可重复执行
+    """
+    engine = engine or db.engine
+    inspector = db.inspect(engine)
+    with engine.begin() as conn:
+        for table in ('task', 'task_archive'):
+            if table not in inspector.get_table_names():
+                continue
+            if 'priority' in {c['name'] for c in inspector.get_columns(table)}:
+                result = conn.execute(db.text(
+                    f"UPDATE {table} SET priority_level = CASE priority "
+                    f"WHEN 'low' THEN 0 WHEN 'high' THEN 2 ELSE 1 END "
+                    f"WHERE priority_level IS NULL"
+                ))
+                if result.rowcount:
+                    print(f"[数据库] 迁移 {table} 优先级 {result.rowcount} 行")
+        
+        table = Task.__table__
+        rows = conn.execute(
+            db.select(table.c.id, table.c.due_date, table.c.priority, table.c.created_at)
+            .where(table.c.smart_rank.is_(None))
+        ).all()
+        if rows:
+            conn.execute(
+                table.update().where(table.c.id == db.bindparam('task_id'))
+                .values(smart_rank=db.bindparam('rank')),
+                [{'task_id': r.id, 'rank': smart_rank(r.due_date, r.priority, r.created_at)} for r in rows]
+            )
+
+
+def fill_completed_at(engine=None):
+    """旧数据中已完成但没有 completed_at 的任务以最后更新时间补齐 (与归档一致)，可重复执行"""
+    engine = engine or db.engine
+    table = Task.__table__
+    with engine.begin() as conn:
+        conn.execute(
+            table.update().where(table.c.completed == True, table.c.completed_at.is_(None))
+            .values(completed_at=db.func.coalesce(table.c.updated_at, table.c.created_at))
+        )
+
+
+def fill_task_paths(engine=None):
+    """旧任务没有层级路径，作为根任务补齐，可重复执行"""
+    engine = engine or db.engine
+    table = Task.__table__
+    with engine.begin() as conn:
+        conn.execute(
+            table.update().where(table.c.path.is_(None))
+            .values(path=db.literal(hierarchy.SEPARATOR) + db.cast(table.c.id, db.String)
+                    + hierarchy.SEPARATOR, depth=0)
+        )
+
+
+def init_shards():
+    """在各分片库创建分片表，并以所有分片中的最大 ID 初始化全局 ID 号段"""
+    tables = sharded_tables()
+    for shard in shard_router.all_shards():
+        if shard != DEFAULT_SHARD:
+            db.metadata.create_all(shard_engine(shard), tables=tables)
+            upgrade_schema(shard_engine(shard), tables)
+            migrate_task_priority(shard_engine(shard))
+            fill_completed_at(shard_engine(shard))
+            fill_task_paths(shard_engine(shard))
+    for model in (Task, CalendarEvent, Tag):
+        start = 1
+        for shard in shard_router.all_shards():
+            with shard_engine(shard).connect() as conn:
+                start = max(start, (conn.execute(db.select(db.func.max(model.__table__.c.id))).scalar() or 0) + 1)
+        id_allocator.seed(model.__tablename__, start)
+
+
+# ============== 任务归档 ==============
+
+def archive_completed_tasks(older_than_days=30, batch_size=500):
+    """
+    将完成超过 older_than_days 天的任务分批移入归档表
+    
+    每批在一个事务内完成复制、删除和计数更新，返回归档总数
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    # 旧数据没有 completed_at，以最后更新时间代替
+    completed_time = db.func.coalesce(Task.completed_at, Task.updated_at)
+    archived = 0
+    
+    while True:
+        # 共享清单的任务不归档 (归档表按个人统计)
+        tasks = Task.query.filter(
+            Task.completed == True, completed_time < cutoff, Task.list_id.is_(None)
+        ).options(db.noload(Task.tags)).order_by(Task.id).limit(batch_size).all()
+        if not tasks:
+            break
+        
+        now = datetime.utcnow()
+        db.session.execute(TaskArchive.__table__.insert(), [{
+            'id': t.id,
+            'user_id': t.user_id,
+            'title': t.title,
+            'description': t.description,
+            'completed_at': t.completed_at or t.updated_at,
+            'due_date': t.due_date,
+            'priority': t.priority,
+            'created_at': t.created_at,
+            'updated_at': t.updated_at,
+            'archived_at': now
+        } for t in tasks])
+        counts = {}
+        archived_ids = {}
+        for t in tasks:
+            counts[t.user_id] = counts.get(t.user_id, 0) + 1
+            archived_ids.setdefault(t.user_id, []).append(t.id)
+        
+        task_ids = [t.id for t in tasks]
+        TaskTag.query.filter(TaskTag.task_id.in_(task_ids)).delete(synchronize_session=False)
+        Task.query.filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+        # 归档的任务不再出现在任务列表中，客户端缓存需移除
+        add_task_tombstones([(t.id, t.user_id) for t in tasks], now)
+        for user_id, count in counts.items():
+            summary = db.session.get(ArchiveSummary, user_id)
+            if summary is None:
+                summary = ArchiveSummary(user_id=user_id, task_count=0)
+                db.session.add(summary)
+            summary.task_count += count
+        db.session.commit()
+        db.session.expunge_all()
+        for user_id, ids in archived_ids.items():
+            tag_index.remove(user_id, ids)
+        
+        archived += len(tasks)
+        if len(tasks) < batch_size:
+            break
+    
+    if archived:
+        print(f"[归档] 已归档 {archived} 个任务")
+    return archived
+
+
+def add_task_tombstones(tasks, now=None):
+    """为 [(任务 ID, 用户 ID)] 写入墓碑 (随调用方的事务提交)，并清理这些用户的过期墓碑"""
+    now = now or datetime.utcnow()
+    ids = [task_id for task_id, _ in tasks]
+    TaskTombstone.query.filter(TaskTombstone.id.in_(ids)).delete(synchronize_session=False)
+    db.session.execute(TaskTombstone.__table__.insert(), [
+        {'id': task_id, 'user_id': user_id, 'deleted_at': now} for task_id, user_id in tasks
+    ])
+    expired = now - timedelta(days=SYNC_CONFIG.get('tombstone_days', 30))
+    TaskTombstone.query.filter(
+        TaskTombstone.user_id.in_({user_id for _, user_id in tasks}),
+        TaskTombstone.deleted_at < expired
+    ).delete(synchronize_session=False)
+
+
+# ============== 任务日汇总 ==============
+
+def task_rollup_state(task, previous=False):
+    """任务对日汇总的 (用户, 贡献)；previous 为真时取本次 flush 之前的值"""
+    state = db.inspect(task)
+    
+    def value(name):
+        history = state.attrs[name].history
+        if previous and history.deleted:
+            return history.deleted[0]
+        return getattr(task, name)
+    
+    if value('list_id') is not None:
+        # 共享清单的任务不计入个人统计
+        return value('user_id'), {}
+    return value('user_id'), task_contribution(value('created_at'), value('completed_at'), value('due_date'))
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_task_rollups(session, flush_context):
+    """任务增删改后在同一事务内更新日汇总 (批量 SQL 删除不经过此处，归档本就不改变汇总)"""
+    delta = RollupDelta()
+    for task in session.new:
+        if isinstance(task, Task):
+            delta.add(*task_rollup_state(task))
+    for task in session.dirty:
+        if isinstance(task, Task) and session.is_modified(task):
+            delta.add(*task_rollup_state(task, previous=True), sign=-1)
+            delta.add(*task_rollup_state(task))
+    for task in session.deleted:
+        if isinstance(task, Task):
+            delta.add(*task_rollup_state(task), sign=-1)
+    rows = delta.rows()
+    if rows:
+        connection = session.connection(bind_arguments={'mapper': TaskDailyStats})
+        apply_rollup_delta(connection, TaskDailyStats.__table__, rows)
+
+
+def backfill_rollups(batch_size=500):
+    """
+    按任务表和归档表重建当前分片内用户的日汇总，返回处理的用户数
+    
+    按用户分批，每批在一个事务内先删除再重算，可重复执行。
+    用户取自本分片的任务、归档和汇总表 (用户表在主库，按它遍历会把每个用户在每个分片上各算一次)
+    """
+    table = TaskDailyStats.__table__
+    shard_users = db.union(
+        db.select(Task.user_id), db.select(TaskArchive.user_id), db.select(table.c.user_id)
+    ).subquery()
+    last_id = 0
+    processed = 0
+    while True:
+        user_ids = db.session.execute(
+            db.select(shard_users.c.user_id).where(shard_users.c.user_id > last_id)
+            .order_by(shard_users.c.user_id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        
+        db.session.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+        delta = RollupDelta()
+        for model, personal in ((Task, Task.list_id.is_(None)), (TaskArchive, db.true())):
+            rows = db.session.execute(
+                db.select(model.user_id, model.created_at, model.completed_at, model.due_date)
+                .where(model.user_id.in_(user_ids), personal)
+            )
+            for row in rows:
+                delta.add(row.user_id, task_contribution(row.created_at, row.completed_at, row.due_date))
+        apply_rollup_delta(
+            db.session.connection(bind_arguments={'mapper': TaskDailyStats}), table, delta.rows()
+        )
+        db.session.commit()
+        processed += len(user_ids)
+    return processed
+
+
+def start_archive_worker():
+    """按 ARCHIVE_CONFIG 周期运行归档任务"""
+    def run():
+        while True:
+            try:
+                with app.app_context():
+                    for _ in each_shard():
+                        archive_completed_tasks(
+                            ARCHIVE_CONFIG.get('days', 30),
+                            ARCHIVE_CONFIG.get('batch_size', 500)
+                        )
+            except Exception as e:
+                print(f"[归档] 执行失败: {e}")
+            time.sleep(ARCHIVE_CONFIG.get('interval', 3600))
+    
+    threading.Thread(target=run, name='task-archiver', daemon=True).start()
+
+
+@app.cli.command('archive-tasks')
+@click.option('--days', default=30, show_default=True, help='归档完成超过多少天的任务')
+@click.option('--batch-size', default=500, show_default=True, help='每批归档数量')
+def archive_tasks_command(days, batch_size):
+    """归档已完成的任务"""
+    init_db()
+    count = sum(archive_completed_tasks(days, batch_size) for _ in each_shard())
+    click.echo(f'已归档 {count} 个任务')
+
+
+@app.cli.command('rollup-backfill')
+@click.option('--batch-size', default=500, show_default=True, help='每批处理的用户数')
+def rollup_backfill_command(batch_size):
+    """按现有任务重建日汇总 (首次部署或修复统计时运行)"""
+    init_db()
+    count = sum(backfill_rollups(batch_size) for _ in each_shard())
+    click.echo(f'已重建 {count} 个用户的日汇总')
+
+
+@app.cli.command('shard-status')
+def shard_status_command():
+    """显示各分片的用户数"""
+    if shard_router is None:
+        click.echo('未启用分片')
+        return
+    init_db()
+    counts = dict(db.session.execute(
+        db.select(ShardAssignment.shard, db.func.count()).group_by(ShardAssignment.shard)
+    ).all())
+    assigned = sum(counts.values())
+    counts[DEFAULT_SHARD] = counts.get(DEFAULT_SHARD, 0) + User.query.count() - assigned
+    for shard in shard_router.all_shards():
+        click.echo(f'{shard}: {counts.get(shard, 0)} 个用户')
+
+
+@app.cli.command('shard-rebalance')
+@click.option('--batch-size', default=100, show_default=True, help='每批迁移的用户数')
+@click.option('--limit', default=0, help='最多迁移的用户数 (0 为不限)')
+@click.option('--dry-run', is_flag=True, help='只列出需要迁移的用户数')
+def shard_rebalance_command(batch_size, limit, dry_run):
+    """将用户迁移到哈希环计算出的分片 (在线执行，迁移中的用户短暂返回 503)"""
+    if shard_router is None:
+        click.echo('未启用分片')
+        return
+    init_db()
+    moved = 0
+    for batch in iter_misplaced_users(batch_size, limit):
+        if dry_run:
+            moved += len(batch)
+            continue
+        moved += rebalance_users(batch)
+        click.echo(f'已迁移 {moved} 个用户')
+    click.echo(f'{"需要" if dry_run else "共"}迁移 {moved} 个用户')
+
+
+def iter_misplaced_users(batch_size, limit=0):
+    """按批返回 [(user_id, 当前分片, 目标分片)]，只包含当前分片与哈希环不一致的用户"""
+    last_id = 0
+    found = 0
+    while not limit or found < limit:
+        rows = db.session.execute(
+            db.select(User.id, ShardAssignment.shard)
+            .outerjoin(ShardAssignment, ShardAssignment.user_id == User.id)
+            .where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        batch = []
+        for user_id, shard in rows:
+            source, target = shard or DEFAULT_SHARD, shard_router.place(user_id)
+            if source != target:
+                batch.append((user_id, source, target))
+        if limit:
+            batch = batch[:limit - found]
+        found += len(batch)
+        if batch:
+            yield batch
+
+
+def rebalance_users(batch):
+    """
+    迁移一批用户:
+    1. 标记为迁移中并等待路由缓存过期，各进程停止读写这些用户
+    2. 复制数据到目标分片 -> 更新分配记录 -> 删除源分片数据
+    中途失败可重跑，复制前会先清理目标分片中的残留数据
+    """
+    tables = sharded_tables()
+    for user_id, source, _ in batch:
+        assignment = db.session.get(ShardAssignment, user_id)
+        if assignment is None:
+            db.session.add(ShardAssignment(user_id=user_id, shard=source, moving=True))
+        else:
+            assignment.moving = True
+    db.session.commit()
+    # 写回缓冲等进行中的写入也在这段时间内完成
+    time.sleep(shard_router.ttl)
+    
+    groups = {}
+    for user_id, source, target in batch:
+        groups.setdefault((source, target), []).append(user_id)
+    for (source, target), user_ids in groups.items():
+        copy_user_rows(shard_engine(source), shard_engine(target), tables, user_ids)
+        db.session.execute(
+            db.update(ShardAssignment).where(ShardAssignment.user_id.in_(user_ids))
+            .values(shard=target, moving=False)
+        )
+        db.session.commit()
+        delete_user_rows(shard_engine(source), tables, user_ids)
+    return len(batch)
+
+
+@app.cli.command('mqtt-relay')
+@click.option('--socket', 'socket_path', default=None, help='Unix socket 路径 (默认取 MQTT_RELAY_CONFIG)')
+def mqtt_relay_command(socket_path):
+    """运行 MQTT 中继 (每台机器一个，代替本机所有工作进程发布和订阅)"""
+    from utils.mqtt.publish_relay import PublishRelay
+    import socket
+    config = {
+        'broker': EMQX_CONFIG['broker'],
+        'port': EMQX_CONFIG['port'],
+        'client_id': f'todo_relay_{socket.gethostname()}_{os.getpid()}',
+        'username': EMQX_CONFIG['username'],
+        'password': EMQX_CONFIG['password'],
+        'use_tls': EMQX_CONFIG['use_tls'],
+        'ca_cert': EMQX_CONFIG['ca_cert'],
+        'qos': 1,
+        # 协议与后端一致以转发消息过期时间；会话选项只用于订阅连接
+        'protocol': EMQX_CONFIG.get('protocol', 4),
+        'clean': EMQX_CONFIG.get('clean', True),
+        'session_expiry': EMQX_CONFIG.get('session_expiry', 0),
+    }
+    PublishRelay(
+        config,
+        socket_path or MQTT_RELAY_CONFIG.get('socket', '/tmp/todo-mqtt-relay.sock'),
+        pool_size=MQTT_RELAY_CONFIG.get('pool_size', 2),
+        batch_max=MQTT_RELAY_CONFIG.get('batch_max', 100),
+        queue_size=MQTT_RELAY_CONFIG.get('queue_size', 10000),
+        # 与 init_mqtt 中工作进程订阅的主题一致
+        topics=[MQTT_TOPICS['tasks'], MQTT_TOPICS['sync'], f'{LIST_TOPIC_PREFIX}/+']
+    ).run()
+
+
 # ============== MQTT 客户端 ==============
 
 mqtt_client = None
 mqtt_connected = False
+# 中继: 启用后本进程的发布和订阅都经 Unix socket 由中继进程完成 (即 mqtt_client)
+mqtt_relay = None
+
+# 本进程标识: 用于识别 MQTT 回传的自身消息
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+# 各事件类型的 QoS / 过期时间 / 保留标志
+event_policies = PolicyTable(MQTT_EVENT_POLICY)
+
+# SSE 推送中心: 由 publish_update 和 MQTT 订阅喂入，按用户扇出到浏览器
+event_hub = EventHub(
+    buffer_size=SSE_CONFIG.get('buffer_size', 256),
+    queue_size=SSE_CONFIG.get('queue_size', 100),
+    heartbeat=SSE_CONFIG.get('heartbeat', 15),
+    instance=INSTANCE_ID,
+    # 全量快照只实时推送，不进续传缓冲
+    live_events=('sync_response',)
+)
 
 def init_mqtt():
     """初始化 MQTT 客户端"""
-    global mqtt_client, mqtt_connected
+    global mqtt_client, mqtt_connected, mqtt_relay
     
     config = {
         'broker': EMQX_CONFIG['broker'],
         'port': EMQX_CONFIG['port'],
-        'client_id': f'todo_backend_{int(time.time())}',
+        # 同一秒启动的多个工作进程不能共用客户端 ID，否则代理会互相踢下线
+        'client_id': f'todo_backend_{os.getpid()}_{INSTANCE_ID}',
         'username': EMQX_CONFIG['username'],
         'password': EMQX_CONFIG['password'],
         'use_tls': EMQX_CONFIG['use_tls'],
         'ca_cert': EMQX_CONFIG['ca_cert'],
-        'qos': 1
+        'qos': 1,
+        # 持久会话: 断线重连期间其他进程的 QoS 1 事件由代理保存并补发，无需重新同步；
+        # 客户端 ID 每个进程不同，首次连接总是新会话，进程正常退出时结束会话
+        'protocol': EMQX_CONFIG.get('protocol', 4),
+        'clean': EMQX_CONFIG.get('clean', True),
+        'session_expiry': EMQX_CONFIG.get('session_expiry', 0),
+        # 回调直接拿到 memoryview，避免解码和打印整条消息
+        'raw_payload': True,
+        'max_payload': EMQX_CONFIG.get('max_payload', 4 * 1024 * 1024)
     }
     
-    mqtt_client = MqttClient(config)
-    mqtt_client.connect()
-    
-    if mqtt_client.connected:
+    if MQTT_RELAY_CONFIG.get('enabled'):
+        # 发布中继: 发布与订阅都经本机中继的 Unix socket，工作进程不连接代理
+        from utils.mqtt.publish_relay import RelayPublisher
+        mqtt_client = mqtt_relay = RelayPublisher({
+            **MQTT_RELAY_CONFIG,
+            'raw_payload': True,
+            'max_payload': config['max_payload']
+        })
+        endpoint = f'中继 unix:{mqtt_client.socket_path}'
+    elif EMQX_CONFIG.get('transport') == 'loopback':
+        # 本地回环代理: 开发与压测时无需连接 EMQX Cloud
+        from utils.mqtt.local_broker import LoopbackMqttClient
+        mqtt_client = LoopbackMqttClient(config)
+        endpoint = '进程内回环代理'
+    else:
+        from utils.mqtt.mqtt_client import MqttClient
+        mqtt_client = MqttClient(config)
+        endpoint = f"{'mqtts' if config['use_tls'] else 'mqtt'}://{config['broker']}:{config['port']}"
+    mqtt_client.metrics_callback = metrics.observe_mqtt
+    if not config['clean'] and mqtt_relay is None:
+        atexit.register(mqtt_client.disconnect)
+    metrics.MQTT_INFLIGHT.set_function(lambda: getattr(mqtt_client, 'inflight_count', 0))
+    connect_started = time.perf_counter()
+    
+    def on_connected(client):
+        global mqtt_connected
+        if not mqtt_connected:
+            startup_report.record('mqtt_connect', time.perf_counter() - connect_started)
         mqtt_connected = True
-        print("[MQTT] 后端已连接到 EMQX Cloud")
+        print(f"[MQTT] 后端已连接到 {endpoint}")
         
-        # 订阅同步主题
-        mqtt_client.subscribe([
+        if client.session_present:
+            # 代理保留了会话: 订阅仍有效，断线期间的消息随后补发
+            return
+        # 订阅同步主题 (新会话需重新订阅)
+        client.subscribe([
             MQTT_TOPICS['tasks'],
-            MQTT_TOPICS['sync']
+            MQTT_TOPICS['sync'],
+            f'{LIST_TOPIC_PREFIX}/+'
         ], on_mqtt_message)
-    else:
-        print("[MQTT] 后端连接失败")
+    
+    # 后台连接并自动重连，不阻塞 HTTP 服务启动
+    mqtt_client.on_connected = on_connected
+    mqtt_client.connect(wait=False)
 
 
-def on_mqtt_message(topic, message):
-    """处理 MQTT 消息"""
-    print(f"[MQTT] 收到消息: {topic} -> {message}")
+def on_mqtt_message(topic, payload):
+    """处理 MQTT 消息 (payload 为 memoryview)"""
+    start = time.perf_counter()
     
     try:
-        data = json.loads(message)
+        text = str(payload, 'utf-8')
+        
+        if topic.startswith(LIST_TOPIC_PREFIX + '/'):
+            # 其他后端进程发布的共享清单事件: 成员变化时失效缓存，再转发给本进程订阅该清单的 SSE 连接
+            header = peek_fields(text, ('event', 'origin', 'user_id', 'list_id'))
+            if 'event' in header and header.get('list_id') is not None and header.get('origin') != INSTANCE_ID:
+                if header.get('event', '').startswith('list_'):
+                    list_members.invalidate(header['list_id'])
+                dispatch_event(header, text)
+            return
+        
+        if topic == MQTT_TOPICS['sync']:
+            # 事件消息只读取开头的路由字段，快照等大字段原样转发
+            header = peek_fields(text, ('event', 'origin', 'user_id'))
+            if 'event' in header:
+                # 其他后端进程发布的事件，转发给本进程的 SSE 连接
+                if header.get('origin') != INSTANCE_ID:
+                    if header.get('user_id') is not None:
+                        if header['event'].startswith(('task_', 'tag_')):
+                            # 其他进程可能改了任务的标签，本进程的标签索引在下次查询时重建
+                            tag_index.invalidate(header['user_id'])
+                        dispatch_event(header, text)
+                    else:
+                        dispatch_event(json.loads(text))
+                return
+        
+        data = json.loads(text)
+        
+        # 客户端发来的请求按用户限流，超限直接丢弃
+        if not allow_mqtt_message(data.get('user_id')):
+            print(f"[MQTT] 用户 {data.get('user_id')} 消息过于频繁，已丢弃")
+            return
         
         if topic == MQTT_TOPICS['tasks']:
             # 处理任务同步
@@ -193,49 +1118,238 @@ def on_mqtt_message(topic, message):
             # 处理同步请求
             handle_sync_request(data)
             
-    except json.JSONDecodeError:
+    except (UnicodeDecodeError, json.JSONDecodeError):
         print(f"[MQTT] 无效的 JSON 消息")
     except Exception as e:
         print(f"[MQTT] 处理消息错误: {e}")
+    finally:
+        metrics.observe_mqtt('handle', topic, time.perf_counter() - start)
 
 
 def handle_task_sync(data):
     """处理任务同步"""
-    with app.app_context():
-        action = data.get('action')
-        user_id = data.get('user_id')
-        
+    action = data.get('action')
+    user_id = data.get('user_id')
+    with app.app_context(), user_shard(user_id):
         if action == 'update':
             task_id = data.get('task_id')
             task = Task.query.get(task_id)
-            if task and task.user_id == user_id:
+            if task and task.user_id == user_id and task.list_id is None:
                 # 广播更新给其他客户端
                 publish_update('task_updated', task.to_dict())
 
 
+def build_sync_response(user_id):
+    """生成用户的全量任务快照"""
+    with app.app_context(), user_shard(user_id):
+        tasks = Task.query.filter_by(user_id=user_id, list_id=None).all()
+        return {
+            'user_id': user_id,
+            'tasks': [t.to_dict() for t in tasks]
+        }
+
+
 def handle_sync_request(data):
     """处理同步请求"""
-    with app.app_context():
-        user_id = data.get('user_id')
-        if user_id:
-            tasks = Task.query.filter_by(user_id=user_id).all()
-            publish_update('sync_response', {
-                'user_id': user_id,
-                'tasks': [t.to_dict() for t in tasks]
-            })
-
-
-def publish_update(event_type, data):
-    """发布更新到 MQTT"""
-    global mqtt_client, mqtt_connected
-    
-    if mqtt_connected and mqtt_client:
-        message = json.dumps({
-            'event': event_type,
-            'data': data,
-            'timestamp': datetime.utcnow().isoformat()
-        })
-        mqtt_client.publish(MQTT_TOPICS['sync'], message)
+    user_id = data.get('user_id')
+    if not user_id:
+        return
+    # 去抖窗口内的重复请求复用同一份快照，只省去查询和计算；
+    # 仍需重新发布: 同步响应为 QoS 0、很快过期且不保留，之后才订阅的客户端收不到上一次的广播
+    response, _ = sync_debouncer.get_or_compute(user_id, lambda: build_sync_response(user_id))
+    publish_update('sync_response', response)
+
+
+def list_channel(list_id):
+    """共享清单在 SSE 推送中心的频道名"""
+    return f'list:{list_id}'
+
+
+def dispatch_event(message, payload=None):
+    """将事件推送给所属用户 (或共享清单频道) 的 SSE 连接 (payload 为已序列化的消息，可省去再次序列化)"""
+    if message.get('list_id') is not None:
+        # 清单事件只写入一次清单频道，由所有成员的连接共享
+        event_hub.publish(list_channel(message['list_id']), message['event'], message, payload)
+        return
+    user_id = message.get('user_id')
+    if user_id is None:
+        user_id = message.get('data', {}).get('user_id')
+    if user_id is not None:
+        if message['event'].startswith('task_'):
+            # 任务有变化，之后的同步请求需重新生成快照
+            sync_debouncer.invalidate(user_id)
+        event_hub.publish(user_id, message['event'], message, payload)
+
+
+def publish_update(event_type, data, list_id=None):
+    """
+    发布更新到 MQTT 和本进程的 SSE 连接
+    
+    list_id 不为空时是共享清单的事件: 只发布一次到清单主题，不按成员逐个发送
+    """
+    # 路由字段在前、data 在后，接收方只需读取开头即可转发
+    message = {
+        'event': event_type,
+        'origin': INSTANCE_ID,
+        'user_id': data.get('user_id')
+    }
+    if list_id is not None:
+        message['list_id'] = list_id
+    message['timestamp'] = format_datetime(datetime.utcnow())
+    message['data'] = data
+    # 只序列化一次，SSE 和 MQTT 共用
+    payload = json.dumps(message, ensure_ascii=False)
+    dispatch_event(message, payload)
+    
+    topic = f'{LIST_TOPIC_PREFIX}/{list_id}' if list_id is not None else MQTT_TOPICS['sync']
+    publish_mqtt(topic, payload, event_policies.get(event_type))
+    
+    if event_type.startswith('task_') and list_id is None and message['user_id']:
+        # 个人任务变化: 稍后刷新该用户的统计快照 (共享清单任务不计入个人统计)
+        stats_debouncer.trigger(message['user_id'])
+
+
+def publish_mqtt(topic, payload, policy):
+    """按事件策略发布到 MQTT (优先经发布中继)"""
+    client = mqtt_relay or (mqtt_client if mqtt_connected else None)
+    if client:
+        client.publish(topic, payload, qos=policy.qos, retain=policy.retain, expiry=policy.expiry)
+
+
+# 本进程最近发布的统计快照，值未变化时不重复发布
+STATS_SNAPSHOT_MAX_USERS = 10000
+published_stats = OrderedDict()
+published_stats_lock = threading.Lock()
+
+
+def publish_stats_snapshot(user_id):
+    """
+    重新计算用户的统计快照，与上次发布的值不同时作为保留消息发布，
+    之后订阅该用户统计主题的客户端立即收到最新值 (由 stats_debouncer 在任务变化后调用)
+    """
+    with app.app_context(), user_shard(user_id):
+        stats = compute_user_stats(user_id)
+    with published_stats_lock:
+        if published_stats.get(user_id) == stats:
+            return
+        published_stats[user_id] = stats
+        published_stats.move_to_end(user_id)
+        while len(published_stats) > STATS_SNAPSHOT_MAX_USERS:
+            published_stats.popitem(last=False)
+    message = {
+        'event': 'stats_snapshot',
+        'origin': INSTANCE_ID,
+        'user_id': user_id,
+        'timestamp': format_datetime(datetime.utcnow()),
+        'data': stats
+    }
+    publish_mqtt(f'{STATS_TOPIC_PREFIX}/{user_id}', json.dumps(message, ensure_ascii=False),
+                 event_policies.get('stats_snapshot'))
+
+
+# 任务变化后合并发布统计快照: 窗口内同一用户的多次写入只重新计算一次
+stats_debouncer = TrailingDebouncer(
+    'stats', RATE_LIMIT_CONFIG.get('stats_debounce_ms', 2000) / 1000, publish_stats_snapshot,
+    max_keys=STATS_SNAPSHOT_MAX_USERS
+)
+
+
+# ============== 错误处理 ==============
+
+@app.errorhandler(InvalidDatetime)
+def handle_invalid_datetime(e):
+    """日期格式错误统一返回 400"""
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(InvalidHierarchy)
+def handle_invalid_hierarchy(e):
+    """父任务无效 (成环或过深) 返回 400"""
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(InvalidRole)
+def handle_invalid_role(e):
+    """清单角色取值错误返回 400"""
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(InvalidTag)
+def handle_invalid_tag(e):
+    """标签取值错误返回 400"""
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(InvalidPriority)
+def handle_invalid_priority(e):
+    """优先级取值错误返回 400"""
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(ShardUnavailable)
+def handle_shard_unavailable(e):
+    """用户数据迁移中返回 503，客户端稍后重试"""
+    return jsonify({'error': '数据迁移中，请稍后再试'}), 503, {'Retry-After': str(math.ceil(e.retry_after))}
+
+
+# ============== 限流 ==============
+
+# 各类别的令牌桶参数: (每秒补充令牌数, 桶容量)
+DEFAULT_RATE_LIMITS = {
+    'auth': (1, 10),      # 登录/注册，按客户端 IP 计
+    'read': (20, 50),     # 查询接口
+    'write': (10, 30),    # 增删改接口
+    'stream': (0.2, 5),   # SSE 建立连接
+    'mqtt': (5, 20),      # 客户端经 MQTT 发来的同步请求
+}
+
+rate_limiter = RateLimiter({**DEFAULT_RATE_LIMITS, **RATE_LIMIT_CONFIG.get('limits', {})})
+
+# 同步请求去抖: 窗口内重复的请求复用同一份快照
+sync_debouncer = Debouncer('sync', RATE_LIMIT_CONFIG.get('sync_debounce_ms', 2000) / 1000)
+
+# 不参与限流的端点
+RATE_LIMIT_EXEMPT = {None, 'static', 'index', 'get_metrics', 'healthz', 'readyz'}
+
+# 特殊端点的限流类别，其余按请求方法分为 read / write
+RATE_LIMIT_CLASSES = {
+    'register': 'auth',
+    'login': 'auth',
+    'event_stream': 'stream',
+}
+
+
+def rate_limit_class():
+    """当前请求的限流类别，不限流返回 None"""
+    endpoint = request.endpoint
+    if endpoint in RATE_LIMIT_EXEMPT or request.method == 'OPTIONS':
+        return None
+    if endpoint in RATE_LIMIT_CLASSES:
+        return RATE_LIMIT_CLASSES[endpoint]
+    return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+
+@app.before_request
+def enforce_rate_limit():
+    """按用户 (未登录按 IP) 和接口类别限流，超限返回 429"""
+    if not RATE_LIMIT_CONFIG.get('enabled', True):
+        return None
+    limit_class = rate_limit_class()
+    if limit_class is None:
+        return None
+    user_id = session.get('user_id')
+    key = f'user:{user_id}' if user_id and limit_class != 'auth' else f'ip:{request.remote_addr}'
+    allowed, retry_after = rate_limiter.acquire(key, limit_class)
+    if not allowed:
+        return jsonify({'error': '请求过于频繁，请稍后再试'}), 429, {'Retry-After': str(math.ceil(retry_after))}
+    return None
+
+
+def allow_mqtt_message(user_id):
+    """MQTT 入站消息按用户限流"""
+    if not RATE_LIMIT_CONFIG.get('enabled', True) or not user_id:
+        return True
+    return rate_limiter.acquire(f'user:{user_id}', 'mqtt')[0]
 
 
 # ============== 用户认证 API ==============
@@ -259,6 +1373,8 @@ def register():
     
     db.session.add(user)
     db.session.commit()
+    if shard_router:
+        assign_new_user_shard(user.id)
     
     session['user_id'] = user.id
     
@@ -314,86 +1430,454 @@ def get_current_user():
     return jsonify({'user': user.to_dict()})
 
 
+# ============== 任务写回缓冲 ==============
+
+TASK_FIELDS = ('title', 'description', 'completed', 'due_date', 'priority')
+
+
+def apply_task_changes(task, data):
+    """按字段应用任务更新"""
+    if 'title' in data:
+        task.title = data['title']
+    if 'description' in data:
+        task.description = data['description']
+    if 'completed' in data:
+        task.set_completed(data['completed'])
+    if 'due_date' in data:
+        task.due_date = parse_datetime(data['due_date'])
+    if 'priority' in data:
+        task.priority = parse_priority(data['priority'])
+
+
+def check_task_changes(data):
+    """校验任务更新字段，返回错误信息 (无误返回 None)；日期和优先级无效时抛出对应异常"""
+    if 'title' in data:
+        title = data['title']
+        if not isinstance(title, str) or not title.strip():
+            return '任务标题不能为空'
+        if len(title) > 200:
+            return '任务标题不能超过 200 个字符'
+    if 'description' in data and data['description'] is not None and not isinstance(data['description'], str):
+        return '任务描述必须是字符串'
+    if 'completed' in data and not isinstance(data['completed'], (bool, int)):
+        return '完成状态必须是布尔值'
+    parse_datetime(data.get('due_date'))
+    if 'priority' in data:
+        parse_priority(data['priority'])
+    return None
+
+
+# 暂时性错误: 整条记录留在写回缓冲中稍后重试；其余错误说明记录本身无法写入，直接丢弃
+TRANSIENT_WRITE_ERRORS = (OperationalError, ShardUnavailable)
+
+
+def write_task_updates(task_ids, batch):
+    """在当前分片的一个事务内写入 task_ids 的合并更新并提交，返回已写入的任务"""
+    tasks = Task.query.filter(Task.id.in_(task_ids)).all()
+    for task in tasks:
+        user_id, changes = batch[task.id]
+        if task.user_id == user_id:
+            apply_task_changes(task, changes)
+    db.session.commit()
+    return tasks
+
+
+def flush_task_updates(batch):
+    """
+    写回缓冲的批量写入: 每个分片一个事务提交全部合并后的更新，每个任务只广播一次
+
+    分片事务失败时逐条重写，找出无法写入的记录丢弃，同分片的其他记录照常写入；
+    各分片独立提交和广播，一个分片失败不会让已提交的分片重写重播。返回需要重试的任务 ID
+    """
+    retry = []
+    shards = {}
+    with app.app_context():
+        for task_id, (user_id, _) in batch.items():
+            try:
+                shard = shard_router.shard_for(user_id) if shard_router else None
+            except TRANSIENT_WRITE_ERRORS:
+                retry.append(task_id)
+                continue
+            shards.setdefault(shard, []).append(task_id)
+    for shard, task_ids in shards.items():
+        with app.app_context(), shard_scope(shard):
+            try:
+                tasks = write_task_updates(task_ids, batch)
+            except TRANSIENT_WRITE_ERRORS as e:
+                db.session.rollback()
+                print(f"[写回] 分片 {shard or DEFAULT_SHARD} 暂时无法写入: {e}")
+                retry.extend(task_ids)
+                continue
+            except Exception:
+                db.session.rollback()
+                tasks = []
+                for task_id in task_ids:
+                    try:
+                        tasks.extend(write_task_updates([task_id], batch))
+                    except TRANSIENT_WRITE_ERRORS:
+                        db.session.rollback()
+                        retry.append(task_id)
+                    except Exception as e:
+                        db.session.rollback()
+                        task_write_buffer.dropped(task_id, 'invalid', e)
+            for task in tasks:
+                publish_update('task_updated', task.to_dict(), list_id=task.list_id)
+    return retry
+
+
+def overlay_pending_updates(tasks):
+    """读取时叠加尚未写入的更新 (调用方需在序列化后回滚会话)"""
+    with db.session.no_autoflush:
+        for task in tasks:
+            changes = task_write_buffer.pending(task.id)
+            if changes:
+                apply_task_changes(task, changes)
+
+
+task_write_buffer = None
+if WRITE_BEHIND_CONFIG.get('enabled'):
+    from backend.write_behind import WriteBehindBuffer
+    task_write_buffer = WriteBehindBuffer(
+        flush_task_updates,
+        window=WRITE_BEHIND_CONFIG.get('window_ms', 500) / 1000.0,
+        max_pending=WRITE_BEHIND_CONFIG.get('max_pending', 1000),
+        durability=WRITE_BEHIND_CONFIG.get('durability', 'memory'),
+        journal_path=WRITE_BEHIND_CONFIG.get('journal_path', 'write_behind.journal'),
+        max_retries=WRITE_BEHIND_CONFIG.get('max_retries', 5)
+    )
+    # 进程退出前写入剩余更新
+    atexit.register(task_write_buffer.close)
+
+
+# ============== 标签索引 ==============
+
+def load_task_tags(user_id):
+    """从数据库加载用户全部 (任务 ID, 标签名)，走 ix_task_tag_user_tag"""
+    return db.session.execute(
+        db.select(TaskTag.task_id, Tag.name)
+        .join(Tag, Tag.id == TaskTag.tag_id)
+        .where(TaskTag.user_id == user_id)
+    ).all()
+
+
+tag_index = TagIndexCache(load_task_tags)
+
+
+def set_task_tags(task, names):
+    """把任务的标签整体设为 names (随调用方的事务提交，提交后再更新 tag_index)，不存在的标签自动创建"""
+    tags = {}
+    if names:
+        tags = {tag.name: tag for tag in Tag.query.filter(Tag.user_id == task.user_id, Tag.name.in_(names))}
+    for name in names:
+        if name not in tags:
+            tags[name] = Tag(user_id=task.user_id, name=name)
+            db.session.add(tags[name])
+    db.session.flush()
+    TaskTag.query.filter_by(task_id=task.id).delete(synchronize_session=False)
+    if names:
+        db.session.execute(TaskTag.__table__.insert(), [
+            {'task_id': task.id, 'tag_id': tags[name].id, 'user_id': task.user_id} for name in names
+        ])
+    # 标签随任务数据同步，刷新更新时间后增量同步才能拉取到
+    task.updated_at = datetime.utcnow()
+
+
+def touch_tagged_tasks(tag_id):
+    """标签改名或删除时刷新带有该标签的任务的更新时间 (一条 UPDATE)"""
+    db.session.execute(
+        db.update(Task)
+        .where(Task.id.in_(db.select(TaskTag.task_id).where(TaskTag.tag_id == tag_id)))
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
 # ============== 任务 API ==============
 
+# sort 参数对应的排序，均有匹配的索引 (user_id 开头)
+TASK_SORTS = {
+    'created': lambda query: query.order_by(Task.created_at.desc()),
+    'priority': lambda query: query.order_by(Task.priority.desc(), Task.created_at.desc()),
+    'smart': lambda query: query.order_by(Task.completed, Task.smart_rank),
+}
+
+
+def query_sorted_tasks(user_id, sort, task_ids=None):
+    """按 sort 查询用户的任务，task_ids 不为 None 时只取其中的任务"""
+    query = Task.query.filter_by(user_id=user_id, list_id=None)
+    if task_ids is not None:
+        if not task_ids:
+            return []
+        query = query.filter(Task.id.in_(task_ids))
+    if sort == 'due':
+        # 有截止时间的按截止时间升序 (走 ix_task_user_due)，其余排在后面
+        return (
+            query.filter(Task.due_date.isnot(None)).order_by(Task.due_date).all()
+            + query.filter(Task.due_date.is_(None)).order_by(Task.created_at.desc()).all()
+        )
+    return TASK_SORTS[sort](query).all()
+
+
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    """获取当前用户的所有任务"""
+    """
+    获取当前用户的所有任务，sort 可选 created (默认) / priority / due / smart
+    
+    tags=a,b 只返回带有这些标签的任务: mode=and (默认) 要求全部标签，mode=or 任一标签，
+    由标签位图索引求出任务 ID，不做关联查询
+    """
     user_id = session.get('user_id')
     
     if not user_id:
         return jsonify({'error': '未登录'}), 401
     
-    tasks = Task.query.filter_by(user_id=user_id).order_by(Task.created_at.desc()).all()
+    sort = request.args.get('sort', 'created')
+    if sort not in TASK_SORTS and sort != 'due':
+        return jsonify({'error': f'无效的排序方式: {sort}'}), 400
+    
+    mode = request.args.get('mode', 'and')
+    if mode not in TAG_MODES:
+        return jsonify({'error': f'无效的标签匹配方式: {mode}'}), 400
+    
+    task_ids = None
+    tag_names = parse_tag_names(request.args.get('tags'))
+    if tag_names:
+        task_ids = tag_index.query(user_id, lambda index: index.match(tag_names, mode))
+    
+    tasks = query_sorted_tasks(user_id, sort, task_ids)
+    
+    if task_write_buffer:
+        overlay_pending_updates(tasks)
+        result = [t.to_dict() for t in tasks]
+        db.session.rollback()
+    else:
+        result = [t.to_dict() for t in tasks]
     
     return jsonify({
-        'tasks': [t.to_dict() for t in tasks]
+        'tasks': result
     })
 
 
-@app.route('/api/tasks', methods=['POST'])
-def create_task():
-    """创建新任务"""
+@app.route('/api/tasks/changes', methods=['GET'])
+def get_task_changes():
+    """
+    增量同步: 返回 since 之后更新过的任务和删除的任务 ID，以及下次请求用的 revision
+    
+    - 不带 since 或 since 早于墓碑保留期时返回全量 (reset 为 true)，客户端应替换本地缓存
+    - has_more 为 true 时用返回的 revision 继续拉取
+    - revision 比当前时间提前 overlap_seconds 秒，覆盖请求期间尚未提交的写入，
+      客户端会重复收到少量任务，按 ID 覆盖即可
+    """
     user_id = session.get('user_id')
     
     if not user_id:
         return jsonify({'error': '未登录'}), 401
     
-    data = request.get_json()
+    since = parse_datetime(request.args.get('since'))
+    limit = min(max(request.args.get('limit', SYNC_CONFIG.get('page_size', 500), type=int), 1), 1000)
+    now = datetime.utcnow()
+    safe_revision = now - timedelta(seconds=SYNC_CONFIG.get('overlap_seconds', 2))
+    
+    reset = since is None or since < now - timedelta(days=SYNC_CONFIG.get('tombstone_days', 30))
+    if not reset:
+        tasks = Task.query.filter(
+            Task.user_id == user_id, Task.list_id.is_(None), Task.updated_at >= since
+        ).order_by(Task.updated_at, Task.id).limit(limit + 1).all()
+        has_more = len(tasks) > limit
+        if has_more:
+            tasks = tasks[:limit]
+            # 下一页从本页最后一条的更新时间开始 (含边界，重复的任务按 ID 覆盖)
+            revision = tasks[-1].updated_at
+            # 超过一页的任务更新时间完全相同时无法分页，改为全量
+            reset = revision <= since
+        else:
+            revision = max(safe_revision, since)
+    
+    if reset:
+        tasks = Task.query.filter_by(user_id=user_id, list_id=None).order_by(Task.created_at.desc()).all()
+        return jsonify({
+            'tasks': [t.to_dict() for t in tasks],
+            'deleted': [],
+            'revision': format_datetime(safe_revision),
+            'has_more': False,
+            'reset': True
+        })
     
-    task = Task(
-        user_id=user_id,
-        title=data.get('title'),
-        description=data.get('description'),
-        due_date=parse_datetime(data.get('due_date')),
-        priority=data.get('priority', 'normal')
+    deleted = db.select(TaskTombstone.id).where(
+        TaskTombstone.user_id == user_id, TaskTombstone.deleted_at >= since
     )
+    if has_more:
+        deleted = deleted.where(TaskTombstone.deleted_at <= revision)
     
-    db.session.add(task)
-    db.session.commit()
+    return jsonify({
+        'tasks': [t.to_dict() for t in tasks],
+        'deleted': db.session.execute(deleted).scalars().all(),
+        'revision': format_datetime(revision),
+        'has_more': has_more,
+        'reset': False
+    })
+
+
+@app.route('/api/tasks/next', methods=['GET'])
+def get_next_tasks():
+    """接下来要做的任务: 未完成任务按智能排序取前 limit 条，直接按索引顺序读取"""
+    user_id = session.get('user_id')
     
-    # 通过 MQTT 广播新任务
-    publish_update('task_created', task.to_dict())
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 100)
+    tasks = Task.query.filter_by(user_id=user_id, list_id=None, completed=False).order_by(
+        Task.smart_rank
+    ).limit(limit).all()
     
     return jsonify({
-        'message': '任务创建成功',
-        'task': task.to_dict()
-    }), 201
+        'tasks': [t.to_dict() for t in tasks]
+    })
 
 
-@app.route('/api/tasks/<int:task_id>', methods=['PUT'])
-def update_task(task_id):
-    """更新任务"""
+@app.route('/api/tasks/archive', methods=['GET'])
+def get_archived_tasks():
+    """分页获取已归档任务，按完成时间倒序"""
     user_id = session.get('user_id')
     
     if not user_id:
         return jsonify({'error': '未登录'}), 401
     
-    task = Task.query.get(task_id)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
     
-    if not task:
-        return jsonify({'error': '任务不存在'}), 404
+    # 多取一条判断是否还有下一页，避免 count(*)
+    rows = TaskArchive.query.filter_by(user_id=user_id).order_by(
+        TaskArchive.completed_at.desc(), TaskArchive.id.desc()
+    ).offset((page - 1) * per_page).limit(per_page + 1).all()
     
-    if task.user_id != user_id:
-        return jsonify({'error': '无权限'}), 403
+    return jsonify({
+        'tasks': [t.to_dict() for t in rows[:per_page]],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(rows) > per_page
+    })
+
+
+def load_task_for(task_id, user_id, list_id=None, role='editor'):
+    """
+    读取用户有权操作的任务，返回 (任务, 错误响应)
     
-    data = request.get_json()
+    个人任务要求属于本人；共享清单中的任务要求在该清单中的角色不低于 role
+    (成员缓存命中时不查库)。个人接口不能操作清单中的任务，反之亦然。
+    """
+    if list_id is not None and not list_members.allows(list_id, user_id, role):
+        return None, (jsonify({'error': '无权限'}), 403)
     
-    if 'title' in data:
-        task.title = data['title']
-    if 'description' in data:
-        task.description = data['description']
-    if 'completed' in data:
-        task.completed = data['completed']
-    if 'due_date' in data:
-        task.due_date = datetime.fromisoformat(data['due_date']) if data['due_date'] else None
-    if 'priority' in data:
-        task.priority = data['priority']
+    task = Task.query.get(task_id)
     
+    if not task or task.list_id != list_id:
+        return None, (jsonify({'error': '任务不存在'}), 404)
+    
+    if list_id is None and task.user_id != user_id:
+        return None, (jsonify({'error': '无权限'}), 403)
+    
+    return task, None
+
+
+@app.route('/api/tasks', methods=['POST'])
+@app.route('/api/lists/<int:list_id>/tasks', methods=['POST'])
+def create_task(list_id=None):
+    """创建新任务 (个人任务或共享清单中的任务)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    owner_id = user_id
+    if list_id is not None:
+        if not list_members.allows(list_id, user_id, 'editor'):
+            return jsonify({'error': '无权限'}), 403
+        # 清单中的任务归清单所有者，与清单的其他任务在同一分片
+        owner_id = list_members.owner(list_id)
+    
+    data = request.get_json()
+    
+    tag_names = parse_tag_names(data.get('tags'))
+    if tag_names and list_id is not None:
+        return jsonify({'error': '共享清单中的任务不支持标签'}), 400
+    
+    parent = None
+    if data.get('parent_id') is not None:
+        parent = Task.query.get(data['parent_id'])
+        if not parent or parent.user_id != owner_id or parent.list_id != list_id:
+            return jsonify({'error': '父任务不存在'}), 404
+        if parent.depth + 1 > hierarchy.MAX_DEPTH:
+            return jsonify({'error': f'任务层级不能超过 {hierarchy.MAX_DEPTH} 层'}), 400
+    
+    task = Task(
+        user_id=owner_id,
+        list_id=list_id,
+        title=data.get('title'),
+        description=data.get('description'),
+        due_date=parse_datetime(data.get('due_date')),
+        priority=parse_priority(data.get('priority')),
+        parent_id=parent.id if parent else None,
+        depth=parent.depth + 1 if parent else 0
+    )
+    
+    db.session.add(task)
+    # 路径包含自身 ID，写入后才能确定
+    db.session.flush()
+    task.path = (hierarchy.child_path(parent.path, task.id) if parent
+                 else hierarchy.root_path(task.id))
+    if tag_names:
+        set_task_tags(task, tag_names)
+    db.session.commit()
+    if tag_names:
+        tag_index.set(task.user_id, task.id, tag_names)
+    
+    # 通过 MQTT 广播新任务
+    publish_update('task_created', task.to_dict(), list_id=list_id)
+    
+    return jsonify({
+        'message': '任务创建成功',
+        'task': task.to_dict()
+    }), 201
+
+
+@app.route('/api/tasks/<int:task_id>', methods=['PUT'])
+@app.route('/api/lists/<int:list_id>/tasks/<int:task_id>', methods=['PUT'])
+def update_task(task_id, list_id=None):
+    """更新任务"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    task, error = load_task_for(task_id, user_id, list_id, 'editor')
+    if error:
+        return error
+    
+    data = request.get_json()
+    changes = {k: data[k] for k in TASK_FIELDS if k in data}
+    message = check_task_changes(changes)
+    if message:
+        return jsonify({'error': message}), 400
+    
+    if task_write_buffer:
+        # 写回模式: 校验后合并进缓冲，窗口结束时批量写入并广播
+        merged = task_write_buffer.submit(task_id, task.user_id, changes)
+        with db.session.no_autoflush:
+            apply_task_changes(task, merged)
+            result = task.to_dict()
+        db.session.rollback()
+        return jsonify({
+            'message': '任务更新已接受',
+            'task': result
+        }), 202
+    
+    apply_task_changes(task, data)
     db.session.commit()
     
     # 通过 MQTT 广播更新
-    publish_update('task_updated', task.to_dict())
+    publish_update('task_updated', task.to_dict(), list_id=list_id)
     
     return jsonify({
         'message': '任务更新成功',
@@ -402,34 +1886,532 @@ def update_task(task_id):
 
 
 @app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
-def delete_task(task_id):
+@app.route('/api/lists/<int:list_id>/tasks/<int:task_id>', methods=['DELETE'])
+def delete_task(task_id, list_id=None):
     """删除任务"""
     user_id = session.get('user_id')
     
     if not user_id:
         return jsonify({'error': '未登录'}), 401
     
+    task, error = load_task_for(task_id, user_id, list_id, 'editor')
+    if error:
+        return error
+    
+    # 连同所有子任务一起删除: 一次范围查询取出子树，一次批量删除
+    subtree = Task.query.filter(Task.user_id == task.user_id, subtree_filter(task.path)).all()
+    deleted_ids = [t.id for t in subtree]
+    task_data = task.to_dict()
+    if list_id is None:
+        TaskTag.query.filter(TaskTag.task_id.in_(deleted_ids)).delete(synchronize_session=False)
+    for t in subtree:
+        db.session.delete(t)
+    if list_id is None:
+        # 墓碑供个人任务的增量同步使用
+        add_task_tombstones([(t.id, user_id) for t in subtree])
+    db.session.commit()
+    if list_id is None:
+        tag_index.remove(user_id, deleted_ids)
+    if task_write_buffer:
+        for deleted_id in deleted_ids:
+            task_write_buffer.discard(deleted_id)
+    
+    # 通过 MQTT 广播删除: 整个子树只发一条
+    if len(deleted_ids) == 1:
+        publish_update('task_deleted', task_data, list_id=list_id)
+    else:
+        publish_update('task_subtree_deleted', {
+            'user_id': task_data['user_id'],
+            'task_id': task_id,
+            'task_ids': deleted_ids
+        }, list_id=list_id)
+    
+    return jsonify({
+        'message': '任务删除成功',
+        'task_id': task_id,
+        'deleted_ids': deleted_ids
+    })
+
+
+@app.route('/api/tasks/<int:task_id>/subtree', methods=['GET'])
+@app.route('/api/lists/<int:list_id>/tasks/<int:task_id>/subtree', methods=['GET'])
+def get_task_subtree(task_id, list_id=None):
+    """
+    获取任务的所有后代 (按路径排序，父任务在子任务之前) 及完成数统计
+    
+    counts_only=1 时只返回统计 (一次聚合查询，不取任务行)
+    """
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    task, error = load_task_for(task_id, user_id, list_id, 'viewer')
+    if error:
+        return error
+    
+    descendants = db.and_(
+        Task.user_id == task.user_id, subtree_filter(task.path), Task.id != task.id
+    )
+    if request.args.get('counts_only') in ('1', 'true'):
+        total, completed = db.session.query(
+            db.func.count(Task.id),
+            db.func.sum(db.case((Task.completed == True, 1), else_=0))
+        ).filter(descendants).one()
+        return jsonify({
+            'task_id': task_id,
+            'total': total,
+            'completed': completed or 0
+        })
+    
+    tasks = Task.query.filter(descendants).order_by(Task.path).all()
+    return jsonify({
+        'task': task.to_dict(),
+        'tasks': [t.to_dict() for t in tasks],
+        'total': len(tasks),
+        'completed': sum(1 for t in tasks if t.completed)
+    })
+
+
+@app.route('/api/tasks/<int:task_id>/move', methods=['PUT'])
+@app.route('/api/lists/<int:list_id>/tasks/<int:task_id>/move', methods=['PUT'])
+def move_task(task_id, list_id=None):
+    """把任务连同子任务移到另一个任务之下 (parent_id 为 null 时移为根任务)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    task, error = load_task_for(task_id, user_id, list_id, 'editor')
+    if error:
+        return error
+    
+    data = request.get_json()
+    parent_id = data.get('parent_id')
+    parent = None
+    if parent_id is not None:
+        parent = Task.query.get(parent_id)
+        if not parent or parent.user_id != task.user_id or parent.list_id != list_id:
+            return jsonify({'error': '父任务不存在'}), 404
+    
+    in_subtree = db.and_(Task.user_id == task.user_id, subtree_filter(task.path))
+    height = (db.session.query(db.func.max(Task.depth)).filter(in_subtree).scalar() or task.depth) - task.depth
+    new_path, new_depth = hierarchy.check_move(
+        task.path, height,
+        parent.path if parent else None,
+        parent.depth if parent else None
+    )
+    old_path, depth_delta = task.path, new_depth - task.depth
+    
+    # 一条 UPDATE 改写整个子树的路径前缀和深度；更新时间一并刷新，增量同步可拉取到
+    result = db.session.execute(
+        db.update(Task).where(in_subtree).values(
+            path=db.literal(new_path) + db.func.substr(Task.path, len(old_path) + 1),
+            depth=Task.depth + depth_delta,
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        db.update(Task).where(Task.id == task_id).values(parent_id=parent_id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    
     task = Task.query.get(task_id)
+    task_data = task.to_dict()
+    
+    # 整个子树只广播一条，客户端按路径前缀改写本地缓存
+    publish_update('task_subtree_moved', {
+        'user_id': task_data['user_id'],
+        'task': task_data,
+        'old_path': old_path,
+        'new_path': new_path,
+        'depth_delta': depth_delta,
+        'count': result.rowcount
+    }, list_id=list_id)
+    
+    return jsonify({
+        'message': '任务移动成功',
+        'task': task_data,
+        'moved': result.rowcount
+    })
+
+
+@app.route('/api/tasks/<int:task_id>/tags', methods=['PUT'])
+def set_tags(task_id):
+    """设置任务的标签 (整体替换)，不存在的标签自动创建"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
     
-    if not task:
-        return jsonify({'error': '任务不存在'}), 404
+    task, error = load_task_for(task_id, user_id)
+    if error:
+        return error
+    
+    data = request.get_json()
+    names = parse_tag_names(data.get('tags'))
+    set_task_tags(task, names)
+    db.session.commit()
+    tag_index.set(user_id, task_id, names)
+    
+    publish_update('task_updated', task.to_dict())
+    
+    return jsonify({
+        'message': '标签已更新',
+        'task': task.to_dict()
+    })
+
+
+# ============== 标签 API ==============
+
+@app.route('/api/tags', methods=['GET'])
+def get_tags():
+    """获取当前用户的标签及各标签的任务数 (计数来自位图索引)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    tags = Tag.query.filter_by(user_id=user_id).order_by(Tag.name).all()
+    counts = tag_index.query(user_id, lambda index: index.counts())
+    
+    return jsonify({
+        'tags': [tag.to_dict(counts.get(tag.name, 0)) for tag in tags]
+    })
+
+
+@app.route('/api/tags/<int:tag_id>', methods=['PUT'])
+def rename_tag(tag_id):
+    """标签改名"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    tag = db.session.get(Tag, tag_id)
+    
+    if not tag or tag.user_id != user_id:
+        return jsonify({'error': '标签不存在'}), 404
+    
+    data = request.get_json()
+    name = data.get('name')
+    if not isinstance(name, str) or not name.strip():
+        return jsonify({'error': '标签名称不能为空'}), 400
+    name = parse_tag_names([name])[0]
     
-    if task.user_id != user_id:
+    if name != tag.name and Tag.query.filter_by(user_id=user_id, name=name).first():
+        return jsonify({'error': '标签已存在'}), 409
+    
+    old_name = tag.name
+    tag.name = name
+    touch_tagged_tasks(tag_id)
+    db.session.commit()
+    tag_index.rename(user_id, old_name, name)
+    
+    # 只发一条标签事件，客户端收到后增量同步受影响的任务
+    publish_update('tag_updated', {
+        'user_id': user_id,
+        'tag': tag.to_dict(),
+        'old_name': old_name
+    })
+    
+    return jsonify({
+        'message': '标签已更新',
+        'tag': tag.to_dict()
+    })
+
+
+@app.route('/api/tags/<int:tag_id>', methods=['DELETE'])
+def delete_tag(tag_id):
+    """删除标签 (从所有任务上移除)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    tag = db.session.get(Tag, tag_id)
+    
+    if not tag or tag.user_id != user_id:
+        return jsonify({'error': '标签不存在'}), 404
+    
+    name = tag.name
+    touch_tagged_tasks(tag_id)
+    TaskTag.query.filter_by(tag_id=tag_id).delete(synchronize_session=False)
+    db.session.delete(tag)
+    db.session.commit()
+    tag_index.drop_tag(user_id, name)
+    
+    publish_update('tag_deleted', {
+        'user_id': user_id,
+        'tag_id': tag_id,
+        'name': name
+    })
+    
+    return jsonify({
+        'message': '标签已删除',
+        'tag_id': tag_id
+    })
+
+
+# ============== 共享清单 API ==============
+
+def list_members_changed(list_id, owner_id):
+    """成员变化: 本进程立即失效缓存，其他进程收到清单事件后失效"""
+    list_members.invalidate(list_id)
+    publish_update('list_members_changed', {
+        'user_id': owner_id,
+        'list_id': list_id
+    }, list_id=list_id)
+
+
+@app.route('/api/lists', methods=['GET'])
+def get_lists():
+    """获取当前用户所在的共享清单及其角色"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    rows = db.session.execute(
+        db.select(TaskList, ListMember.role)
+        .join(ListMember, ListMember.list_id == TaskList.id)
+        .where(ListMember.user_id == user_id)
+        .order_by(TaskList.created_at)
+    ).all()
+    
+    return jsonify({
+        'lists': [task_list.to_dict(role) for task_list, role in rows]
+    })
+
+
+@app.route('/api/lists', methods=['POST'])
+def create_list():
+    """创建共享清单，创建者为所有者"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    data = request.get_json()
+    name = (data.get('name') or '').strip()
+    
+    if not name:
+        return jsonify({'error': '清单名称不能为空'}), 400
+    
+    task_list = TaskList(name=name[:100], owner_id=user_id)
+    db.session.add(task_list)
+    db.session.flush()
+    db.session.add(ListMember(list_id=task_list.id, user_id=user_id, role='owner'))
+    db.session.commit()
+    list_members.invalidate(task_list.id)
+    
+    return jsonify({
+        'message': '清单创建成功',
+        'list': task_list.to_dict('owner')
+    }), 201
+
+
+@app.route('/api/lists/<int:list_id>', methods=['DELETE'])
+def delete_list(list_id):
+    """删除共享清单及其中的全部任务 (仅所有者)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    if not list_members.allows(list_id, user_id, 'owner'):
         return jsonify({'error': '无权限'}), 403
     
-    task_data = task.to_dict()
-    db.session.delete(task)
+    # 清单任务在所有者的分片，成员与清单在主库
+    deleted_ids = db.session.execute(
+        db.select(Task.id).where(Task.user_id == user_id, Task.list_id == list_id)
+    ).scalars().all()
+    db.session.execute(
+        db.delete(Task).where(Task.user_id == user_id, Task.list_id == list_id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(db.delete(ListMember).where(ListMember.list_id == list_id))
+    db.session.execute(db.delete(TaskList).where(TaskList.id == list_id))
     db.session.commit()
+    if task_write_buffer:
+        for deleted_id in deleted_ids:
+            task_write_buffer.discard(deleted_id)
     
-    # 通过 MQTT 广播删除
-    publish_update('task_deleted', task_data)
+    list_members.invalidate(list_id)
+    publish_update('list_deleted', {
+        'user_id': user_id,
+        'list_id': list_id,
+        'task_ids': deleted_ids
+    }, list_id=list_id)
     
     return jsonify({
-        'message': '任务删除成功',
-        'task_id': task_id
+        'message': '清单删除成功',
+        'list_id': list_id
     })
 
 
+@app.route('/api/lists/<int:list_id>/members', methods=['GET'])
+def get_list_members(list_id):
+    """获取清单成员"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    if not list_members.allows(list_id, user_id, 'viewer'):
+        return jsonify({'error': '无权限'}), 403
+    
+    rows = db.session.execute(
+        db.select(ListMember, User.username)
+        .join(User, User.id == ListMember.user_id)
+        .where(ListMember.list_id == list_id)
+        .order_by(ListMember.joined_at)
+    ).all()
+    
+    return jsonify({
+        'members': [{
+            'user_id': member.user_id,
+            'username': username,
+            'role': member.role,
+            'joined_at': format_datetime(member.joined_at)
+        } for member, username in rows]
+    })
+
+
+@app.route('/api/lists/<int:list_id>/members', methods=['POST'])
+def add_list_member(list_id):
+    """添加成员或修改成员角色 (仅所有者)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    if not list_members.allows(list_id, user_id, 'owner'):
+        return jsonify({'error': '无权限'}), 403
+    
+    data = request.get_json()
+    role = parse_role(data.get('role'))
+    user = User.query.filter_by(username=data.get('username')).first()
+    
+    if not user:
+        return jsonify({'error': '用户不存在'}), 404
+    
+    if user.id == user_id:
+        return jsonify({'error': '不能修改所有者的角色'}), 400
+    
+    member = db.session.get(ListMember, (list_id, user.id))
+    if member:
+        member.role = role
+    else:
+        db.session.add(ListMember(list_id=list_id, user_id=user.id, role=role))
+    db.session.commit()
+    list_members_changed(list_id, user_id)
+    
+    return jsonify({
+        'message': '成员已更新',
+        'member': {'user_id': user.id, 'username': user.username, 'role': role}
+    })
+
+
+@app.route('/api/lists/<int:list_id>/members/<int:member_id>', methods=['DELETE'])
+def remove_list_member(list_id, member_id):
+    """移除成员 (所有者可移除任何成员，成员可以退出)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    owner_id = list_members.owner(list_id)
+    if member_id != user_id and owner_id != user_id:
+        return jsonify({'error': '无权限'}), 403
+    
+    if member_id == owner_id:
+        return jsonify({'error': '不能移除清单所有者'}), 400
+    
+    member = db.session.get(ListMember, (list_id, member_id))
+    if not member:
+        return jsonify({'error': '成员不存在'}), 404
+    
+    db.session.delete(member)
+    db.session.commit()
+    list_members_changed(list_id, owner_id)
+    
+    return jsonify({
+        'message': '成员已移除',
+        'user_id': member_id
+    })
+
+
+@app.route('/api/lists/<int:list_id>/tasks', methods=['GET'])
+def get_list_tasks(list_id):
+    """获取共享清单中的任务"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    if not list_members.allows(list_id, user_id, 'viewer'):
+        return jsonify({'error': '无权限'}), 403
+    
+    tasks = Task.query.filter_by(list_id=list_id).order_by(Task.created_at.desc()).all()
+    
+    if task_write_buffer:
+        overlay_pending_updates(tasks)
+        result = [t.to_dict() for t in tasks]
+        db.session.rollback()
+    else:
+        result = [t.to_dict() for t in tasks]
+    
+    return jsonify({
+        'list_id': list_id,
+        'tasks': result
+    })
+
+
+# ============== 事件推送 API ==============
+
+@app.route('/api/events/stream', methods=['GET'])
+def event_stream():
+    """SSE 事件流，断线重连时浏览器自动携带 Last-Event-ID"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    # 事件 ID 形如 "<进程实例>-<序号>"，由推送中心判断能否续传
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or None
+    
+    # 同时订阅所在共享清单的频道 (加入新清单后需重连才能收到)
+    list_ids = db.session.execute(
+        db.select(ListMember.list_id).where(ListMember.user_id == user_id)
+    ).scalars().all()
+    subscriber = event_hub.subscribe(user_id, last_event_id, [list_channel(i) for i in list_ids])
+    
+    return Response(event_hub.stream(subscriber), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+# ============== 日历区间索引 ==============
+
+def load_calendar_spans(user_id):
+    """从数据库加载用户全部事件的有效区间"""
+    rows = db.session.query(
+        CalendarEvent.id, CalendarEvent.start_time, CalendarEvent.end_time, CalendarEvent.all_day
+    ).filter(CalendarEvent.user_id == user_id).all()
+    return [(event_id, *event_span(start, end, all_day)) for event_id, start, end, all_day in rows]
+
+
+calendar_index = IntervalIndexCache(load_calendar_spans)
+
+
+def index_calendar_event(event):
+    """写接口调用: 增量更新已缓存的区间索引"""
+    calendar_index.update(event.user_id, event.id, *event_span(event.start_time, event.end_time, event.all_day))
+
+
 # ============== 日历 API ==============
 
 @app.route('/api/calendar', methods=['GET'])
@@ -446,9 +2428,9 @@ def get_calendar_events():
     query = CalendarEvent.query.filter_by(user_id=user_id)
     
     if start_date:
-        query = query.filter(CalendarEvent.start_time >= datetime.fromisoformat(start_date))
+        query = query.filter(CalendarEvent.start_time >= parse_datetime(start_date))
     if end_date:
-        query = query.filter(CalendarEvent.end_time <= datetime.fromisoformat(end_date))
+        query = query.filter(CalendarEvent.end_time <= parse_datetime(end_date))
     
     events = query.all()
     
@@ -467,6 +2449,9 @@ def create_calendar_event():
     
     data = request.get_json()
     
+    if not data.get('start_time'):
+        return jsonify({'error': '开始时间不能为空'}), 400
+    
     event = CalendarEvent(
         user_id=user_id,
         title=data.get('title'),
@@ -479,6 +2464,7 @@ def create_calendar_event():
     
     db.session.add(event)
     db.session.commit()
+    index_calendar_event(event)
     
     return jsonify({
         'message': '事件创建成功',
@@ -509,15 +2495,18 @@ def update_calendar_event(event_id):
     if 'description' in data:
         event.description = data['description']
     if 'start_time' in data:
-        event.start_time = datetime.fromisoformat(data['start_time'])
+        if not data['start_time']:
+            return jsonify({'error': '开始时间不能为空'}), 400
+        event.start_time = parse_datetime(data['start_time'])
     if 'end_time' in data:
-        event.end_time = datetime.fromisoformat(data['end_time']) if data['end_time'] else None
+        event.end_time = parse_datetime(data['end_time'])
     if 'all_day' in data:
         event.all_day = data['all_day']
     if 'color' in data:
         event.color = data['color']
     
     db.session.commit()
+    index_calendar_event(event)
     
     return jsonify({
         'message': '事件更新成功',
@@ -543,6 +2532,7 @@ def delete_calendar_event(event_id):
     
     db.session.delete(event)
     db.session.commit()
+    calendar_index.remove(user_id, event_id)
     
     return jsonify({
         'message': '事件删除成功',
@@ -550,6 +2540,57 @@ def delete_calendar_event(event_id):
     })
 
 
+@app.route('/api/calendar/conflicts', methods=['GET'])
+def get_calendar_conflicts():
+    """获取时间重叠的事件对，可指定 event_id 只查该事件的冲突，或用 start/end 限定范围"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    event_id = request.args.get('event_id', type=int)
+    if event_id is not None:
+        event = CalendarEvent.query.get(event_id)
+        if not event or event.user_id != user_id:
+            return jsonify({'error': '事件不存在'}), 404
+        span = event_span(event.start_time, event.end_time, event.all_day)
+        ids = calendar_index.query(user_id, lambda index: index.overlaps(*span, exclude=event_id))
+        return jsonify({'event_id': event_id, 'conflicts': ids})
+    
+    start = parse_datetime(request.args.get('start'))
+    end = parse_datetime(request.args.get('end'))
+    pairs = calendar_index.query(user_id, lambda index: index.conflicts(start, end))
+    
+    return jsonify({
+        'conflicts': [sorted(pair) for pair in pairs]
+    })
+
+
+@app.route('/api/calendar/free', methods=['GET'])
+def get_calendar_free_slots():
+    """查找空闲时段: duration 为分钟数，after/before 限定范围 (默认从当前时间开始)"""
+    user_id = session.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
+    
+    duration = request.args.get('duration', type=int)
+    if not duration or duration <= 0:
+        return jsonify({'error': 'duration 必须为正整数 (分钟)'}), 400
+    
+    after = parse_datetime(request.args.get('after')) or datetime.utcnow()
+    before = parse_datetime(request.args.get('before'))
+    limit = min(max(request.args.get('limit', 1, type=int), 1), 50)
+    
+    slots = calendar_index.query(
+        user_id, lambda index: index.free_slots(after, timedelta(minutes=duration), before, limit)
+    )
+    
+    return jsonify({
+        'slots': [{'start': format_datetime(s), 'end': format_datetime(e)} for s, e in slots]
+    })
+
+
 # ============== 统计 API ==============
 
 @app.route('/api/stats', methods=['GET'])
@@ -560,28 +2601,124 @@ def get_stats():
     if not user_id:
         return jsonify({'error': '未登录'}), 401
     
-    total_tasks = Task.query.filter_by(user_id=user_id).count()
-    completed_tasks = Task.query.filter_by(user_id=user_id, completed=True).count()
-    pending_tasks = total_tasks - completed_tasks
+    return jsonify(compute_user_stats(user_id))
+
+
+def compute_user_stats(user_id):
+    """用户的任务统计 (当前分片)"""
+    # 今日到期任务按时间范围比较，可以使用索引
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    tomorrow = today + timedelta(days=1)
+    
+    # 单次聚合查询代替多次 count
+    total_tasks, completed_tasks, due_today, high_priority = db.session.query(
+        db.func.count(Task.id),
+        db.func.sum(db.case((Task.completed == True, 1), else_=0)),
+        db.func.sum(db.case((db.and_(Task.due_date >= today, Task.due_date < tomorrow), 1), else_=0)),
+        db.func.sum(db.case((db.and_(Task.priority == 'high', Task.completed == False), 1), else_=0))
+    ).filter(Task.user_id == user_id, Task.list_id.is_(None)).one()
+    completed_tasks = completed_tasks or 0
+    
+    # 归档任务均已完成，计数来自 archive_summary
+    summary = db.session.get(ArchiveSummary, user_id)
+    archived_tasks = summary.task_count if summary else 0
+    
+    return {
+        'total_tasks': total_tasks + archived_tasks,
+        'completed_tasks': completed_tasks + archived_tasks,
+        'pending_tasks': total_tasks - completed_tasks,
+        'archived_tasks': archived_tasks,
+        'due_today': due_today or 0,
+        'high_priority': high_priority or 0
+    }
+
+
+# 趋势统计最多查询的天数
+MAX_TREND_DAYS = 1100
+
+
+@app.route('/api/stats/trends', methods=['GET'])
+def get_stats_trends():
+    """
+    完成趋势: from 到 to (含，UTC 日期) 按 day / week / month 汇总的
+    创建数、完成数、平均完成时长 (小时) 和逾期完成率，只读日汇总表
+    """
+    user_id = session.get('user_id')
     
-    # 今日到期任务
-    today = datetime.utcnow().date()
-    due_today = Task.query.filter_by(user_id=user_id).filter(
-        db.func.date(Task.due_date) == today
-    ).count()
+    if not user_id:
+        return jsonify({'error': '未登录'}), 401
     
-    # 高优先级任务
-    high_priority = Task.query.filter_by(user_id=user_id, priority='high', completed=False).count()
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in TREND_BUCKETS:
+        return jsonify({'error': f'无效的统计周期: {bucket}'}), 400
+    
+    end = parse_datetime(request.args.get('to'))
+    end = end.date() if end else datetime.utcnow().date()
+    start = parse_datetime(request.args.get('from'))
+    start = start.date() if start else end - timedelta(days=29)
+    if start > end:
+        return jsonify({'error': '开始日期不能晚于结束日期'}), 400
+    if (end - start).days >= MAX_TREND_DAYS:
+        return jsonify({'error': f'查询范围不能超过 {MAX_TREND_DAYS} 天'}), 400
+    
+    rows = TaskDailyStats.query.filter(
+        TaskDailyStats.user_id == user_id,
+        TaskDailyStats.day >= start,
+        TaskDailyStats.day <= end
+    ).all()
+    series, totals = build_trends(rows, start, end, bucket)
     
     return jsonify({
-        'total_tasks': total_tasks,
-        'completed_tasks': completed_tasks,
-        'pending_tasks': pending_tasks,
-        'due_today': due_today,
-        'high_priority': high_priority
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'bucket': bucket,
+        'series': series,
+        'totals': totals
     })
 
 
+# ============== 监控 API ==============
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 指标"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ============== 健康检查 API ==============
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活检查: 进程能响应即可"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    就绪检查: 后台服务已启动且数据库可用；require_mqtt 为真时还要求 MQTT 已连接
+
+    服务未启动时在后台线程中启动并立即返回 starting，
+    就绪前负载均衡不会转发业务请求，由探针触发启动才不会卡住
+    """
+    if not services_started:
+        start_services_background()
+    checks = {'services': services_started, 'mqtt': mqtt_connected}
+    try:
+        db.session.execute(text('SELECT 1'))
+        checks['database'] = True
+    except Exception:
+        checks['database'] = False
+    ready = checks['services'] and checks['database'] and (
+        checks['mqtt'] or not STARTUP_CONFIG.get('require_mqtt', False)
+    )
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'checks': checks,
+        'startup': startup_report.as_dict()
+    }), 200 if ready else 503
+
+
 # ============== 前端页面路由 ==============
 
 @app.route('/')
@@ -590,15 +2727,78 @@ def index():
     return app.send_static_file('index.html')
 
 
+# ============== 后台服务 ==============
+
+services_started = False
+_services_lock = threading.Lock()
+
+
+def start_services():
+    """
+    初始化数据库并启动 MQTT 与后台任务 (幂等)
+
+    python app.py 启动时直接调用；flask run 或 WSGI 服务器下由首个请求触发，
+    这样多进程服务器中每个工作进程在 fork 之后各自启动后台线程。
+    """
+    global services_started
+    if services_started:
+        return
+    with _services_lock:
+        if services_started:
+            return
+        with startup_report.phase('init_db'):
+            with app.app_context():
+                init_db()
+        
+        # 初始化 MQTT (后台连接)
+        with startup_report.phase('mqtt_init'):
+            init_mqtt()
+        
+        with startup_report.phase('workers'):
+            # 定期归档已完成任务
+            if ARCHIVE_CONFIG.get('enabled'):
+                start_archive_worker()
+            
+            # 写回缓冲: 重放日志并启动后台写入
+            if task_write_buffer:
+                with app.app_context():
+                    task_write_buffer.start()
+        services_started = True
+    print(startup_report.format())
+
+
+_services_thread = None
+
+
+def start_services_background():
+    """在后台线程中启动服务 (只启动一次)"""
+    global _services_thread
+    with _services_lock:
+        if _services_thread is None:
+            _services_thread = threading.Thread(target=start_services, name='start-services', daemon=True)
+            _services_thread.start()
+
+
+@app.before_request
+def ensure_services():
+    """首个请求时启动后台服务 (存活和就绪检查除外，就绪检查需如实反映启动状态)"""
+    if not services_started and request.endpoint not in ('healthz', 'readyz'):
+        start_services()
+
+
+# 分片路由依赖 shard_assignment 表，需在 ensure_services 之后执行
+app.before_request(route_user_shard)
+
+startup_report.mark('routes')
+
 # ============== 主程序 ==============
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        print("[数据库] 表已创建")
+    start_services()
     
-    # 初始化 MQTT
-    init_mqtt()
+    if task_write_buffer:
+        # SIGTERM 时正常退出，以便 atexit 写入剩余更新
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     
     print("[服务器] 启动中...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,224 @@
+"""
+SSE 推送中心 - Server-Sent Events
+
+后端只保持一个 MQTT 订阅，事件在进程内按用户扇出到各浏览器连接。
+连接还可订阅额外的频道 (如共享清单)，频道事件只写入一次，由订阅该频道的连接共享。
+
+功能:
+- 每个连接一个有界队列，写满即判定为慢消费者并断开 (客户端带 Last-Event-ID 重连)
+- 按用户保存最近事件的环形缓冲，支持 Last-Event-ID 断点续传 (live_events 中的事件只实时推送，
+  不进缓冲: 全量快照等大消息过时即无用，续传时重放只会浪费内存和带宽)
+- 空闲时发送心跳注释，防止代理/负载均衡断开长连接
+
+事件 ID 为 "<进程实例>-<序号>"，序号只在本进程内递增。多进程部署下重连可能落到另一个进程，
+各进程收到事件的顺序不同，序号无法比较: 非本进程的 ID 一律通知客户端全量同步，不会按错误位置续传。
+
+并发限制: stream() 是阻塞生成器，在同步 WSGI 服务器下每个浏览器连接占用一个工作线程直到断开，
+连接数受线程数限制。需要单进程承载大量连接时使用协程式工作进程 (如 gunicorn -k gevent，
+其猴子补丁让 queue/threading 变为协作式)，本模块无需修改。
+"""
+
+import itertools
+import json
+import queue
+import re
+import threading
+from collections import OrderedDict, deque
+
+from backend import metrics
+
+SSE_SUBSCRIBERS = metrics.registry.gauge('todo_sse_subscribers', '当前 SSE 连接数')
+SSE_EVENTS = metrics.registry.counter('todo_sse_events_total', '写入 SSE 推送中心的事件数')
+SSE_EVICTIONS = metrics.registry.counter('todo_sse_evictions_total', '因消费过慢被断开的 SSE 连接数')
+
+# 队列中的断开标记
+_EVICTED = object()
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def peek_fields(text: str, names) -> dict:
+    """
+    读取 JSON 对象开头的若干字段，遇到不在 names 中的字段即停止
+
+    事件消息把路由字段放在大字段 data 之前，转发时无需解析整个快照。
+    格式错误抛出 json.JSONDecodeError。
+    """
+    result = {}
+    i = _whitespace.match(text, 0).end()
+    if text[i:i + 1] != '{':
+        raise json.JSONDecodeError('应为 JSON 对象', text, i)
+    i += 1
+    while len(result) < len(names):
+        i = _whitespace.match(text, i).end()
+        if text[i:i + 1] != '"':
+            break
+        key, i = _decoder.raw_decode(text, i)
+        i = _whitespace.match(text, i).end()
+        if text[i:i + 1] != ':':
+            raise json.JSONDecodeError('应为冒号', text, i)
+        if key not in names:
+            break
+        value, i = _decoder.raw_decode(text, _whitespace.match(text, i + 1).end())
+        result[key] = value
+        i = _whitespace.match(text, i).end()
+        if text[i:i + 1] != ',':
+            break
+        i += 1
+    return result
+
+
+class Subscriber:
+    """单个 SSE 连接，channels 为用户自身及额外订阅的频道"""
+    __slots__ = ('user_id', 'channels', 'queue')
+
+    def __init__(self, user_id, queue_size: int, channels=()):
+        self.user_id = user_id
+        self.channels = (user_id,) + tuple(channels)
+        self.queue = queue.Queue(maxsize=queue_size)
+
+
+class EventHub:
+    """按用户 (或频道) 扇出的事件中心，线程安全；以下 user_id 均可为频道名"""
+
+    def __init__(self, buffer_size: int = 256, queue_size: int = 100,
+                 heartbeat: float = 15, max_users: int = 10000, instance: str = '',
+                 live_events=()):
+        self.instance = instance
+        self.live_events = frozenset(live_events)
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.max_users = max_users
+        self._ids = itertools.count(1)
+        self._last_id = 0               # 最近发出的事件序号
+        self._lock = threading.Lock()
+        self._subscribers = {}          # user_id -> set(Subscriber)
+        self._buffers = OrderedDict()   # user_id -> deque[(事件 ID, SSE 帧)]
+        self._dropped = {}              # user_id -> 已移出缓冲的最大事件 ID
+        self._lru_dropped = 0           # 因用户数超限整体丢弃的最大事件 ID
+
+    def _frame(self, event_id: int, event_type: str, payload: str) -> str:
+        """组装 SSE 帧，每个事件只序列化一次，所有连接共享"""
+        return f'id: {self.instance}-{event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+
+    def parse_event_id(self, value):
+        """Last-Event-ID 中本进程的序号；其他进程的或格式错误的 ID 返回 None"""
+        if isinstance(value, int):
+            return value
+        instance, _, seq = str(value).rpartition('-')
+        if instance != self.instance or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(self, user_id, event_type: str, message: dict = None, payload: str = None) -> int:
+        """推送事件给该用户的所有连接，返回事件 ID；已序列化的消息可直接传 payload"""
+        if payload is None or '\n' in payload or '\r' in payload:
+            # SSE 的 data 行不能含换行
+            payload = json.dumps(message if message is not None else json.loads(payload), ensure_ascii=False)
+        evicted = []
+        with self._lock:
+            event_id = self._last_id = next(self._ids)
+            frame = self._frame(event_id, event_type, payload)
+            if event_type not in self.live_events:
+                self._remember(user_id, event_id, frame)
+            for sub in self._subscribers.get(user_id, ()):
+                try:
+                    sub.queue.put_nowait(frame)
+                except queue.Full:
+                    evicted.append(sub)
+        SSE_EVENTS.inc()
+        for sub in evicted:
+            self._evict(sub)
+        return event_id
+
+    def _remember(self, user_id, event_id: int, frame: str):
+        """写入该用户的续传缓冲 (需持有锁)"""
+        buffer = self._buffers.get(user_id)
+        if buffer is None:
+            buffer = self._buffers[user_id] = deque(maxlen=self.buffer_size)
+            if len(self._buffers) > self.max_users:
+                old_user, old_buffer = self._buffers.popitem(last=False)
+                self._dropped.pop(old_user, None)
+                if old_buffer:
+                    self._lru_dropped = max(self._lru_dropped, old_buffer[-1][0])
+        else:
+            self._buffers.move_to_end(user_id)
+        if len(buffer) == self.buffer_size:
+            self._dropped[user_id] = buffer[0][0]
+        buffer.append((event_id, frame))
+
+    def subscribe(self, user_id, last_event_id=None, channels=()) -> Subscriber:
+        """
+        注册连接 (同时订阅 channels)，有 last_event_id 时按事件 ID 顺序补发各缓冲中之后的事件
+
+        last_event_id 为客户端传来的字符串 (或本进程的序号)，不是本进程发出的则通知全量同步
+        """
+        sub = Subscriber(user_id, self.queue_size, channels)
+        if last_event_id is not None:
+            seq = self.parse_event_id(last_event_id)
+            last_event_id = seq if seq is not None else -1
+        with self._lock:
+            if last_event_id is not None:
+                dropped = 0
+                missed = []
+                for channel in sub.channels:
+                    buffer = self._buffers.get(channel)
+                    if buffer is None:
+                        dropped = max(dropped, self._lru_dropped)
+                    else:
+                        dropped = max(dropped, self._dropped.get(channel, 0))
+                        missed.extend(item for item in buffer if item[0] > last_event_id)
+                missed = [frame for _, frame in sorted(missed, key=lambda item: item[0])]
+                # 断点之后的事件已被移出缓冲或 ID 来自其他进程，无法完整续传，通知客户端全量同步
+                if last_event_id < 0 or last_event_id < dropped or len(missed) > self.queue_size - 1:
+                    # 带上本进程当前的 ID: 全量同步后再断线重连到本进程可以正常续传
+                    missed = [self._frame(self._last_id, 'resync', '{}')]
+                for frame in missed:
+                    sub.queue.put_nowait(frame)
+            for channel in sub.channels:
+                self._subscribers.setdefault(channel, set()).add(sub)
+        SSE_SUBSCRIBERS.inc()
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        """注销连接"""
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs is None or sub not in subs:
+                return
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[channel]
+        SSE_SUBSCRIBERS.dec()
+
+    def _evict(self, sub: Subscriber):
+        """断开慢消费者: 清空队列并放入断开标记"""
+        self.unsubscribe(sub)
+        SSE_EVICTIONS.inc()
+        try:
+            while True:
+                sub.queue.get_nowait()
+        except queue.Empty:
+            pass
+        sub.queue.put_nowait(_EVICTED)
+
+    def stream(self, sub: Subscriber):
+        """生成 SSE 响应体"""
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    frame = sub.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if frame is _EVICTED:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(sub)
@@ -0,0 +1,51 @@
+"""
+任务层级 (物化路径)
+
+每个任务保存从根到自身的 ID 路径，如 /3/17/42/，深度为路径中的祖先数。
+子树 (含自身) 即路径以该前缀开头的任务，用区间条件 [前缀, 前缀末尾 '/' 换成 '0')
+表示，配合 (user_id, path) 索引一次范围扫描取出，不需要逐层递归查询。
+路径只含数字和 '/'，'0' 是 '/' 之后的下一个字符，因此区间内恰好是该前缀的所有后代。
+"""
+
+SEPARATOR = '/'
+# 最大深度 (根任务为 0)，限制路径长度
+MAX_DEPTH = 32
+PATH_LENGTH = 500
+
+
+class InvalidHierarchy(ValueError):
+    """父任务无效: 会形成环或超过最大深度"""
+
+
+def root_path(task_id) -> str:
+    return f'{SEPARATOR}{task_id}{SEPARATOR}'
+
+
+def child_path(parent_path: str, task_id) -> str:
+    return f'{parent_path}{task_id}{SEPARATOR}'
+
+
+def subtree_bounds(path: str):
+    """子树 (含自身) 的路径区间 [lower, upper)"""
+    return path, path[:-1] + '0'
+
+
+def in_subtree(path: str, root: str) -> bool:
+    return path.startswith(root)
+
+
+def check_move(path: str, subtree_height: int, parent_path, parent_depth):
+    """
+    校验把 path 对应的子树移到 parent_path 之下 (None 为移到根)，返回新的 (路径前缀, 深度)
+
+    subtree_height 为子树中最深任务与子树根的深度差
+    """
+    task_id = path.rstrip(SEPARATOR).rsplit(SEPARATOR, 1)[-1]
+    if parent_path is None:
+        return root_path(task_id), 0
+    if in_subtree(parent_path, path):
+        raise InvalidHierarchy('不能移动到自身或子任务之下')
+    depth = parent_depth + 1
+    if depth + subtree_height > MAX_DEPTH:
+        raise InvalidHierarchy(f'任务层级不能超过 {MAX_DEPTH} 层')
+    return child_path(parent_path, task_id), depth
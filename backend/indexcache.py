@@ -0,0 +1,91 @@
+"""
+按用户缓存的内存索引
+
+首次访问时通过 loader(user_id) 从数据库构建，之后由写接口在提交后增量更新；
+超过 ttl 秒的条目重新构建，兼容多进程部署下其他进程的写入。
+
+构建在锁外执行 (一次数据库查询)，期间该用户的增量更新会被记录下来，
+构建完成后重放到新索引上: 查询开始后才提交的写入不会因为条目尚未缓存而丢失。
+增量更新都是 "设为某状态" 的幂等操作，已包含在查询结果中的写入重放一次也无妨。
+构建期间被失效 (其他进程的写入) 的结果只用于本次查询，不缓存。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_INVALIDATED = object()
+
+
+class UserIndexCache:
+    """用户 -> 索引的 LRU 缓存，index_class(loader(user_id)) 构建索引"""
+
+    index_class = None
+
+    def __init__(self, loader, max_users: int = 1000, ttl: float = 300):
+        self.loader = loader
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> (构建时间, 索引)
+        self._building = {}             # user_id -> [进行中的构建各自记录的更新列表]
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            pending = []
+            self._building.setdefault(user_id, []).append(pending)
+        try:
+            index = self.index_class(self.loader(user_id))
+        except BaseException:
+            with self._lock:
+                self._end_build(user_id, pending)
+            raise
+        # 结束构建与写入缓存在同一锁内，中间不会漏掉增量更新
+        with self._lock:
+            self._end_build(user_id, pending)
+            if _INVALIDATED in pending:
+                return index
+            for fn in pending:
+                fn(index)
+            self._entries[user_id] = (time.monotonic(), index)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return index
+
+    def _end_build(self, user_id, pending):
+        # 按身份移除: 内容相同的列表 (例如都为空) 互相相等
+        builds = [p for p in self._building[user_id] if p is not pending]
+        self._building[user_id] = builds
+        if not builds:
+            del self._building[user_id]
+
+    def _apply(self, user_id, fn):
+        """增量更新: 应用到已缓存的索引，并记录给进行中的构建"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                fn(entry[1])
+            for pending in self._building.get(user_id, ()):
+                pending.append(fn)
+
+    def query(self, user_id, fn):
+        """在锁内对该用户的索引执行只读查询 fn(index)"""
+        index = self.get(user_id)
+        with self._lock:
+            return fn(index)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                builds = [p for pendings in self._building.values() for p in pendings]
+            else:
+                self._entries.pop(user_id, None)
+                builds = self._building.get(user_id, ())
+            for pending in builds:
+                pending.append(_INVALIDATED)
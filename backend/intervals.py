@@ -0,0 +1,127 @@
+"""
+日历区间索引
+
+按开始时间排序的区间集合，配合 "最长区间长度" 上界剪枝:
+与 [s, e) 重叠的区间开始时间必然落在 [s - 最长区间, e) 内，
+查询只需一次二分加上候选扫描，避免逐对比较。
+
+区间均为左闭右开 [start, end)，[a, b) 与 [c, d) 重叠当且仅当 a < d 且 c < b。
+"""
+
+import heapq
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from backend.indexcache import UserIndexCache
+
+ALL_DAY = timedelta(days=1)
+# 无结束时间的非全天事件按最小时长占用
+MIN_SPAN = timedelta(minutes=1)
+
+
+def event_span(start, end, all_day=False):
+    """日历事件的有效区间: 无结束时间时全天事件持续一天，其余按最小时长"""
+    if end is None or end <= start:
+        end = start + (ALL_DAY if all_day and end is None else MIN_SPAN)
+    return start, end
+
+
+class IntervalIndex:
+    """单个用户的事件区间索引"""
+
+    def __init__(self, items=()):
+        self._order = []            # [(start, id)] 按开始时间排序
+        self._spans = {}            # id -> (start, end)
+        self._max_length = timedelta(0)
+        for item_id, start, end in items:
+            self._spans[item_id] = (start, end)
+            self._max_length = max(self._max_length, end - start)
+        self._order = sorted((start, item_id) for item_id, (start, _) in self._spans.items())
+
+    def __len__(self):
+        return len(self._spans)
+
+    def add(self, item_id, start, end):
+        """新增或更新区间"""
+        self.remove(item_id)
+        self._spans[item_id] = (start, end)
+        insort(self._order, (start, item_id))
+        # 上界只增不减，删除长区间后仍然正确，只是剪枝稍弱
+        self._max_length = max(self._max_length, end - start)
+
+    def remove(self, item_id):
+        """删除区间"""
+        span = self._spans.pop(item_id, None)
+        if span is None:
+            return
+        i = bisect_left(self._order, (span[0], item_id))
+        if i < len(self._order) and self._order[i] == (span[0], item_id):
+            del self._order[i]
+
+    def _scan(self, start):
+        """从可能覆盖 start 的第一个候选开始按开始时间遍历"""
+        order = self._order
+        for i in range(bisect_left(order, (start - self._max_length,)), len(order)):
+            item_start, item_id = order[i]
+            yield item_id, item_start, self._spans[item_id][1]
+
+    def overlaps(self, start, end, exclude=None):
+        """返回与 [start, end) 重叠的区间 ID"""
+        result = []
+        for item_id, item_start, item_end in self._scan(start):
+            if item_start >= end:
+                break
+            if item_end > start and item_id != exclude:
+                result.append(item_id)
+        return result
+
+    def conflicts(self, start=None, end=None):
+        """
+        返回所有重叠的区间对 [(id1, id2), ...]
+
+        扫描线: 按开始时间遍历，小顶堆维护尚未结束的区间，复杂度 O(n log n + k)
+        """
+        pairs = []
+        active = []     # [(end, id)]
+        items = self._scan(start) if start is not None else (
+            (item_id, s, self._spans[item_id][1]) for s, item_id in self._order
+        )
+        for item_id, item_start, item_end in items:
+            if end is not None and item_start >= end:
+                break
+            while active and active[0][0] <= item_start:
+                heapq.heappop(active)
+            if start is None or item_end > start:
+                pairs.extend((other_id, item_id) for _, other_id in active)
+                heapq.heappush(active, (item_end, item_id))
+        return pairs
+
+    def free_slots(self, after, duration, before=None, limit=1):
+        """返回 after 之后 (before 之前) 长度不小于 duration 的空闲时段"""
+        slots = []
+        cursor = after
+        for _, item_start, item_end in self._scan(after):
+            if before is not None and item_start >= before:
+                break
+            if item_end <= cursor:
+                continue
+            if item_start - cursor >= duration:
+                slots.append((cursor, item_start))
+                if len(slots) >= limit:
+                    return slots
+            cursor = max(cursor, item_end)
+        if before is None or before - cursor >= duration:
+            slots.append((cursor, before))
+        return slots[:limit]
+
+
+class IntervalIndexCache(UserIndexCache):
+    """按用户缓存的区间索引，写接口提交后调用 update / remove 增量更新"""
+
+    index_class = IntervalIndex
+
+    def update(self, user_id, item_id, start, end):
+        self._apply(user_id, lambda index: index.add(item_id, start, end))
+
+    def remove(self, user_id, item_id):
+        self._apply(user_id, lambda index: index.remove(item_id))
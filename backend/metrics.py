@@ -0,0 +1,385 @@
+"""
+监控指标 - Prometheus 文本格式
+
+功能:
+- Counter / Gauge / Histogram 指标注册表
+- 请求级埋点: 接口延迟、SQL 次数与耗时、序列化耗时
+- 采样剖析器: 慢请求导出火焰图兼容的折叠栈 (folded stacks)
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 默认延迟分桶 (秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Metric:
+    """指标基类"""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 标签不匹配: {sorted(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """瞬时值，可绑定取值函数"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """渲染时调用 fn() 取值"""
+        self._functions[self._key(labels)] = fn
+
+    def render(self):
+        for key, fn in list(self._functions.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().render()
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'todo_http_request_duration_seconds', 'HTTP 请求耗时', ('endpoint', 'method', 'status'))
+REQUEST_SQL_QUERIES = registry.histogram(
+    'todo_http_request_sql_queries', '单次请求执行的 SQL 数量', ('endpoint',),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+REQUEST_SQL_SECONDS = registry.histogram(
+    'todo_http_request_sql_seconds', '单次请求的 SQL 总耗时', ('endpoint',))
+REQUEST_SERIALIZE_SECONDS = registry.histogram(
+    'todo_http_request_serialize_seconds', '单次请求的序列化耗时', ('endpoint',))
+SQL_QUERIES = registry.counter('todo_sql_queries_total', 'SQL 执行总数')
+MQTT_PUBLISHED = registry.counter('todo_mqtt_published_total', 'MQTT 发布消息数', ('topic',))
+MQTT_RECEIVED = registry.counter('todo_mqtt_received_total', 'MQTT 接收消息数', ('topic',))
+MQTT_PUBLISH_LATENCY = registry.histogram(
+    'todo_mqtt_publish_ack_seconds', 'MQTT 发布到收到确认的耗时')
+MQTT_HANDLE_LATENCY = registry.histogram(
+    'todo_mqtt_handle_seconds', 'MQTT 消息处理耗时', ('topic',))
+MQTT_DROPPED = registry.counter('todo_mqtt_dropped_total', '超过大小上限被丢弃的 MQTT 消息数', ('topic',))
+MQTT_INFLIGHT = registry.gauge('todo_mqtt_inflight_messages', '等待确认的 MQTT 消息数')
+PROFILES_WRITTEN = registry.counter('todo_profiles_written_total', '已导出的慢请求剖析数')
+
+
+# ============== 请求级埋点 ==============
+
+def _sql_before(conn, cursor, statement, parameters, context, executemany):
+    # 开始时间记在本次执行的上下文上: 语句失败时随上下文丢弃，不会残留在池化连接中
+    if context is not None:
+        context.metrics_query_start = time.perf_counter()
+
+
+def _sql_after(conn, cursor, statement, parameters, context, executemany):
+    SQL_QUERIES.inc()
+    start = getattr(context, 'metrics_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context() and 'metrics_sql_count' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_seconds += elapsed
+
+
+def add_serialize_time(seconds: float):
+    """累加当前请求的序列化耗时"""
+    if has_request_context() and 'metrics_serialize' in g:
+        g.metrics_serialize += seconds
+
+
+def timed_serializer(fn):
+    """装饰 to_dict 等序列化方法，计入当前请求的序列化耗时"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add_serialize_time(time.perf_counter() - start)
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def topic_label(topic):
+    """
+    主题的指标标签: 数字层级 (用户 ID、清单 ID) 折叠为 +，
+    如 todo/stats/42 -> todo/stats/+，避免每个用户或清单各占一条时间序列
+    """
+    if topic is None:
+        return topic
+    return '/'.join('+' if level.isdigit() else level for level in topic.split('/'))
+
+
+def observe_mqtt(kind: str, topic: str = None, seconds: float = None):
+    """MqttClient.metrics_callback 的接收函数"""
+    topic = topic_label(topic)
+    if kind == 'publish':
+        MQTT_PUBLISHED.inc(topic=topic)
+    elif kind == 'ack':
+        MQTT_PUBLISH_LATENCY.observe(seconds)
+    elif kind == 'receive':
+        MQTT_RECEIVED.inc(topic=topic)
+    elif kind == 'handle':
+        MQTT_HANDLE_LATENCY.observe(seconds, topic=topic)
+    elif kind == 'dropped':
+        MQTT_DROPPED.inc(topic=topic)
+
+
+def install(app, profile_slow_ms=None, profile_interval_ms=5, profile_dir='profiles'):
+    """为 Flask 应用安装请求埋点，profile_slow_ms 非空时开启慢请求采样剖析"""
+    if not getattr(Engine, '_todo_metrics_installed', False):
+        event.listen(Engine, 'before_cursor_execute', _sql_before)
+        event.listen(Engine, 'after_cursor_execute', _sql_after)
+        Engine._todo_metrics_installed = True
+
+    profiler = None
+    if profile_slow_ms:
+        profiler = SamplingProfiler(profile_interval_ms / 1000.0, profile_slow_ms / 1000.0, profile_dir)
+
+    json_provider = app.json
+
+    class _TimedJSONProvider(type(json_provider)):
+        def dumps(self, obj, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().dumps(obj, **kwargs)
+            finally:
+                add_serialize_time(time.perf_counter() - start)
+
+    app.json = _TimedJSONProvider(app)
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_serialize = 0.0
+        if profiler:
+            profiler.begin()
+
+    @app.after_request
+    def _metrics_finish(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method,
+                                status=response.status_code)
+        REQUEST_SQL_QUERIES.observe(g.metrics_sql_count, endpoint=endpoint)
+        REQUEST_SQL_SECONDS.observe(g.metrics_sql_seconds, endpoint=endpoint)
+        REQUEST_SERIALIZE_SECONDS.observe(g.metrics_serialize, endpoint=endpoint)
+        if profiler:
+            profiler.end(endpoint, elapsed)
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        # 异常请求不会经过 after_request，这里确保剖析器释放线程
+        if profiler and exc is not None:
+            profiler.end(request.endpoint or 'unknown', 0)
+
+    return profiler
+
+
+# ============== 采样剖析 ==============
+
+class SamplingProfiler:
+    """
+    采样剖析器
+
+    后台线程按固定间隔采样正在处理请求的线程栈，请求耗时超过阈值时
+    以折叠栈格式 (flamegraph.pl / speedscope 可直接读取) 写入 profile_dir。
+    """
+
+    def __init__(self, interval: float, slow_threshold: float, output_dir: str):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.output_dir = output_dir
+        self._active = {}           # 线程 ID -> 栈计数
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = _StackCounter()
+
+    def end(self, endpoint: str, elapsed: float):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if stacks and elapsed >= self.slow_threshold:
+            self._dump(endpoint, elapsed, stacks)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._fold(frame)] += 1
+
+    @staticmethod
+    def _fold(frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    def _dump(self, endpoint: str, elapsed: float, stacks):
+        os.makedirs(self.output_dir, exist_ok=True)
+        filename = f'{time.strftime("%Y%m%d-%H%M%S")}_{endpoint}_{int(elapsed * 1000)}ms.folded'
+        path = os.path.join(self.output_dir, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        PROFILES_WRITTEN.inc()
+        print(f"[剖析] 慢请求 {endpoint} 耗时 {elapsed * 1000:.0f}ms -> {path}")
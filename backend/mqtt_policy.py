@@ -0,0 +1,62 @@
+"""
+MQTT 事件发布策略
+
+按事件类型决定 QoS、消息过期时间 (MQTT 5 Message Expiry Interval，秒) 和是否为保留消息:
+- task_updated 频繁且可由增量同步补齐，用 QoS 0、短过期，不占用代理的确认和离线存储
+- 删除、移动、清单成员和标签变化用 QoS 1、较长过期，持久会话的订阅者重连后仍能收到
+- sync_response 快照只对发起方当时有用，QoS 0、很快过期
+- stats_snapshot 作为保留消息发到每个用户的统计主题，新订阅者立即拿到最新统计
+
+配置 MQTT_EVENT_POLICY 可按事件类型覆盖部分字段，'*' 为未列出事件的默认策略。
+"""
+
+from typing import NamedTuple, Optional
+
+
+class EventPolicy(NamedTuple):
+    qos: int = 1
+    expiry: Optional[int] = None    # None 为不过期
+    retain: bool = False
+
+
+DEFAULT_POLICIES = {
+    '*': EventPolicy(qos=1),
+    'task_created': EventPolicy(qos=1, expiry=3600),
+    'task_updated': EventPolicy(qos=0, expiry=60),
+    'task_deleted': EventPolicy(qos=1, expiry=86400),
+    'task_subtree_deleted': EventPolicy(qos=1, expiry=86400),
+    'task_subtree_moved': EventPolicy(qos=1, expiry=86400),
+    'sync_response': EventPolicy(qos=0, expiry=30),
+    'list_members_changed': EventPolicy(qos=1, expiry=86400),
+    'list_deleted': EventPolicy(qos=1, expiry=86400),
+    'tag_updated': EventPolicy(qos=1, expiry=86400),
+    'tag_deleted': EventPolicy(qos=1, expiry=86400),
+    'stats_snapshot': EventPolicy(qos=1, expiry=86400, retain=True),
+}
+
+
+def parse_policy(value: dict, base: EventPolicy) -> EventPolicy:
+    """用配置中的字段覆盖 base，取值无效时抛出 ValueError (启动时即发现)"""
+    unknown = set(value) - set(EventPolicy._fields)
+    if unknown:
+        raise ValueError(f'未知的策略字段: {", ".join(sorted(unknown))}')
+    policy = base._replace(**value)
+    if policy.qos not in (0, 1, 2):
+        raise ValueError(f'无效的 qos: {policy.qos}')
+    if policy.expiry is not None and (not isinstance(policy.expiry, int) or policy.expiry <= 0):
+        raise ValueError(f'无效的过期时间: {policy.expiry}')
+    return policy._replace(retain=bool(policy.retain))
+
+
+class PolicyTable:
+    """事件类型 -> 发布策略"""
+
+    def __init__(self, overrides: dict = None):
+        self._policies = dict(DEFAULT_POLICIES)
+        for event_type, value in (overrides or {}).items():
+            base = self._policies.get(event_type, self._policies['*'])
+            self._policies[event_type] = parse_policy(value, base)
+        self._default = self._policies['*']
+
+    def get(self, event_type: str) -> EventPolicy:
+        return self._policies.get(event_type, self._default)
@@ -0,0 +1,92 @@
+"""
+共享清单的成员与权限
+
+角色: viewer (只读) < editor (增删改任务) < owner (管理成员、删除清单)
+
+MembershipCache 按清单缓存全部成员: 每个清单一次查询加载，之后的权限检查只是字典查找，
+与清单人数无关。成员变化时本进程立即失效，其他进程收到 MQTT 上的成员变化事件后失效，
+ttl 为兜底。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+ROLES = {'viewer': 0, 'editor': 1, 'owner': 2}
+MEMBER_ROLES = ('viewer', 'editor')
+
+
+class InvalidRole(ValueError):
+    """角色取值无效"""
+
+
+def parse_role(value, default='editor'):
+    """校验可授予成员的角色 (owner 不能授予)"""
+    if value is None or value == '':
+        return default
+    if value not in MEMBER_ROLES:
+        raise InvalidRole(f'无效的角色: {value}，可选 {", ".join(MEMBER_ROLES)}')
+    return value
+
+
+class ListMembers:
+    """单个清单的所有者与成员角色"""
+    __slots__ = ('owner_id', 'roles')
+
+    def __init__(self, owner_id, roles: dict):
+        self.owner_id = owner_id
+        self.roles = roles
+
+
+class MembershipCache:
+    """
+    清单成员缓存
+
+    loader(list_id) 返回 (所有者 ID, {用户 ID: 角色})，清单不存在返回 None (不缓存，
+    否则先查询后创建的清单在 ttl 内对所有者也不可见)
+    """
+
+    def __init__(self, loader, ttl: float = 30, max_lists: int = 10000):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_lists = max_lists
+        self._lock = threading.Lock()
+        self._lists = OrderedDict()     # list_id -> (读取时间, ListMembers)
+
+    def get(self, list_id):
+        """清单成员，清单不存在返回 None"""
+        with self._lock:
+            cached = self._lists.get(list_id)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                self._lists.move_to_end(list_id)
+                return cached[1]
+        loaded = self.loader(list_id)
+        if loaded is None:
+            return None
+        entry = ListMembers(*loaded)
+        with self._lock:
+            self._lists[list_id] = (time.monotonic(), entry)
+            self._lists.move_to_end(list_id)
+            while len(self._lists) > self.max_lists:
+                self._lists.popitem(last=False)
+        return entry
+
+    def owner(self, list_id):
+        entry = self.get(list_id)
+        return entry.owner_id if entry else None
+
+    def role(self, list_id, user_id):
+        entry = self.get(list_id)
+        return entry.roles.get(user_id) if entry else None
+
+    def allows(self, list_id, user_id, required: str = 'viewer') -> bool:
+        """用户在清单中的角色是否不低于 required"""
+        role = self.role(list_id, user_id)
+        return role is not None and ROLES[role] >= ROLES[required]
+
+    def invalidate(self, list_id=None):
+        with self._lock:
+            if list_id is None:
+                self._lists.clear()
+            else:
+                self._lists.pop(list_id, None)
@@ -0,0 +1,70 @@
+"""
+任务优先级与排序
+
+- 优先级在数据库中存为小整数 (low=0, normal=1, high=2)，接口仍使用字符串
+- smart_rank: 写入时计算的 "下一步做什么" 排序键，值越小越靠前
+
+smart_rank 不依赖当前时间: 有截止时间的任务按 "截止时间 - 优先级提前量" 排序，
+过期和临近截止的任务自然排在前面，随时间推移相对顺序不变，
+因此可以在写入时算好并建索引，查询时直接按索引顺序取前 N 条。
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy.types import SmallInteger, TypeDecorator
+
+PRIORITY_LEVELS = {'low': 0, 'normal': 1, 'high': 2}
+PRIORITY_NAMES = {level: name for name, level in PRIORITY_LEVELS.items()}
+DEFAULT_PRIORITY = 'normal'
+
+# 高优先级任务视为提前到期，低优先级视为推后
+PRIORITY_LEAD = {0: timedelta(days=-1), 1: timedelta(0), 2: timedelta(days=2)}
+
+# 无截止时间的任务排在所有有截止时间的任务之后，其中高优先级在前、创建早的在前
+NO_DUE_RANK = 1 << 40
+NO_DUE_PRIORITY_STEP = 1 << 36
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class InvalidPriority(ValueError):
+    """优先级取值无效"""
+
+
+def parse_priority(value):
+    """校验接口传入的优先级，空值视为 normal，返回字符串"""
+    if value is None or value == '':
+        return DEFAULT_PRIORITY
+    if value not in PRIORITY_LEVELS:
+        raise InvalidPriority(f'无效的优先级: {value}，可选 {", ".join(PRIORITY_LEVELS)}')
+    return value
+
+
+class PriorityType(TypeDecorator):
+    """优先级列: Python 侧为字符串，数据库中为小整数，可直接在 SQL 中排序"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return value
+        return PRIORITY_LEVELS[value]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return PRIORITY_NAMES.get(int(value), DEFAULT_PRIORITY)
+
+
+def _seconds(value: datetime) -> int:
+    return int((value - _EPOCH).total_seconds())
+
+
+def smart_rank(due_date, priority, created_at) -> int:
+    """计算排序键 (时间均为 naive UTC)"""
+    level = PRIORITY_LEVELS.get(priority, PRIORITY_LEVELS[DEFAULT_PRIORITY])
+    if due_date is not None:
+        return _seconds(due_date - PRIORITY_LEAD[level])
+    return NO_DUE_RANK - level * NO_DUE_PRIORITY_STEP + _seconds(created_at or datetime.utcnow())
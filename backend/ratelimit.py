@@ -0,0 +1,151 @@
+"""
+限流与去抖
+
+- RateLimiter: 按 (键, 类别) 的令牌桶限流，键通常为用户 ID 或客户端 IP
+- Debouncer: 窗口内对同一键的重复请求复用一次计算结果
+- TrailingDebouncer: 同一键在窗口内的多次触发合并为窗口结束时的一次调用
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from backend import metrics
+
+RATE_LIMIT_ALLOWED = metrics.registry.counter('todo_rate_limit_allowed_total', '限流放行次数', ('limit_class',))
+RATE_LIMIT_REJECTED = metrics.registry.counter('todo_rate_limit_rejected_total', '限流拒绝次数', ('limit_class',))
+DEBOUNCE_HITS = metrics.registry.counter('todo_debounce_hits_total', '去抖窗口内复用结果的次数', ('name',))
+DEBOUNCE_DROPPED = metrics.registry.counter('todo_debounce_dropped_total', '待执行键过多而丢弃的触发次数', ('name',))
+
+
+class RateLimiter:
+    """令牌桶限流器，线程安全，桶数超过 max_keys 时淘汰最久未用的"""
+
+    def __init__(self, limits: dict, max_keys: int = 100000):
+        # limits: 类别 -> (每秒补充令牌数, 桶容量)
+        self.limits = {name: (float(rate), float(burst)) for name, (rate, burst) in limits.items()}
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()   # (键, 类别) -> [令牌数, 更新时间]
+
+    def acquire(self, key, limit_class: str, cost: float = 1.0):
+        """尝试取令牌，返回 (是否放行, 需等待秒数)"""
+        limit = self.limits.get(limit_class)
+        if limit is None:
+            return True, 0.0
+        rate, burst = limit
+        now = time.monotonic()
+        bucket_key = (key, limit_class)
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = [burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket_key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (cost - bucket[0]) / rate
+        if allowed:
+            RATE_LIMIT_ALLOWED.inc(limit_class=limit_class)
+        else:
+            RATE_LIMIT_REJECTED.inc(limit_class=limit_class)
+        return allowed, retry_after
+
+
+class Debouncer:
+    """窗口内复用同一键的计算结果"""
+
+    def __init__(self, name: str, window: float, max_keys: int = 10000):
+        self.name = name
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._results = OrderedDict()   # 键 -> (计算时间, 结果)
+        self._key_locks = {}
+
+    def get_or_compute(self, key, compute):
+        """返回 (结果, 是否新计算)；并发的同键请求只计算一次"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                cached = self._results.get(key)
+                if cached is not None and time.monotonic() - cached[0] < self.window:
+                    DEBOUNCE_HITS.inc(name=self.name)
+                    return cached[1], False
+            stored = False
+            try:
+                result = compute()
+                with self._lock:
+                    self._results[key] = (time.monotonic(), result)
+                    self._results.move_to_end(key)
+                    stored = True
+                    while len(self._results) > self.max_keys:
+                        old_key, _ = self._results.popitem(last=False)
+                        self._key_locks.pop(old_key, None)
+            finally:
+                if not stored:
+                    # 计算失败时不保留键锁，_key_locks 的大小不超过 max_keys
+                    with self._lock:
+                        if self._key_locks.get(key) is key_lock and key not in self._results:
+                            del self._key_locks[key]
+            return result, True
+
+    def invalidate(self, key):
+        """数据变化后丢弃缓存结果"""
+        with self._lock:
+            self._results.pop(key, None)
+            self._key_locks.pop(key, None)
+
+
+class TrailingDebouncer:
+    """
+    同一键在 window 秒内的多次触发合并为一次: 首次触发后 window 秒由后台线程调用 fn(键)
+
+    待执行的键超过 max_keys 时丢弃新触发。后台线程在首次触发时启动 (多进程服务器中位于 fork 之后)。
+    """
+
+    def __init__(self, name: str, window: float, fn, max_keys: int = 10000):
+        self.name = name
+        self.window = window
+        self.fn = fn
+        self.max_keys = max_keys
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # 键 -> 执行时间，窗口相同所以按时间有序
+        self._thread = None
+
+    def trigger(self, key):
+        with self._cond:
+            if key in self._pending:
+                DEBOUNCE_HITS.inc(name=self.name)
+                return
+            if len(self._pending) >= self.max_keys:
+                DEBOUNCE_DROPPED.inc(name=self.name)
+                return
+            self._pending[key] = time.monotonic() + self.window
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'debounce-{self.name}', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, due = next(iter(self._pending.items()))
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                del self._pending[key]
+            try:
+                self.fn(key)
+            except Exception as e:
+                print(f"[去抖] {self.name} 执行失败: {e}")
@@ -0,0 +1,139 @@
+"""
+任务日汇总 (rollup)
+
+每用户每天一行计数，趋势统计只读汇总表，不扫描任务表:
+- created: 当天创建的任务数
+- completed: 当天完成的任务数
+- completion_seconds: 当天完成的任务从创建到完成的总秒数 (求平均用)
+- due / late: 当天完成的任务中有截止时间的数量 / 其中逾期完成的数量 (求逾期率用)
+
+汇总反映任务表与归档表中现存的任务: 写入任务时按 "写入后贡献 - 写入前贡献" 增量更新，
+删除任务时减去其贡献，归档不改变贡献。日期按 UTC 划分。
+完成时间以 completed_at 为准 (旧数据由 init_db 用最后更新时间补齐)。
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import update
+
+ROLLUP_FIELDS = ('created', 'completed', 'completion_seconds', 'due', 'late')
+TREND_BUCKETS = ('day', 'week', 'month')
+
+
+def task_contribution(created_at, completed_at, due_date):
+    """单个任务对日汇总的贡献，返回 {日期: {字段: 计数}}"""
+    result = {}
+    if created_at is not None:
+        result[created_at.date()] = {'created': 1}
+    if completed_at is not None:
+        counts = result.setdefault(completed_at.date(), {})
+        counts['completed'] = 1
+        if created_at is not None:
+            counts['completion_seconds'] = max(int((completed_at - created_at).total_seconds()), 0)
+        if due_date is not None:
+            counts['due'] = 1
+            counts['late'] = int(completed_at > due_date)
+    return result
+
+
+class RollupDelta:
+    """累积 (用户, 日期) -> 各字段增量，最后一次性写入"""
+
+    def __init__(self):
+        self._rows = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+
+    def add(self, user_id, contribution, sign=1):
+        for day, counts in contribution.items():
+            row = self._rows[(user_id, day)]
+            for field, value in counts.items():
+                row[field] += sign * value
+
+    def rows(self):
+        """非零增量 [{'user_id', 'day', 字段...}]"""
+        return [
+            {'user_id': user_id, 'day': day, **counts}
+            for (user_id, day), counts in self._rows.items()
+            if any(counts.values())
+        ]
+
+
+def apply_rollup_delta(connection, table, rows):
+    """
+    把增量加到汇总表 (在调用方的事务内)
+
+    SQLite / PostgreSQL 使用 INSERT ... ON CONFLICT DO UPDATE，其他数据库先 UPDATE 再补 INSERT
+    """
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={field: table.c[field] + stmt.excluded[field] for field in ROLLUP_FIELDS}
+        ), rows)
+        return
+    for row in rows:
+        result = connection.execute(
+            update(table).where(table.c.user_id == row['user_id'], table.c.day == row['day'])
+            .values({field: table.c[field] + row[field] for field in ROLLUP_FIELDS})
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(row))
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    """日期所在统计区间的第一天 (周从周一开始)"""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start: date, bucket: str) -> date:
+    if bucket == 'week':
+        return start + timedelta(days=7)
+    if bucket == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def _summary(counts):
+    completed = counts['completed']
+    return {
+        'created': counts['created'],
+        'completed': completed,
+        'avg_completion_hours': (
+            round(counts['completion_seconds'] / completed / 3600, 2) if completed else None
+        ),
+        'overdue_rate': round(counts['late'] / counts['due'], 4) if counts['due'] else None,
+    }
+
+
+def build_trends(rows, start: date, end: date, bucket: str):
+    """
+    把日汇总行 (day 与 ROLLUP_FIELDS 属性) 合并为按 bucket 划分的序列，
+    没有数据的区间补零，返回 (序列, 合计)
+    """
+    buckets = {}
+    total = dict.fromkeys(ROLLUP_FIELDS, 0)
+    for row in rows:
+        counts = buckets.setdefault(bucket_start(row.day, bucket), dict.fromkeys(ROLLUP_FIELDS, 0))
+        for field in ROLLUP_FIELDS:
+            value = getattr(row, field) or 0
+            counts[field] += value
+            total[field] += value
+
+    series = []
+    current = bucket_start(start, bucket)
+    while current <= end:
+        counts = buckets.get(current) or dict.fromkeys(ROLLUP_FIELDS, 0)
+        series.append({'start': current.isoformat(), **_summary(counts)})
+        current = next_bucket(current, bucket)
+    return series, _summary(total)
@@ -0,0 +1,229 @@
+"""
+按用户分片
+
+用户数据 (任务、日历等) 按 user_id 分布到多个数据库 (本地为多个 SQLite 文件，
+生产环境可为不同的数据库服务器)，主库只保存用户表、分片分配表等全局数据。
+
+- HashRing: 一致性哈希环，新用户按 user_id 落到某个分片，增减分片时只有少量用户需要迁移
+- ShardRouter: 用户 -> 分片的路由，以主库中的分配记录为准，进程内缓存
+- sharded_session: 根据 current_shard 把分片表的读写路由到对应分片库
+- IdAllocator: 分片表的全局 ID 号段，各分片 ID 不重复，迁移用户时保留原 ID
+- copy_user_rows / delete_user_rows: 迁移工具的批量复制与删除
+"""
+
+import hashlib
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect as sa_inspect, select
+from sqlalchemy.sql.util import find_tables
+
+# 主库本身也可作为分片: 没有分配记录的老用户数据都在主库
+DEFAULT_SHARD = 'default'
+
+# 当前上下文 (请求、后台任务) 所用的分片，None 表示主库
+current_shard = ContextVar('current_shard', default=None)
+
+
+class ShardUnavailable(Exception):
+    """用户正在迁移分片，暂时不可读写"""
+
+    def __init__(self, user_id, retry_after: float):
+        super().__init__(f'用户 {user_id} 正在迁移数据')
+        self.user_id = user_id
+        self.retry_after = retry_after
+
+
+@contextmanager
+def shard_scope(shard):
+    """在 with 块内把分片表的读写路由到 shard"""
+    token = current_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        current_shard.reset(token)
+
+
+class HashRing:
+    """一致性哈希环，每个节点放置 vnodes 个虚拟节点以均衡分布"""
+
+    def __init__(self, nodes, vnodes: int = 64):
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise ValueError('哈希环至少需要一个节点')
+        points = sorted(
+            (self._hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get(self, key):
+        """key 顺时针方向的第一个节点"""
+        i = bisect_right(self._keys, self._hash(str(key)))
+        return self._owners[i % len(self._owners)]
+
+
+class ShardRouter:
+    """
+    用户分片路由
+
+    loader(user_id) 返回 (分片名, 是否迁移中)，无分配记录返回 None。
+    缓存 ttl 秒，迁移工具标记迁移后等待 ttl 秒，保证各进程都已看到标记。
+    """
+
+    def __init__(self, shards, loader, vnodes: int = 64, ttl: float = 5, max_users: int = 100000):
+        self.shards = list(shards)
+        self.ring = HashRing(self.shards, vnodes)
+        self.loader = loader
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # user_id -> (读取时间, 分片名, 是否迁移中)
+
+    def all_shards(self):
+        """全部分片，主库总在其中 (老用户数据)"""
+        return [DEFAULT_SHARD] + [shard for shard in self.shards if shard != DEFAULT_SHARD]
+
+    def place(self, user_id):
+        """按哈希环计算用户应在的分片"""
+        return self.ring.get(user_id)
+
+    def lookup(self, user_id):
+        """返回 (分片名, 是否迁移中)"""
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return entry[1], entry[2]
+        shard, moving = self.loader(user_id) or (DEFAULT_SHARD, False)
+        self.remember(user_id, shard, moving)
+        return shard, moving
+
+    def shard_for(self, user_id):
+        """用户所在分片，迁移中抛出 ShardUnavailable"""
+        shard, moving = self.lookup(user_id)
+        if moving:
+            raise ShardUnavailable(user_id, self.ttl)
+        return shard
+
+    def remember(self, user_id, shard, moving=False):
+        with self._lock:
+            self._cache[user_id] = (time.monotonic(), shard, moving)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+
+def sharded_session(sharded_tables):
+    """
+    生成 Flask-SQLAlchemy 会话类: 涉及分片表的语句按 current_shard 选择引擎
+
+    同一会话 (一个应用上下文) 内只应访问一个分片，切换分片前需 db.session.remove()，
+    否则身份映射中可能混入其他分片的同 ID 对象。
+    """
+    sharded_tables = frozenset(sharded_tables)
+
+    def touches_sharded(mapper, clause):
+        if mapper is not None:
+            return sa_inspect(mapper).local_table.name in sharded_tables
+        if clause is not None:
+            return any(getattr(table, 'name', None) in sharded_tables
+                       for table in find_tables(clause, include_crud=True))
+        return False
+
+    class ShardedSession(Session):
+        def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+            shard = current_shard.get()
+            if bind is None and shard not in (None, DEFAULT_SHARD) and touches_sharded(mapper, clause):
+                return self._db.engines[shard]
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    return ShardedSession
+
+
+class IdAllocator:
+    """
+    分片表的全局 ID 号段分配 (hi/lo)
+
+    号段表 (name, next_id) 在主库中，每次取 block 个 ID，进程内依次分配。
+    """
+
+    def __init__(self, engine_getter, table, block: int = 1000):
+        self.engine_getter = engine_getter
+        self.table = table
+        self.block = block
+        self._lock = threading.Lock()
+        self._ranges = {}   # 表名 -> [下一个 ID, 号段上界]
+
+    def seed(self, name, start):
+        """号段起点不存在时写入 (已存在则保持不变)"""
+        with self.engine_getter().begin() as conn:
+            exists = conn.execute(
+                select(self.table.c.next_id).where(self.table.c.name == name)
+            ).first()
+            if exists is None:
+                conn.execute(self.table.insert().values(name=name, next_id=start))
+
+    def next_id(self, name):
+        with self._lock:
+            current = self._ranges.get(name)
+            if current is None or current[0] >= current[1]:
+                current = self._ranges[name] = list(self._reserve(name))
+            value = current[0]
+            current[0] += 1
+            return value
+
+    def _reserve(self, name):
+        table = self.table
+        with self.engine_getter().begin() as conn:
+            conn.execute(
+                table.update().where(table.c.name == name)
+                .values(next_id=table.c.next_id + self.block)
+            )
+            upper = conn.execute(select(table.c.next_id).where(table.c.name == name)).scalar()
+        if upper is None:
+            raise RuntimeError(f'表 {name} 没有 ID 号段，需先初始化分片')
+        return upper - self.block, upper
+
+
+def copy_user_rows(source, target, tables, user_ids):
+    """
+    把用户的行从 source 复制到 target (保留原 ID)，返回复制行数
+
+    先删除 target 中这些用户的行，上次迁移中断后重跑也不会重复
+    """
+    user_ids = list(user_ids)
+    rows = {}
+    with source.connect() as conn:
+        for table in tables:
+            result = conn.execute(table.select().where(table.c.user_id.in_(user_ids)))
+            rows[table.name] = [dict(row._mapping) for row in result]
+    with target.begin() as conn:
+        for table in tables:
+            conn.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+            if rows[table.name]:
+                conn.execute(table.insert(), rows[table.name])
+    return sum(len(table_rows) for table_rows in rows.values())
+
+
+def delete_user_rows(engine, tables, user_ids):
+    """删除用户在 engine 中的行 (迁移完成后清理源分片)"""
+    user_ids = list(user_ids)
+    with engine.begin() as conn:
+        for table in tables:
+            conn.execute(table.delete().where(table.c.user_id.in_(user_ids)))
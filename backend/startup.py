@@ -0,0 +1,58 @@
+"""
+启动耗时统计
+
+按阶段记录后端启动各步骤的耗时，启动完成后打印报告，并由 /readyz 返回，
+便于定位冷启动慢在哪一步。只依赖标准库，以便在其他导入之前开始计时。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """启动阶段耗时记录，线程安全"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self._lock = threading.Lock()
+        self._phases = []   # [(阶段名, 秒)]
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._phases.append((name, seconds))
+
+    def mark(self, name: str):
+        """记录从上一个 mark (或开始计时) 到现在的耗时"""
+        now = time.perf_counter()
+        with self._lock:
+            self._phases.append((name, now - self._last_mark))
+            self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            phases = list(self._phases)
+        return {
+            'total_seconds': round(sum(seconds for _, seconds in phases), 4),
+            'phases': [{'name': name, 'seconds': round(seconds, 4)} for name, seconds in phases]
+        }
+
+    def format(self) -> str:
+        """按耗时从高到低排列的文本报告"""
+        with self._lock:
+            phases = sorted(self._phases, key=lambda item: item[1], reverse=True)
+        total = sum(seconds for _, seconds in phases) or 1e-9
+        lines = [f"[启动] 总耗时 {total * 1000:.1f} ms"]
+        for name, seconds in phases:
+            lines.append(f"  {name:<16} {seconds * 1000:8.1f} ms  {seconds / total:6.1%}")
+        return '\n'.join(lines)
@@ -0,0 +1,189 @@
+"""
+任务标签位图索引
+
+每个用户一份索引: 任务 ID 映射为从 0 开始的紧凑槽位，每个标签一个位图 (Python 整数，
+第 n 位表示槽位 n 的任务带有该标签)。任务 ID 是全局分配的稀疏值，直接按 ID 建位图会很大，
+按用户重新编号后位图只有该用户任务数那么多位；删除任务空出的槽位由新任务复用，位图不会变稀疏。
+
+多标签查询即位图按位与 (and) / 或 (or)，整数运算在 C 中按机器字完成，
+上万个任务的交并只需微秒级，最后只对结果中的置位解码出任务 ID。
+"""
+
+from backend.indexcache import UserIndexCache
+
+TAG_LENGTH = 50
+MAX_TAGS_PER_TASK = 20
+TAG_MODES = ('and', 'or')
+
+
+class InvalidTag(ValueError):
+    """标签取值无效"""
+
+
+def parse_tag_names(value):
+    """
+    校验标签列表 (列表或逗号分隔的字符串)，去除首尾空白和重复，保持原顺序
+
+    空值返回空列表
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        raise InvalidTag('标签必须是列表或逗号分隔的字符串')
+    names = []
+    for item in value:
+        if not isinstance(item, str):
+            raise InvalidTag(f'无效的标签: {item}')
+        name = item.strip()
+        if not name:
+            continue
+        if len(name) > TAG_LENGTH:
+            raise InvalidTag(f'标签不能超过 {TAG_LENGTH} 个字符: {name}')
+        if name not in names:
+            names.append(name)
+    if len(names) > MAX_TAGS_PER_TASK:
+        raise InvalidTag(f'每个任务最多 {MAX_TAGS_PER_TASK} 个标签')
+    return names
+
+
+class TagBitmapIndex:
+    """单个用户的标签位图索引"""
+
+    def __init__(self, rows=()):
+        self._slots = {}        # 任务 ID -> 槽位
+        self._task_ids = []     # 槽位 -> 任务 ID (空位为 None)
+        self._free = []         # 可复用的空槽位
+        self._tags = {}         # 任务 ID -> 标签集合
+        self._bitmaps = {}      # 标签 -> 位图
+        grouped = {}
+        for task_id, tag in rows:
+            grouped.setdefault(task_id, set()).add(tag)
+        for task_id, tags in grouped.items():
+            self.set(task_id, tags)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def _slot(self, task_id):
+        slot = self._slots.get(task_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._task_ids[slot] = task_id
+            else:
+                slot = len(self._task_ids)
+                self._task_ids.append(task_id)
+            self._slots[task_id] = slot
+        return slot
+
+    def set(self, task_id, tags):
+        """设置任务的全部标签 (空集合等同于 remove)"""
+        tags = set(tags)
+        if not tags:
+            self.remove(task_id)
+            return
+        old = self._tags.get(task_id, set())
+        bit = 1 << self._slot(task_id)
+        for tag in old - tags:
+            self._clear(tag, bit)
+        for tag in tags - old:
+            self._bitmaps[tag] = self._bitmaps.get(tag, 0) | bit
+        self._tags[task_id] = tags
+
+    def remove(self, task_id):
+        """移除任务，槽位留给之后的任务复用"""
+        tags = self._tags.pop(task_id, None)
+        slot = self._slots.pop(task_id, None)
+        if slot is None:
+            return
+        bit = 1 << slot
+        for tag in tags or ():
+            self._clear(tag, bit)
+        self._task_ids[slot] = None
+        self._free.append(slot)
+
+    def rename(self, old, new):
+        """标签改名 (或合并到已有标签)"""
+        bitmap = self._bitmaps.pop(old, 0)
+        if not bitmap:
+            return
+        self._bitmaps[new] = self._bitmaps.get(new, 0) | bitmap
+        for task_id in self._decode(bitmap):
+            tags = self._tags[task_id]
+            tags.discard(old)
+            tags.add(new)
+
+    def drop_tag(self, tag):
+        """从所有任务上移除标签"""
+        for task_id in self._decode(self._bitmaps.pop(tag, 0)):
+            tags = self._tags[task_id]
+            tags.discard(tag)
+            if not tags:
+                self.remove(task_id)
+
+    def _clear(self, tag, bit):
+        bitmap = self._bitmaps.get(tag, 0) & ~bit
+        if bitmap:
+            self._bitmaps[tag] = bitmap
+        else:
+            self._bitmaps.pop(tag, None)
+
+    def _decode(self, bitmap):
+        """位图中置位的槽位对应的任务 ID"""
+        task_ids = self._task_ids
+        result = []
+        while bitmap:
+            low = bitmap & -bitmap
+            result.append(task_ids[low.bit_length() - 1])
+            bitmap ^= low
+        return result
+
+    def match(self, tags, mode='and'):
+        """带有全部 (and) 或任一 (or) 标签的任务 ID"""
+        bitmaps = [self._bitmaps.get(tag, 0) for tag in tags]
+        if not bitmaps:
+            return []
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            if mode == 'and':
+                if not result:
+                    break
+                result &= bitmap
+            else:
+                result |= bitmap
+        return self._decode(result)
+
+    def counts(self):
+        """每个标签的任务数"""
+        return {tag: bin(bitmap).count('1') for tag, bitmap in self._bitmaps.items()}
+
+
+class TagIndexCache(UserIndexCache):
+    """
+    按用户缓存的标签位图索引
+
+    loader(user_id) 返回 [(任务 ID, 标签名)]；写接口提交后增量更新，
+    其他进程写入时收到 MQTT 事件后失效，ttl 为兜底。
+    """
+
+    index_class = TagBitmapIndex
+
+    def set(self, user_id, task_id, tags):
+        tags = set(tags)
+        self._apply(user_id, lambda index: index.set(task_id, tags))
+
+    def remove(self, user_id, task_ids):
+        task_ids = list(task_ids)
+
+        def remove_all(index):
+            for task_id in task_ids:
+                index.remove(task_id)
+        self._apply(user_id, remove_all)
+
+    def rename(self, user_id, old, new):
+        self._apply(user_id, lambda index: index.rename(old, new))
+
+    def drop_tag(self, user_id, tag):
+        self._apply(user_id, lambda index: index.drop_tag(tag))
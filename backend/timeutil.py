@@ -0,0 +1,67 @@
+"""
+日期时间编解码
+
+约定: 数据库中统一存储不带时区的 UTC 时间 (naive UTC)。
+- 带时区的输入 (Z / +08:00) 换算为 UTC 后去掉时区
+- 不带时区的输入视为 UTC，原样存储
+"""
+
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+
+class InvalidDatetime(ValueError):
+    """日期时间格式无效"""
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _parse_fast(value: str):
+    """快速路径: ...Z 结尾的 UTC 时间 (前端 toISOString 的格式)，去掉 Z 即为 naive UTC"""
+    if value[-1:] != 'Z':
+        return None
+    try:
+        parsed = datetime.fromisoformat(value[:-1])
+    except ValueError:
+        return None
+    # 形如 +08:00Z 的混合写法不合法
+    return parsed if parsed.tzinfo is None else None
+
+
+@lru_cache(maxsize=4096)
+def _parse_str(value: str) -> datetime:
+    parsed = _parse_fast(value)
+    if parsed is not None:
+        return parsed
+    if value.endswith('Z'):
+        raise InvalidDatetime(f'日期格式无效: {value}')
+    try:
+        return _to_naive_utc(datetime.fromisoformat(value))
+    except ValueError:
+        raise InvalidDatetime(f'日期格式无效: {value}') from None
+
+
+def parse_datetime(value):
+    """
+    解析 ISO 8601 日期时间，返回 naive UTC datetime
+
+    空值返回 None，格式无效抛出 InvalidDatetime
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return _to_naive_utc(value)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if not isinstance(value, str):
+        raise InvalidDatetime(f'日期格式无效: {value!r}')
+    return _parse_str(value.strip())
+
+
+def format_datetime(value):
+    """序列化为 ISO 8601 字符串 (UTC，不带时区后缀)，空值返回 None"""
+    return value.isoformat() if value is not None else None
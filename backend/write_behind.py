@@ -0,0 +1,228 @@
+"""
+写回缓冲 (write-behind)
+
+短时间窗口内对同一记录的多次更新按字段合并，窗口结束后由 flush_fn
+批量写入并只广播一次。
+
+flush_fn(batch) 返回需要重试的键 (暂时性失败，如数据库不可用、用户迁移中)，
+无法写入的记录由 flush_fn 自行丢弃并报告；单条记录失败不影响同批的其他记录。
+重试超过 max_retries 次的记录同样丢弃，不会一直占住缓冲。
+
+持久性 (durability):
+- memory: 仅内存，进程崩溃会丢失窗口内的更新
+- journal: 每次提交追加写入日志文件，重启时重放
+- fsync: 同 journal，且每次提交后 fsync
+"""
+
+import json
+import os
+import threading
+import time
+
+from backend import metrics
+
+WRITE_BEHIND_PENDING = metrics.registry.gauge('todo_write_behind_pending', '写回缓冲中待写入的记录数')
+WRITE_BEHIND_MERGED = metrics.registry.counter('todo_write_behind_merged_total', '被合并掉的更新次数')
+WRITE_BEHIND_FLUSHES = metrics.registry.counter('todo_write_behind_flushes_total', '批量写入次数')
+WRITE_BEHIND_DROPPED = metrics.registry.counter(
+    'todo_write_behind_dropped_total', '无法写入而丢弃的更新数', ('reason',))
+
+
+class WriteBehindBuffer:
+    """按记录合并更新的写回缓冲，线程安全"""
+
+    def __init__(self, flush_fn, window: float = 0.5, max_pending: int = 1000,
+                 durability: str = 'memory', journal_path: str = 'write_behind.journal',
+                 max_retries: int = 5):
+        if durability not in ('memory', 'journal', 'fsync'):
+            raise ValueError(f'未知的持久性级别: {durability}')
+        self.flush_fn = flush_fn
+        self.window = window
+        self.max_pending = max_pending
+        self.durability = durability
+        self.journal_path = journal_path
+        self.max_retries = max_retries
+        self._pending = {}              # key -> (user_id, 合并后的字段)
+        self._retries = {}              # key -> 已失败的写入次数
+        self._first_at = None           # 当前窗口第一条更新的时间
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._journal = None
+        self._unconfirmed = []          # 已轮转、尚未确认写入的日志文件
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        """重放日志并启动后台写入线程"""
+        if self.durability != 'memory':
+            self._replay()
+            self.flush()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, key, user_id, changes: dict) -> dict:
+        """合并一次更新，返回该记录当前全部待写入字段"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('写回缓冲已关闭')
+            self._append_journal(key, user_id, changes)
+            entry = self._pending.get(key)
+            if entry is None:
+                merged = dict(changes)
+                if not self._pending:
+                    self._first_at = time.monotonic()
+            else:
+                merged = {**entry[1], **changes}
+                WRITE_BEHIND_MERGED.inc()
+            self._pending[key] = (user_id, merged)
+            WRITE_BEHIND_PENDING.set(len(self._pending))
+            self._wakeup.notify()
+            return dict(merged)
+
+    def pending(self, key):
+        """返回记录的待写入字段，无则返回 None"""
+        with self._lock:
+            entry = self._pending.get(key)
+            return dict(entry[1]) if entry else None
+
+    def discard(self, key):
+        """丢弃记录的待写入更新 (如记录已被删除)"""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._retries.pop(key, None)
+            WRITE_BEHIND_PENDING.set(len(self._pending))
+
+    @staticmethod
+    def dropped(key, reason, error=None):
+        """报告无法写入而丢弃的记录 (供 flush_fn 调用)"""
+        WRITE_BEHIND_DROPPED.inc(reason=reason)
+        print(f"[写回] 丢弃记录 {key} 的更新 ({reason}): {error}")
+
+    def _append_journal(self, key, user_id, changes):
+        """追加一条日志 (需持有 _lock)"""
+        if self._journal is not None:
+            self._journal.write(json.dumps({'key': key, 'user_id': user_id, 'changes': changes}) + '\n')
+            self._journal.flush()
+            if self.durability == 'fsync':
+                os.fsync(self._journal.fileno())
+
+    def flush(self):
+        """立即写入全部待写入更新"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._first_at = None
+                WRITE_BEHIND_PENDING.set(0)
+                self._rotate_journal()
+            try:
+                retry = set(self.flush_fn(batch) or ())
+            except Exception as e:
+                # flush_fn 本身出错 (不应发生): 整批按暂时性失败处理，受重试次数限制
+                print(f"[写回] 批量写入失败: {e}")
+                retry = set(batch)
+            with self._lock:
+                self._requeue({key: batch[key] for key in retry if key in batch})
+                for key in batch:
+                    if key not in retry:
+                        self._retries.pop(key, None)
+                # 重试的更新已重新写入当前日志，之前轮转的日志可以确认
+                for path in self._unconfirmed:
+                    os.remove(path)
+                self._unconfirmed = []
+            WRITE_BEHIND_FLUSHES.inc()
+            return len(batch) - len(retry)
+
+    def _requeue(self, failed):
+        """暂时性失败的记录放回缓冲，已有的较新更新优先 (需持有 _lock)"""
+        for key, (user_id, changes) in failed.items():
+            attempts = self._retries.get(key, 0) + 1
+            if attempts > self.max_retries:
+                self._retries.pop(key, None)
+                self.dropped(key, 'retries', f'{self.max_retries} 次写入均失败')
+                continue
+            self._retries[key] = attempts
+            newer = self._pending.get(key)
+            merged = {**changes, **newer[1]} if newer else changes
+            self._pending[key] = (user_id, merged)
+            self._append_journal(key, user_id, merged)
+        if self._pending and self._first_at is None:
+            self._first_at = time.monotonic()
+        WRITE_BEHIND_PENDING.set(len(self._pending))
+
+    def close(self):
+        """停止后台线程并写入剩余更新 (进程退出时调用)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                # 等到窗口结束或缓冲超过上限
+                remaining = self.window - (time.monotonic() - self._first_at)
+                if remaining > 0 and len(self._pending) < self.max_pending:
+                    self._wakeup.wait(remaining)
+                    continue
+            self.flush()
+
+    def _rotate_journal(self):
+        """将当前日志改名为待确认文件，写入成功后删除 (需持有 _lock)"""
+        if self._journal is None:
+            return
+        self._journal.close()
+        rotated = f'{self.journal_path}.{time.time_ns()}.flushing'
+        os.replace(self.journal_path, rotated)
+        self._unconfirmed.append(rotated)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        """
+        启动时恢复未写入的日志: 合并后写入新日志再删除旧文件，之后按正常流程写入 (失败可重试)
+        """
+        directory = os.path.dirname(os.path.abspath(self.journal_path))
+        base = os.path.basename(self.journal_path)
+        files = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(base + '.') and name.endswith('.flushing')
+        )
+        if os.path.exists(self.journal_path):
+            files.append(self.journal_path)
+        for path in files:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue    # 崩溃时写了一半的最后一行
+                    entry = self._pending.get(record['key'])
+                    merged = {**entry[1], **record['changes']} if entry else record['changes']
+                    self._pending[record['key']] = (record['user_id'], merged)
+        replay_path = f'{self.journal_path}.replay'
+        with open(replay_path, 'w', encoding='utf-8') as f:
+            for key, (user_id, changes) in self._pending.items():
+                f.write(json.dumps({'key': key, 'user_id': user_id, 'changes': changes}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(replay_path, self.journal_path)
+        for path in files:
+            if path != self.journal_path:
+                os.remove(path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        if self._pending:
+            print(f"[写回] 从日志恢复 {len(self._pending)} 条待写入更新")
+            self._first_at = time.monotonic()
+            WRITE_BEHIND_PENDING.set(len(self._pending))
@@ -9,6 +9,14 @@ EMQX_CONFIG = {
     'password': 'your-password',
     'use_tls': True,
     'ca_cert': 'emqxsl-ca.crt',  # CA证书路径
+    'transport': 'emqx',  # emqx: 连接代理; loopback: 进程内本地代理 (开发/压测)
+    'max_payload': 4 * 1024 * 1024,  # 后端接收消息的大小上限 (字节)，超过直接丢弃
+    'protocol': 4,  # MQTT 协议版本: 4 (3.1.1) 或 5 (支持消息过期时间与会话过期时间，需代理支持)
+    # 持久会话 (可选，需 protocol 5): 'clean': False 时断线重连期间的 QoS 1 事件由代理保存并补发。
+    # 客户端 ID 每个进程不同，会话只在进程存活期间的重连中恢复；进程被杀或崩溃后
+    # 代理仍保留其会话并排队消息 session_expiry 秒，因此只设置覆盖一次重连所需的时长 (如 60)
+    'clean': True,
+    'session_expiry': 0,  # 持久会话在断开后保留的秒数 (仅 MQTT 5)
 }
 
 # Flask 配置
@@ -22,4 +30,103 @@ MQTT_TOPICS = {
     'tasks': 'todo/tasks',
     'calendar': 'todo/calendar',
     'sync': 'todo/sync',
-}
\ No newline at end of file
+    'lists': 'todo/lists',        # 共享清单事件，每个清单一个子主题
+    'stats': 'todo/stats',        # 用户统计快照 (保留消息)，每个用户一个子主题
+}
+
+# 监控配置
+METRICS_CONFIG = {
+    'enabled': True,              # 请求埋点与 /metrics
+    'profile_slow_ms': None,      # 慢请求采样剖析阈值 (毫秒)，None 为关闭
+    'profile_interval_ms': 5,     # 采样间隔 (毫秒)
+    'profile_dir': 'profiles',    # 折叠栈输出目录
+}
+
+# SSE 推送配置 (/api/events/stream)
+# 每个连接在同步 WSGI 服务器下占用一个线程；大量连接请使用协程式工作进程 (如 gunicorn -k gevent)
+SSE_CONFIG = {
+    'buffer_size': 256,   # 每用户保留的最近事件数，用于 Last-Event-ID 续传 (全量快照 sync_response 不保留)
+    'queue_size': 100,    # 每连接队列长度，写满即断开慢消费者
+    'heartbeat': 15,      # 心跳间隔 (秒)
+}
+
+# 任务归档配置 (也可手动运行: flask --app backend/app.py archive-tasks)
+ARCHIVE_CONFIG = {
+    'enabled': False,     # 是否在后端进程内定期归档
+    'days': 30,           # 归档完成超过多少天的任务
+    'batch_size': 500,    # 每批归档数量
+    'interval': 3600,     # 运行间隔 (秒)
+}
+
+# 任务更新写回缓冲: 窗口内对同一任务的多次更新合并为一次写入和一次广播
+WRITE_BEHIND_CONFIG = {
+    'enabled': False,
+    'window_ms': 500,                        # 合并窗口 (毫秒)
+    'max_pending': 1000,                     # 待写入任务数超过此值时提前写入
+    'durability': 'memory',                  # memory / journal / fsync
+    'journal_path': 'write_behind.journal',  # journal / fsync 模式的日志文件
+    'max_retries': 5,                        # 暂时性写入失败的重试次数，超过后丢弃并计入指标
+}
+
+# 限流: 按用户 (未登录按 IP) 和接口类别的令牌桶，超限返回 429 和 Retry-After
+RATE_LIMIT_CONFIG = {
+    'enabled': True,
+    'limits': {                   # 类别: (每秒补充令牌数, 桶容量)，未列出的类别用默认值
+        'auth': (1, 10),          # 登录/注册
+        'read': (20, 50),         # 查询接口
+        'write': (10, 30),        # 增删改接口
+        'stream': (0.2, 5),       # SSE 建立连接
+        'mqtt': (5, 20),          # 经 MQTT 发来的同步请求
+    },
+    'sync_debounce_ms': 2000,     # 窗口内重复的同步请求复用同一份快照
+    'stats_debounce_ms': 2000,    # 任务变化后合并发布统计快照 (保留消息) 的窗口
+}
+
+# 启动与健康检查: /healthz 存活检查，/readyz 就绪检查 (同时返回启动耗时报告)
+STARTUP_CONFIG = {
+    'require_mqtt': False,        # 就绪检查是否要求 MQTT 已连接 (MQTT 在后台连接，不阻塞 HTTP)
+}
+
+# 按用户分片: 任务、日历等用户数据按一致性哈希分布到多个库，主库保存用户与分片分配表
+# 调整分片后运行 flask --app backend/app.py shard-rebalance 在线迁移用户
+SHARD_CONFIG = {
+    'enabled': False,
+    'shards': {                   # 分片名: 数据库 URI ('default' 表示主库本身)
+        'shard0': 'sqlite:///todo_shard0.db',
+        'shard1': 'sqlite:///todo_shard1.db',
+    },
+    'vnodes': 64,                 # 每个分片在哈希环上的虚拟节点数
+    'cache_ttl': 5,               # 用户分片路由缓存 (秒)，迁移时先等待此时长
+    'id_block': 1000,             # 每次从主库领取的全局 ID 数
+}
+
+# MQTT 中继: 多个工作进程经本机 Unix socket 把消息交给中继，由中继的少量连接批量发布；
+# 中继用一条连接订阅后端主题并扇出给各工作进程，工作进程不再连接代理
+# 启用前先运行 flask --app backend/app.py mqtt-relay
+MQTT_RELAY_CONFIG = {
+    'enabled': False,
+    'socket': '/tmp/todo-mqtt-relay.sock',
+    'pool_size': 2,               # 中继到代理的连接数 (同一主题固定走同一连接，保证顺序)
+    'batch_max': 100,             # 每次合并写入的最大消息数
+    'queue_size': 10000,          # 每条连接的发送队列长度，满时丢弃新消息
+    'timeout': 0.5,               # 工作进程写 socket 的超时 (秒)，超时丢弃该消息
+}
+
+# 增量同步: 前端缓存任务到 IndexedDB，启动后只通过 /api/tasks/changes 拉取变化
+SYNC_CONFIG = {
+    'tombstone_days': 30,         # 删除记录保留天数，离线更久的客户端改为全量同步
+    'overlap_seconds': 2,         # revision 回退秒数，覆盖请求期间尚未提交的写入
+    'page_size': 500,             # 每次返回的最大任务数
+}
+
+# 共享清单
+LIST_CONFIG = {
+    'membership_ttl': 30,         # 成员缓存有效期 (秒)，其他进程的成员变化最迟在此时间后生效
+    'max_cached_lists': 10000,    # 每个进程最多缓存的清单数
+}
+
+# MQTT 事件发布策略: 按事件类型覆盖 qos / expiry (消息过期秒数，仅 MQTT 5) / retain，
+# '*' 为未列出事件的默认值，内置策略见 backend/mqtt_policy.py
+MQTT_EVENT_POLICY = {
+    # 'task_updated': {'qos': 1},
+}
@@ -37,13 +37,32 @@ const API = {
     },
     
     // 任务相关
-    async getTasks() {
-        const response = await fetch(`${CONFIG.API_BASE}/tasks`, {
+    // sort: created (默认) / priority / due / smart，由后端排序
+    // tags: 标签名数组，mode 为 and (全部标签) / or (任一标签)
+    async getTasks(sort, tags, mode = 'and') {
+        const params = new URLSearchParams();
+        if (sort) params.set('sort', sort);
+        if (tags && tags.length) {
+            params.set('tags', tags.join(','));
+            params.set('mode', mode);
+        }
+        const query = params.toString() ? `?${params}` : '';
+        const response = await fetch(`${CONFIG.API_BASE}/tasks${query}`, {
             credentials: 'include'
         });
         return response.json();
     },
     
+    // 增量同步: since 为上次返回的 revision，为空时返回全量
+    async getTaskChanges(since) {
+        const query = since ? `?since=${encodeURIComponent(since)}` : '';
+        const response = await fetch(`${CONFIG.API_BASE}/tasks/changes${query}`, {
+            credentials: 'include'
+        });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json();
+    },
+    
     async createTask(task) {
         const response = await fetch(`${CONFIG.API_BASE}/tasks`, {
             method: 'POST',
@@ -64,6 +83,63 @@ const API = {
         return response.json();
     },
     
+    // 移动任务及其子任务，parentId 为 null 时移为根任务
+    async moveTask(taskId, parentId) {
+        const response = await fetch(`${CONFIG.API_BASE}/tasks/${taskId}/move`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify({ parent_id: parentId })
+        });
+        return response.json();
+    },
+    
+    // 子任务列表及完成数；countsOnly 时只返回统计
+    async getSubtree(taskId, countsOnly = false) {
+        const query = countsOnly ? '?counts_only=1' : '';
+        const response = await fetch(`${CONFIG.API_BASE}/tasks/${taskId}/subtree${query}`, {
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    // 整体替换任务的标签
+    async setTaskTags(taskId, tags) {
+        const response = await fetch(`${CONFIG.API_BASE}/tasks/${taskId}/tags`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify({ tags })
+        });
+        return response.json();
+    },
+    
+    // 标签及各标签的任务数
+    async getTags() {
+        const response = await fetch(`${CONFIG.API_BASE}/tags`, {
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    async renameTag(tagId, name) {
+        const response = await fetch(`${CONFIG.API_BASE}/tags/${tagId}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify({ name })
+        });
+        return response.json();
+    },
+    
+    async deleteTag(tagId) {
+        const response = await fetch(`${CONFIG.API_BASE}/tags/${tagId}`, {
+            method: 'DELETE',
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
     async deleteTask(taskId) {
         const response = await fetch(`${CONFIG.API_BASE}/tasks/${taskId}`, {
             method: 'DELETE',
@@ -72,6 +148,93 @@ const API = {
         return response.json();
     },
     
+    // 共享清单
+    async getLists() {
+        const response = await fetch(`${CONFIG.API_BASE}/lists`, {
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    async createList(name) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify({ name })
+        });
+        return response.json();
+    },
+    
+    async deleteList(listId) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}`, {
+            method: 'DELETE',
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    async getListMembers(listId) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/members`, {
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    // role: viewer / editor，已是成员时修改角色
+    async addListMember(listId, username, role = 'editor') {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/members`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify({ username, role })
+        });
+        return response.json();
+    },
+    
+    async removeListMember(listId, userId) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/members/${userId}`, {
+            method: 'DELETE',
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    async getListTasks(listId) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/tasks`, {
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
+    async createListTask(listId, task) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/tasks`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify(task)
+        });
+        return response.json();
+    },
+    
+    async updateListTask(listId, taskId, data) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/tasks/${taskId}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'include',
+            body: JSON.stringify(data)
+        });
+        return response.json();
+    },
+    
+    async deleteListTask(listId, taskId) {
+        const response = await fetch(`${CONFIG.API_BASE}/lists/${listId}/tasks/${taskId}`, {
+            method: 'DELETE',
+            credentials: 'include'
+        });
+        return response.json();
+    },
+    
     // 日历事件
     async getCalendarEvents(start, end) {
         let url = `${CONFIG.API_BASE}/calendar?`;
@@ -118,5 +281,16 @@ const API = {
             credentials: 'include'
         });
         return response.json();
+    },
+    
+    // 完成趋势: from / to 为 YYYY-MM-DD，bucket 为 day / week / month
+    async getTrends(from, to, bucket = 'day') {
+        const params = new URLSearchParams({ bucket });
+        if (from) params.set('from', from);
+        if (to) params.set('to', to);
+        const response = await fetch(`${CONFIG.API_BASE}/stats/trends?${params}`, {
+            credentials: 'include'
+        });
+        return response.json();
     }
 };
\ No newline at end of file
@@ -3,6 +3,16 @@ const App = {
     currentUser: null,
     tasks: [],
     currentFilter: 'all',
+    // 上次增量同步的 revision (与 IndexedDB 缓存一起保存)
+    revision: null,
+    // 已归档任务数，不在本地缓存中，仅用于统计
+    archivedTasks: 0,
+    syncing: null,
+    
+    // 实时推送通道 (MQTT 或 SSE)
+    get push() {
+        return CONFIG.PUSH_MODE === 'sse' ? Events : MQTT;
+    },
     
     // 初始化
     async init() {
@@ -42,12 +52,18 @@ const App = {
         // 显示用户名
         document.getElementById('currentUser').textContent = this.currentUser.username;
         
-        // 加载数据
-        await this.loadTasks();
-        await this.loadStats();
+        // 先显示本地缓存，再增量拉取变化
+        await Store.open(this.currentUser.id);
+        const cached = await Store.load();
+        this.tasks = this.sortTasks(cached.tasks);
+        this.revision = cached.revision;
+        this.renderTasks();
+        
+        await this.syncTasks();
+        this.loadStats();
         
-        // 连接 MQTT
-        await MQTT.connect((topic, data) => this.handleMQTTMessage(topic, data));
+        // 连接实时推送
+        await this.push.connect((topic, data) => this.handleMQTTMessage(topic, data));
     },
     
     // 绑定事件
@@ -111,8 +127,12 @@ const App = {
         // 退出登录
         document.getElementById('logoutBtn').addEventListener('click', async () => {
             await API.logout();
-            MQTT.disconnect();
+            this.push.disconnect();
+            await Store.clear();
+            Store.close();
             this.currentUser = null;
+            this.tasks = [];
+            this.revision = null;
             this.showAuthPage();
         });
         
@@ -146,30 +166,129 @@ const App = {
                 this.renderTasks();
             });
         });
+        
+        // 网络恢复后补拉离线期间的变化
+        window.addEventListener('online', () => {
+            if (this.currentUser) this.syncTasks();
+        });
     },
     
-    // 加载任务
-    async loadTasks() {
+    // 增量同步任务: 只拉取 revision 之后的变化，合并进内存和本地缓存
+    syncTasks() {
+        // 同一时间只有一个同步请求，期间的调用共用结果
+        if (!this.syncing) {
+            this.syncing = this.pullChanges().finally(() => {
+                this.syncing = null;
+            });
+        }
+        return this.syncing;
+    },
+    
+    async pullChanges() {
         try {
-            const result = await API.getTasks();
-            this.tasks = result.tasks || [];
+            let result;
+            do {
+                result = await API.getTaskChanges(this.revision);
+                if (result.error) throw new Error(result.error);
+                
+                await Store.apply({
+                    upserts: result.tasks,
+                    deletes: result.deleted,
+                    revision: result.revision,
+                    reset: result.reset
+                });
+                if (result.reset) {
+                    this.tasks = result.tasks;
+                } else {
+                    this.mergeTasks(result.tasks, result.deleted);
+                }
+                this.revision = result.revision;
+            } while (result.has_more);
+            
+            this.tasks = this.sortTasks(this.tasks);
             this.renderTasks();
+            this.renderStats();
         } catch (error) {
-            console.error('加载任务失败:', error);
+            // 离线时继续使用本地缓存
+            console.error('同步任务失败:', error);
         }
     },
     
-    // 加载统计数据
+    // 合并任务变化到内存列表 (按 id 覆盖，删除在最后执行)
+    mergeTasks(upserts, deletes = []) {
+        const byId = new Map(this.tasks.map(t => [t.id, t]));
+        upserts.forEach(task => byId.set(task.id, task));
+        deletes.forEach(id => byId.delete(id));
+        this.tasks = Array.from(byId.values());
+    },
+    
+    // 与后端默认排序一致: 创建时间倒序
+    sortTasks(tasks) {
+        return tasks.sort((a, b) => (b.created_at || '').localeCompare(a.created_at || '') || b.id - a.id);
+    },
+    
+    // 应用单个任务变化 (本地操作结果或推送事件)，只更新受影响的部分
+    applyTaskPatch(task, deleted = false) {
+        if (deleted) {
+            this.tasks = this.tasks.filter(t => t.id !== task.id);
+            Store.apply({ deletes: [task.id] });
+        } else {
+            const index = this.tasks.findIndex(t => t.id === task.id);
+            if (index >= 0) {
+                this.tasks[index] = task;
+            } else {
+                this.tasks = this.sortTasks([task, ...this.tasks]);
+            }
+            Store.apply({ upserts: [task] });
+        }
+        this.renderTasks();
+        this.renderStats();
+    },
+    
+    // 移除多个任务 (删除子树)
+    removeTasks(ids) {
+        const removed = new Set(ids);
+        this.tasks = this.tasks.filter(t => !removed.has(t.id));
+        Store.apply({ deletes: ids });
+        this.renderTasks();
+        this.renderStats();
+    },
+    
+    // 子树移动: 按路径前缀改写本地任务的路径和深度
+    applySubtreeMove({ task, old_path, new_path, depth_delta }) {
+        const changed = [];
+        this.tasks.forEach(t => {
+            if (t.path && t.path.startsWith(old_path)) {
+                t.path = new_path + t.path.slice(old_path.length);
+                t.depth += depth_delta;
+                changed.push(t);
+            }
+        });
+        Store.apply({ upserts: changed });
+        this.applyTaskPatch(task);
+    },
+    
+    // 加载统计数据 (归档数只能从后端获取，其余按本地任务计算)
     async loadStats() {
         try {
             const stats = await API.getStats();
-            document.getElementById('totalTasks').textContent = stats.total_tasks || 0;
-            document.getElementById('completedTasks').textContent = stats.completed_tasks || 0;
-            document.getElementById('pendingTasks').textContent = stats.pending_tasks || 0;
-            document.getElementById('dueToday').textContent = stats.due_today || 0;
+            this.archivedTasks = stats.archived_tasks || 0;
         } catch (error) {
             console.error('加载统计失败:', error);
         }
+        this.renderStats();
+    },
+    
+    // 按本地任务计算统计 (今日到期与后端一致按 UTC 日期)
+    renderStats() {
+        const today = new Date().toISOString().slice(0, 10);
+        const completed = this.tasks.filter(t => t.completed).length;
+        const dueToday = this.tasks.filter(t => t.due_date && t.due_date.slice(0, 10) === today).length;
+        
+        document.getElementById('totalTasks').textContent = this.tasks.length + this.archivedTasks;
+        document.getElementById('completedTasks').textContent = completed + this.archivedTasks;
+        document.getElementById('pendingTasks').textContent = this.tasks.length - completed;
+        document.getElementById('dueToday').textContent = dueToday;
     },
     
     // 渲染任务列表
@@ -233,12 +352,10 @@ const App = {
             });
             
             if (result.task) {
-                this.tasks.unshift(result.task);
-                this.renderTasks();
-                this.loadStats();
+                this.applyTaskPatch(result.task);
                 
                 // 发布 MQTT 消息
-                MQTT.publish(CONFIG.MQTT.topics.tasks, {
+                this.push.publish(CONFIG.MQTT.topics.tasks, {
                     action: 'create',
                     user_id: this.currentUser.id,
                     task: result.task
@@ -262,13 +379,10 @@ const App = {
             });
             
             if (result.task) {
-                const index = this.tasks.findIndex(t => t.id === taskId);
-                this.tasks[index] = result.task;
-                this.renderTasks();
-                this.loadStats();
+                this.applyTaskPatch(result.task);
                 
                 // 发布 MQTT 消息
-                MQTT.publish(CONFIG.MQTT.topics.tasks, {
+                this.push.publish(CONFIG.MQTT.topics.tasks, {
                     action: 'update',
                     user_id: this.currentUser.id,
                     task: result.task
@@ -282,13 +396,12 @@ const App = {
     // 删除任务
     async deleteTask(taskId) {
         try {
-            await API.deleteTask(taskId);
-            this.tasks = this.tasks.filter(t => t.id !== taskId);
-            this.renderTasks();
-            this.loadStats();
+            const result = await API.deleteTask(taskId);
+            // 子任务随父任务一起删除
+            this.removeTasks(result.deleted_ids || [taskId]);
             
             // 发布 MQTT 消息
-            MQTT.publish(CONFIG.MQTT.topics.tasks, {
+            this.push.publish(CONFIG.MQTT.topics.tasks, {
                 action: 'delete',
                 user_id: this.currentUser.id,
                 task_id: taskId
@@ -303,22 +416,31 @@ const App = {
         console.log('[App] 收到 MQTT 消息:', topic, data);
         
         if (topic === CONFIG.MQTT.topics.sync) {
-            if (data.event === 'task_created') {
-                // 其他客户端创建了任务
-                this.loadTasks();
-            } else if (data.event === 'task_updated') {
-                // 更新本地任务
-                const index = this.tasks.findIndex(t => t.id === data.data.id);
-                if (index >= 0) {
-                    this.tasks[index] = data.data;
-                    this.renderTasks();
-                    this.loadStats();
+            if (data.event === 'resync') {
+                // 推送断点无法续传，按 revision 补拉错过的变化
+                this.syncTasks();
+                return;
+            }
+            // MQTT 同步主题上有所有用户的事件，只处理自己的
+            if (data.user_id !== undefined && data.user_id !== this.currentUser.id) return;
+            // 共享清单的事件不属于个人任务列表
+            if (data.list_id !== undefined && data.list_id !== null) return;
+            
+            if (data.event === 'task_created' || data.event === 'task_updated') {
+                // 直接应用推送的任务，较旧的事件 (乱序到达) 忽略
+                const local = this.tasks.find(t => t.id === data.data.id);
+                if (!local || (data.data.updated_at || '') >= (local.updated_at || '')) {
+                    this.applyTaskPatch(data.data);
                 }
             } else if (data.event === 'task_deleted') {
-                // 删除本地任务
-                this.tasks = this.tasks.filter(t => t.id !== data.data.id);
-                this.renderTasks();
-                this.loadStats();
+                this.applyTaskPatch(data.data, true);
+            } else if (data.event === 'task_subtree_deleted') {
+                this.removeTasks(data.data.task_ids);
+            } else if (data.event === 'task_subtree_moved') {
+                this.applySubtreeMove(data.data);
+            } else if (data.event === 'tag_updated' || data.event === 'tag_deleted') {
+                // 标签改名或删除影响多个任务，服务端已刷新其更新时间，增量拉取即可
+                this.syncTasks();
             }
         }
     },
@@ -3,6 +3,9 @@ const CONFIG = {
     // 后端 API 地址 - 使用相对路径（前端和后端在同一服务器）
     API_BASE: '/api',
     
+    // 实时推送方式: 'mqtt' 浏览器直连代理; 'sse' 由后端 /api/events/stream 推送
+    PUSH_MODE: 'mqtt',
+    
     // MQTT 配置 - WebSocket 连接
     MQTT: {
         broker: 'wss://d6c1f93c.ala.cn-hangzhou.emqxsl.cn:8084/mqtt',
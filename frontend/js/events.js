@@ -0,0 +1,71 @@
+// SSE 推送模块 - 由后端单一 MQTT 订阅扇出，浏览器无需直连代理
+const Events = {
+    source: null,
+    connected: false,
+    
+    // 连接事件流，回调签名与 MQTT.connect 一致
+    connect(onMessage) {
+        return new Promise((resolve) => {
+            this.source = new EventSource(`${CONFIG.API_BASE}/events/stream`, { withCredentials: true });
+            
+            this.source.onopen = () => {
+                this.connected = true;
+                console.log('[SSE] 已连接');
+                this.updateStatus(true);
+                resolve();
+            };
+            
+            this.source.onerror = () => {
+                // EventSource 会携带 Last-Event-ID 自动重连
+                this.connected = false;
+                this.updateStatus(false);
+                resolve();
+            };
+            
+            const handler = (e) => {
+                if (!onMessage) return;
+                try {
+                    onMessage(CONFIG.MQTT.topics.sync, JSON.parse(e.data));
+                } catch (err) {
+                    console.error('[SSE] 无效消息:', err);
+                }
+            };
+            ['task_created', 'task_updated', 'task_deleted', 'task_subtree_moved', 'task_subtree_deleted',
+             'tag_updated', 'tag_deleted', 'sync_response'].forEach(type => {
+                this.source.addEventListener(type, handler);
+            });
+            
+            // 断点之后的事件已丢失，需要全量刷新
+            this.source.addEventListener('resync', () => {
+                if (onMessage) onMessage(CONFIG.MQTT.topics.sync, { event: 'resync', data: {} });
+            });
+        });
+    },
+    
+    // 后端已负责广播，SSE 模式下客户端无需发布
+    publish(topic, message) {},
+    
+    // 断开连接
+    disconnect() {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+            this.connected = false;
+            this.updateStatus(false);
+            console.log('[SSE] 已断开连接');
+        }
+    },
+    
+    // 更新状态显示
+    updateStatus(connected) {
+        const indicator = document.getElementById('mqttIndicator');
+        const status = document.getElementById('mqttStatus');
+        
+        if (indicator) {
+            indicator.className = 'indicator ' + (connected ? 'online' : 'offline');
+        }
+        if (status) {
+            status.textContent = 'SSE: ' + (connected ? '已连接' : '未连接');
+        }
+    }
+};
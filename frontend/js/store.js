@@ -0,0 +1,86 @@
+// 本地任务缓存 - IndexedDB，按任务 id 存储，并记录上次同步的 revision
+// 浏览器不支持或禁用 IndexedDB (如隐私模式) 时退化为纯内存，不影响使用
+const Store = {
+    db: null,
+
+    // 每个用户一个库，切换账号不会串数据
+    open(userId) {
+        this.close();
+        if (!window.indexedDB) return Promise.resolve(null);
+
+        return new Promise((resolve) => {
+            const request = indexedDB.open(`todo-cache-${userId}`, 1);
+
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                db.createObjectStore('tasks', { keyPath: 'id' });
+                db.createObjectStore('meta');
+            };
+            request.onsuccess = () => {
+                this.db = request.result;
+                resolve(this.db);
+            };
+            request.onerror = () => {
+                console.warn('[Store] IndexedDB 不可用:', request.error);
+                resolve(null);
+            };
+        });
+    },
+
+    close() {
+        if (this.db) {
+            this.db.close();
+            this.db = null;
+        }
+    },
+
+    // 读取缓存的全部任务和 revision
+    async load() {
+        if (!this.db) return { tasks: [], revision: null };
+        const tx = this.db.transaction(['tasks', 'meta'], 'readonly');
+        const [tasks, revision] = await Promise.all([
+            this.request(tx.objectStore('tasks').getAll()),
+            this.request(tx.objectStore('meta').get('revision'))
+        ]);
+        return { tasks: tasks || [], revision: revision || null };
+    },
+
+    // 应用一次同步结果: upserts 覆盖写入，deletes 为要移除的 id，reset 时先清空
+    apply({ upserts = [], deletes = [], revision, reset = false }) {
+        if (!this.db) return Promise.resolve();
+        const tx = this.db.transaction(['tasks', 'meta'], 'readwrite');
+        const tasks = tx.objectStore('tasks');
+        if (reset) tasks.clear();
+        upserts.forEach(task => tasks.put(task));
+        deletes.forEach(id => tasks.delete(id));
+        if (revision !== undefined) tx.objectStore('meta').put(revision, 'revision');
+        return this.done(tx);
+    },
+
+    // 退出登录时删除本地缓存
+    async clear() {
+        if (!this.db) return;
+        const tx = this.db.transaction(['tasks', 'meta'], 'readwrite');
+        tx.objectStore('tasks').clear();
+        tx.objectStore('meta').clear();
+        await this.done(tx);
+    },
+
+    request(req) {
+        return new Promise((resolve, reject) => {
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+    },
+
+    done(tx) {
+        return new Promise((resolve) => {
+            tx.oncomplete = () => resolve();
+            // 缓存写入失败不影响页面，下次启动按 revision 重新拉取
+            tx.onerror = tx.onabort = () => {
+                console.warn('[Store] 写入缓存失败:', tx.error);
+                resolve();
+            };
+        });
+    }
+};
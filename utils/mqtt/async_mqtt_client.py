@@ -0,0 +1,422 @@
+"""
+异步 MQTT 客户端 - Python (asyncio)
+
+无第三方依赖，基于 mqtt_protocol.py 的报文编解码。
+所有连接共享一个事件循环，适合负载模拟器、多租户桥接等需要上千并发连接的场景。
+
+运行: python async_mqtt_client.py --clients 1000
+
+支持:
+- 可等待的 connect / publish / subscribe / unsubscribe (等待 CONNACK / PUBACK / SUBACK)
+- async for 异步迭代接收消息，接收队列满时对代理形成背压
+- QoS 0 / 1 发布 (不支持 QoS 2，传入时抛出 ValueError)，QoS 1 在途消息数上限 (max_inflight) 流控
+- 普通连接与 TLS/SSL 连接，MQTT 3.1.1 / 5.0
+"""
+
+import asyncio
+import inspect
+import itertools
+import json
+import random
+import ssl
+
+try:
+    from utils.mqtt import mqtt_protocol as proto
+except ImportError:
+    import mqtt_protocol as proto
+
+# ============== 配置区域 ==============
+CONFIG = {
+    'broker': 'localhost',
+    'port': 1883,
+    'client_id': f'mqtt_async_client_{random.randint(0, 1000)}',
+    'username': '',
+    'password': '',
+    'topic': 'test/topic',
+    'qos': 1,
+    'keepalive': 60,
+    'clean': True,
+    'session_expiry': 0,     # 持久会话在断开后保留的秒数 (仅 MQTT 5)
+    'protocol': proto.MQTT_V311,
+    'max_inflight': 20,      # QoS 1 在途消息上限
+    'max_queued': 1000,      # 接收队列长度
+    'raw_payload': False,    # True 时消息为 bytes (不解码)，否则为 str
+    'connect_timeout': 5,
+    # TLS 配置
+    'use_tls': False,
+    'ca_cert': None,
+    'insecure': False,
+}
+# =====================================
+
+_CLOSED = object()
+
+
+def _check_qos(qos):
+    if qos not in (0, 1):
+        raise ValueError(f'不支持的 QoS: {qos} (仅支持 0 / 1)')
+
+
+class AsyncMqttClient:
+    """asyncio MQTT 客户端，接口与 MqttClient 对应，方法均为协程"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.protocol = config.get('protocol', proto.MQTT_V311)
+        self.connected = False
+        self.session_present = False
+        self.message_callback = None
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._ping_task = None
+        self._connack = None
+        self._pending = {}      # 报文标识符 -> Future
+        self._ids = itertools.count(1)
+        self._inflight = asyncio.Semaphore(config.get('max_inflight', 20))
+        self._queue = asyncio.Queue(maxsize=config.get('max_queued', 1000))
+        # 关闭标志: 队列已满时放不进 _CLOSED，messages() 取空队列后据此结束
+        self._closed = False
+        self._pong = asyncio.Event()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    def _ssl_context(self):
+        """构造 TLS 上下文"""
+        if not self.config.get('use_tls'):
+            return None
+        context = ssl.create_default_context(cafile=self.config.get('ca_cert'))
+        if self.config.get('insecure'):
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def connect(self):
+        """连接到 MQTT 代理，收到 CONNACK 后返回；被拒绝或超时抛出 ConnectionError"""
+        timeout = self.config.get('connect_timeout', 5)
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.config['broker'], self.config['port'],
+                                        ssl=self._ssl_context()),
+                timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"[连接错误] {self.config['broker']}:{self.config['port']} {e}")
+
+        self._closed = False
+        self._connack = asyncio.get_running_loop().create_future()
+        self._read_task = asyncio.create_task(self._read_loop())
+        properties = None
+        if self.config.get('session_expiry'):
+            properties = {proto.PROP_SESSION_EXPIRY: int(self.config['session_expiry'])}
+        self._writer.write(proto.build_connect(
+            self.config['client_id'],
+            keepalive=self.config.get('keepalive', 60),
+            username=self.config.get('username') or None,
+            password=self.config.get('password', ''),
+            clean=self.config.get('clean', True),
+            protocol=self.protocol,
+            properties=properties,
+        ))
+        try:
+            session_present, return_code, _ = await asyncio.wait_for(self._connack, timeout)
+        except asyncio.TimeoutError:
+            await self._close()
+            raise ConnectionError('[连接失败] 等待 CONNACK 超时')
+        if return_code != 0:
+            await self._close()
+            raise ConnectionError(f'[连接失败] 返回码: {return_code}')
+
+        self.connected = True
+        self.session_present = bool(session_present)
+        if self.config.get('keepalive', 60):
+            self._ping_task = asyncio.create_task(self._ping_loop())
+        return self
+
+    def _next_id(self) -> int:
+        while True:
+            packet_id = next(self._ids) % 65535 + 1
+            if packet_id not in self._pending:
+                return packet_id
+
+    async def _request(self, packet_id: int, packet: bytes):
+        """发送报文并等待对应确认"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[packet_id] = future
+        self._writer.write(packet)
+        await self._writer.drain()
+        return await future
+
+    async def publish(self, topic: str, message, qos: int = None, retain: bool = False,
+                      expiry: int = None):
+        """
+        发布消息，QoS 1 等待 PUBACK 后返回
+
+        只支持 QoS 0 / 1 (与 MqttClient 不同，不支持 QoS 2)，qos 大于 1 时抛出 ValueError
+
+        Args:
+            topic: 主题
+            message: 消息内容（字符串、字节或字典）
+            qos: 服务质量等级 (0, 1)
+            retain: 是否为保留消息
+            expiry: 消息过期时间 (秒，仅 MQTT 5)
+        """
+        if qos is None:
+            qos = self.config.get('qos', 1)
+        _check_qos(qos)
+        if not self.connected:
+            raise ConnectionError('[错误] 客户端未连接')
+        if isinstance(message, (dict, list)):
+            payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        elif isinstance(message, (bytes, bytearray, memoryview)):
+            payload = message
+        else:
+            payload = str(message).encode('utf-8')
+        properties = {proto.PROP_MESSAGE_EXPIRY: int(expiry)} if expiry else None
+
+        if qos == 0:
+            self._writer.write(proto.build_publish(topic, payload, 0, retain=retain,
+                                                   protocol=self.protocol, properties=properties))
+            await self._writer.drain()
+            return
+        # 在途消息数达到上限时在此等待
+        async with self._inflight:
+            packet_id = self._next_id()
+            await self._request(packet_id, proto.build_publish(
+                topic, payload, 1, packet_id, retain, protocol=self.protocol,
+                properties=properties))
+
+    async def publish_batch(self, messages):
+        """
+        批量发布，messages 为 [(主题, payload 字节, qos, retain, 过期秒数或 None)]
+
+        报文合并为一次写入、一次 drain，QoS 1 消息统一等待 PUBACK；
+        在途消息达到上限时先写出已组装的报文再等待。qos 大于 1 时不发送任何消息并抛出 ValueError。
+        """
+        for message in messages:
+            _check_qos(message[2])
+        if not self.connected:
+            raise ConnectionError('[错误] 客户端未连接')
+        loop = asyncio.get_running_loop()
+        packets = []
+        futures = []
+        for topic, payload, qos, retain, expiry in messages:
+            properties = {proto.PROP_MESSAGE_EXPIRY: expiry} if expiry else None
+            if not qos:
+                packets.append(proto.build_publish(topic, payload, 0, retain=retain,
+                                                   protocol=self.protocol, properties=properties))
+                continue
+            if self._inflight.locked() and packets:
+                self._writer.write(b''.join(packets))
+                packets = []
+                await self._writer.drain()
+            await self._inflight.acquire()
+            if not self.connected:
+                self._inflight.release()
+                raise ConnectionError('连接已关闭')
+            packet_id = self._next_id()
+            future = loop.create_future()
+            future.add_done_callback(lambda _: self._inflight.release())
+            self._pending[packet_id] = future
+            futures.append(future)
+            packets.append(proto.build_publish(topic, payload, 1, packet_id, retain,
+                                               protocol=self.protocol, properties=properties))
+        if packets:
+            self._writer.write(b''.join(packets))
+            await self._writer.drain()
+        if futures:
+            await asyncio.gather(*futures)
+
+    async def subscribe(self, topics, callback=None):
+        """
+        订阅主题，返回授予的 qos 列表
+
+        Args:
+            topics: 主题字符串或主题列表
+            callback: 消息回调函数 (普通函数或协程)，为空时消息进入 messages() 队列
+        """
+        if not self.connected:
+            raise ConnectionError('[错误] 客户端未连接')
+        if callback is not None:
+            self.message_callback = callback
+        if isinstance(topics, str):
+            topics = [topics]
+        qos = self.config.get('qos', 1)
+        packet_id = self._next_id()
+        granted = await self._request(packet_id, proto.build_subscribe(
+            packet_id, [(t, qos) for t in topics], self.protocol))
+        failed = [t for t, code in zip(topics, granted) if code >= 0x80]
+        if failed:
+            print(f"[订阅失败] 主题: {', '.join(failed)}")
+        return granted
+
+    async def unsubscribe(self, topics):
+        """
+        取消订阅
+
+        Args:
+            topics: 主题字符串或主题列表
+        """
+        if not self.connected:
+            raise ConnectionError('[错误] 客户端未连接')
+        if isinstance(topics, str):
+            topics = [topics]
+        packet_id = self._next_id()
+        await self._request(packet_id, proto.build_unsubscribe(packet_id, topics, self.protocol))
+
+    async def messages(self):
+        """异步迭代接收的消息，产出 (主题, 消息)；连接关闭后结束"""
+        while True:
+            if self._closed and self._queue.empty():
+                return
+            item = await self._queue.get()
+            if item is _CLOSED:
+                return
+            yield item
+
+    async def disconnect(self):
+        """断开连接"""
+        if self.connected:
+            self._writer.write(proto.pack_packet(proto.DISCONNECT, 0))
+            try:
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+        await self._close()
+
+    async def _close(self):
+        self.connected = False
+        self._closed = True
+        for task in (self._ping_task, self._read_task):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(ConnectionError('连接已关闭'))
+
+    def _fail_pending(self, error):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        if self._connack is not None and not self._connack.done():
+            self._connack.set_exception(error)
+        try:
+            # 唤醒正在等待空队列的 messages()
+            self._queue.put_nowait(_CLOSED)
+        except asyncio.QueueFull:
+            # 队列已满说明消费者尚未取完，取空后会看到 _closed
+            pass
+
+    async def _ping_loop(self):
+        """每半个保活周期发送 PINGREQ，一个保活周期内收不到 PINGRESP 视为连接已失效 (半开连接)"""
+        keepalive = self.config.get('keepalive', 60)
+        while self.connected:
+            await asyncio.sleep(keepalive / 2)
+            if not self.connected:
+                return
+            self._pong.clear()
+            self._writer.write(proto.pack_packet(proto.PINGREQ, 0))
+            try:
+                await asyncio.wait_for(self._pong.wait(), keepalive)
+            except asyncio.TimeoutError:
+                print(f"[已断开] {self.config['client_id']} 等待 PINGRESP 超时")
+                await self._close()
+                return
+
+    async def _read_loop(self):
+        try:
+            while True:
+                packet_type, flags, body = await proto.read_packet(self._reader)
+                if packet_type == proto.PUBLISH:
+                    await self._handle_publish(flags, body)
+                elif packet_type == proto.CONNACK:
+                    if not self._connack.done():
+                        self._connack.set_result(proto.parse_connack(body, self.protocol))
+                elif packet_type in (proto.PUBACK, proto.UNSUBACK):
+                    self._resolve(proto.parse_packet_id(body), None)
+                elif packet_type == proto.SUBACK:
+                    packet_id, granted = proto.parse_suback(body, self.protocol)
+                    self._resolve(packet_id, granted)
+                elif packet_type == proto.PINGRESP:
+                    self._pong.set()
+                elif packet_type == proto.PUBREL:
+                    self._writer.write(proto.build_ack(
+                        proto.PUBCOMP, proto.parse_packet_id(body), self.protocol))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if self.connected:
+                print(f"[已断开] {self.config['client_id']} 连接已关闭")
+        except proto.ProtocolError as e:
+            print(f"[协议错误] {e}")
+        finally:
+            await self._close()
+
+    def _resolve(self, packet_id, result):
+        future = self._pending.pop(packet_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def _handle_publish(self, flags, body):
+        msg = proto.parse_publish(flags, body, self.protocol)
+        payload = bytes(msg['payload'])
+        if not self.config.get('raw_payload'):
+            payload = payload.decode('utf-8')
+        if self.message_callback:
+            try:
+                result = self.message_callback(msg['topic'], payload)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"[回调错误] {e}")
+        else:
+            # 队列满时阻塞读取，借助 TCP 背压限制代理发送速率
+            await self._queue.put((msg['topic'], payload))
+        if msg['qos'] == 1:
+            self._writer.write(proto.build_ack(proto.PUBACK, msg['packet_id'], self.protocol))
+        elif msg['qos'] == 2:
+            self._writer.write(proto.build_ack(proto.PUBREC, msg['packet_id'], self.protocol))
+
+
+# ============== 使用示例 ==============
+async def _demo(clients: int):
+    """启动 clients 个并发连接，向同一主题各发布一条消息"""
+    received = []
+
+    def on_message(topic, message):
+        received.append(message)
+
+    listener = await AsyncMqttClient({**CONFIG, 'client_id': 'async_listener'}).connect()
+    await listener.subscribe(CONFIG['topic'], on_message)
+
+    pool = [AsyncMqttClient({**CONFIG, 'client_id': f'async_client_{i}'}) for i in range(clients)]
+    await asyncio.gather(*(c.connect() for c in pool))
+    print(f"[已连接] {clients} 个客户端")
+
+    await asyncio.gather(*(c.publish(CONFIG['topic'], {'client': i}) for i, c in enumerate(pool)))
+    await asyncio.sleep(0.5)
+    print(f"[已发布] {clients} 条消息, 监听端收到 {len(received)} 条")
+
+    await asyncio.gather(*(c.disconnect() for c in pool))
+    await listener.disconnect()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='异步 MQTT 客户端示例')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--local', action='store_true', help='启动进程内本地代理')
+    args = parser.parse_args()
+
+    if args.local:
+        try:
+            from utils.mqtt.local_broker import LocalBroker
+        except ImportError:
+            from local_broker import LocalBroker
+        CONFIG['port'] = LocalBroker().start('127.0.0.1', 0)
+    asyncio.run(_demo(args.clients))
@@ -0,0 +1,661 @@
+"""
+本地 MQTT 代理 - Python
+
+用于开发与压测的轻量级 MQTT 代理，替代 EMQX Cloud。
+无第三方依赖，可在离线环境中运行后端并测量消息扇出吞吐。
+
+支持:
+- 进程内回环客户端 (LoopbackMqttClient)，接口与 MqttClient 一致，无需网络
+- asyncio TCP 服务端，兼容 MQTT 3.1.1 / 5.0 客户端 (paho 等)
+- QoS 0 / 1 (QoS 2 订阅降级为 1)
+- 通配符订阅 (+ / #)、共享订阅 ($share/<group>/<filter>)、保留消息
+- 持久会话 (clean=False) 的离线消息队列
+
+运行:
+    python local_broker.py                       # 监听 127.0.0.1:1883
+    python local_broker.py --bench 5000          # 5000 个回环客户端的扇出压测
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+try:
+    from utils.mqtt import mqtt_protocol as proto
+except ImportError:
+    import mqtt_protocol as proto
+
+
+class _Node:
+    """订阅树节点"""
+    __slots__ = ('children', 'subscribers', 'shared')
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = {}   # session -> qos
+        self.shared = {}        # group -> _SharedGroup
+
+
+class _SharedGroup:
+    """共享订阅组: 组内成员轮询接收消息"""
+    __slots__ = ('members', 'cursor')
+
+    def __init__(self):
+        self.members = {}       # session -> qos
+        self.cursor = itertools.count()
+
+    def pick(self):
+        sessions = list(self.members.items())
+        return sessions[next(self.cursor) % len(sessions)]
+
+
+class _TopicTree:
+    """按主题层级组织的订阅树，匹配复杂度与订阅总数无关"""
+
+    def __init__(self):
+        self.root = _Node()
+
+    def _node(self, topic_filter: str, create: bool):
+        node = self.root
+        path = []
+        for level in topic_filter.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                if not create:
+                    return None, path
+                child = node.children[level] = _Node()
+            path.append((node, level))
+            node = child
+        return node, path
+
+    def add(self, session, topic_filter: str, qos: int):
+        group, real_filter = proto.split_shared(topic_filter)
+        node, _ = self._node(real_filter, create=True)
+        if group is None:
+            node.subscribers[session] = qos
+        else:
+            node.shared.setdefault(group, _SharedGroup()).members[session] = qos
+
+    def remove(self, session, topic_filter: str):
+        group, real_filter = proto.split_shared(topic_filter)
+        node, path = self._node(real_filter, create=False)
+        if node is None:
+            return
+        if group is None:
+            node.subscribers.pop(session, None)
+        elif group in node.shared:
+            node.shared[group].members.pop(session, None)
+            if not node.shared[group].members:
+                del node.shared[group]
+        # 回收空节点
+        for parent, level in reversed(path):
+            child = parent.children[level]
+            if child.children or child.subscribers or child.shared:
+                break
+            del parent.children[level]
+
+    def match(self, topic: str):
+        """返回匹配主题的全部节点"""
+        levels = topic.split('/')
+        matched = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            # 以 $ 开头的主题不匹配首层通配符
+            wildcard_ok = not (depth == 0 and topic.startswith('$'))
+            if wildcard_ok and '#' in node.children:
+                matched.append(node.children['#'])
+            if depth == len(levels):
+                matched.append(node)
+                continue
+            child = node.children.get(levels[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+            if wildcard_ok and '+' in node.children:
+                stack.append((node.children['+'], depth + 1))
+        return matched
+
+
+# MQTT 5 会话过期时间取最大值表示永不过期
+SESSION_NEVER_EXPIRES = 0xFFFFFFFF
+_BY_CLEAN = object()
+
+
+def session_expiry(protocol: int, clean: bool, properties: dict = None):
+    """
+    断开后会话保留的秒数，None 为永不过期
+
+    3.1.1 的非 clean 会话没有过期时间 (永久保留)；5.0 由 CONNECT 的会话过期时间决定，
+    缺省为 0 (断开即结束)，clean_start 只决定连接时是否丢弃旧会话
+    """
+    if protocol != proto.MQTT_V5:
+        return 0 if clean else None
+    expiry = (properties or {}).get(proto.PROP_SESSION_EXPIRY, 0)
+    return None if expiry == SESSION_NEVER_EXPIRES else expiry
+
+
+class Session:
+    """代理侧会话基类，子类实现 deliver()"""
+
+    def __init__(self, client_id: str, clean: bool = True, expiry=_BY_CLEAN):
+        self.client_id = client_id
+        self.clean = clean
+        # 断开后保留的秒数 (0 为断开即结束，None 为永不过期)，缺省按 3.1.1 语义由 clean 决定
+        self.expiry = session_expiry(proto.MQTT_V311, clean) if expiry is _BY_CLEAN else expiry
+        self.expires_at = None      # 断开后的过期时刻 (time.monotonic())
+        self.subscriptions = {}     # 过滤器 -> qos
+
+    @property
+    def persistent(self) -> bool:
+        """断开后是否保留会话 (订阅与离线消息)"""
+        return self.expiry != 0
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and now >= self.expires_at
+
+    def deliver(self, topic: str, payload: bytes, qos: int, retain: bool, properties: dict):
+        raise NotImplementedError
+
+    def kick(self):
+        """同 ID 客户端重复连接时断开旧连接"""
+
+    def adopt(self, old_session):
+        """接管同 ID 的持久会话状态 (订阅之外的部分)"""
+
+
+class LocalBroker:
+    """进程内 MQTT 代理核心，线程安全"""
+
+    def __init__(self, max_queued: int = 1000, max_write_buffer: int = 1 << 20):
+        self.max_queued = max_queued
+        self.max_write_buffer = max_write_buffer
+        self._lock = threading.RLock()
+        self._tree = _TopicTree()
+        self._sessions = {}         # client_id -> Session
+        self._retained = {}         # topic -> (payload, qos, properties, 过期时间)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self.stats = {
+            'published': 0,
+            'delivered': 0,
+            'dropped': 0,
+            'sessions': 0,
+        }
+
+    # ---------- 会话管理 ----------
+
+    def attach(self, session: Session) -> bool:
+        """接入会话，若存在同 ID 持久会话则接管其订阅，返回会话是否已存在"""
+        present = False
+        with self._lock:
+            self._purge_expired()
+            old = self._sessions.get(session.client_id)
+            if old is not None and old is not session:
+                old.kick()
+                if not session.clean and old.persistent:
+                    for topic_filter, qos in old.subscriptions.items():
+                        self._tree.remove(old, topic_filter)
+                        self._tree.add(session, topic_filter, qos)
+                    session.subscriptions = old.subscriptions
+                    session.adopt(old)
+                    present = True
+                else:
+                    self._drop_subscriptions(old)
+            self._sessions[session.client_id] = session
+            self.stats['sessions'] = len(self._sessions)
+        return present
+
+    def detach(self, session: Session):
+        """断开会话: 非持久会话同时清理订阅，持久会话开始计算过期时间"""
+        with self._lock:
+            if self._sessions.get(session.client_id) is session:
+                if not session.persistent:
+                    self._drop_subscriptions(session)
+                    del self._sessions[session.client_id]
+                elif session.expiry is not None:
+                    session.expires_at = time.monotonic() + session.expiry
+            self._purge_expired()
+            self.stats['sessions'] = len(self._sessions)
+
+    def _purge_expired(self):
+        """清理已过期的离线持久会话 (调用方持有锁)"""
+        now = time.monotonic()
+        for client_id, session in [(k, v) for k, v in self._sessions.items() if v.expired(now)]:
+            self._drop_subscriptions(session)
+            del self._sessions[client_id]
+
+    def _drop_subscriptions(self, session: Session):
+        for topic_filter in list(session.subscriptions):
+            self._tree.remove(session, topic_filter)
+        session.subscriptions.clear()
+
+    # ---------- 订阅与发布 ----------
+
+    def subscribe(self, session: Session, topic_filter: str, qos: int) -> int:
+        """订阅主题，返回授予的 qos (0 / 1 / 0x80 失败)，保留消息需另行调用 send_retained()"""
+        try:
+            proto.split_shared(topic_filter)
+        except proto.ProtocolError:
+            return 0x80
+        granted = min(qos, 1)
+        with self._lock:
+            self._tree.add(session, topic_filter, granted)
+            session.subscriptions[topic_filter] = granted
+        return granted
+
+    def send_retained(self, session: Session, topic_filter: str):
+        """向新订阅投递匹配的保留消息 (共享订阅不投递)"""
+        group, real_filter = proto.split_shared(topic_filter)
+        granted = session.subscriptions.get(topic_filter)
+        if group is not None or granted is None:
+            return
+        now = time.time()
+        with self._lock:
+            retained = [
+                (topic, item) for topic, item in self._retained.items()
+                if proto.topic_matches(real_filter, topic)
+            ]
+        for topic, (payload, msg_qos, properties, expires) in retained:
+            if expires is None or expires > now:
+                session.deliver(topic, payload, min(granted, msg_qos), True, properties)
+
+    def unsubscribe(self, session: Session, topic_filter: str):
+        """取消订阅"""
+        with self._lock:
+            self._tree.remove(session, topic_filter)
+            session.subscriptions.pop(topic_filter, None)
+
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False,
+                properties: dict = None) -> int:
+        """发布消息，返回投递的订阅者数量"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif not isinstance(payload, bytes):
+            payload = bytes(payload)
+        properties = properties or {}
+        targets = {}
+        with self._lock:
+            self.stats['published'] += 1
+            if retain:
+                if payload:
+                    expiry = properties.get(proto.PROP_MESSAGE_EXPIRY)
+                    expires = time.time() + expiry if expiry else None
+                    self._retained[topic] = (bytes(payload), qos, properties, expires)
+                else:
+                    self._retained.pop(topic, None)
+            for node in self._tree.match(topic):
+                for session, sub_qos in node.subscribers.items():
+                    # 同一会话多个过滤器匹配时取最高 qos
+                    targets[session] = max(targets.get(session, 0), sub_qos)
+                for group in node.shared.values():
+                    session, sub_qos = group.pick()
+                    targets[session] = max(targets.get(session, 0), sub_qos)
+        for session, sub_qos in targets.items():
+            session.deliver(topic, payload, min(qos, sub_qos), False, properties)
+        with self._lock:
+            self.stats['delivered'] += len(targets)
+        return len(targets)
+
+    # ---------- TCP 服务端 ----------
+
+    def start(self, host: str = '127.0.0.1', port: int = 1883):
+        """在后台线程启动 TCP 服务端，返回实际监听端口"""
+        ready = threading.Event()
+        result = {}
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._server = self._loop.run_until_complete(
+                    asyncio.start_server(self._handle_connection, host, port)
+                )
+                result['port'] = self._server.sockets[0].getsockname()[1]
+            except Exception as e:
+                result['error'] = e
+                ready.set()
+                return
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='local-mqtt-broker', daemon=True)
+        self._thread.start()
+        ready.wait()
+        if 'error' in result:
+            raise result['error']
+        print(f"[本地代理] 监听 {host}:{result['port']}")
+        return result['port']
+
+    def stop(self):
+        """停止 TCP 服务端"""
+        if self._loop is None:
+            return
+
+        def shutdown():
+            self._server.close()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(shutdown)
+        self._thread.join(timeout=5)
+        self._loop = None
+
+    async def serve_forever(self, host: str = '127.0.0.1', port: int = 1883):
+        """在当前事件循环中运行 TCP 服务端"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"[本地代理] 监听 {host}:{port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        session = None
+        try:
+            packet_type, _, body = await asyncio.wait_for(proto.read_packet(reader), 10)
+            if packet_type != proto.CONNECT:
+                return
+            info = proto.parse_connect(body)
+            protocol = info['protocol']
+            client_id = info['client_id'] or f'local_{id(writer):x}'
+            session = _TcpSession(self, client_id, info['clean'], protocol,
+                                  session_expiry(protocol, info['clean'], info['properties']))
+            session_present = self.attach(session)
+            session.bind(writer, asyncio.get_running_loop())
+            writer.write(proto.build_connack(session_present, 0, protocol))
+            session.resume()
+            keepalive = info['keepalive'] * 1.5 if info['keepalive'] else None
+
+            while True:
+                packet_type, flags, body = await asyncio.wait_for(
+                    proto.read_packet(reader), keepalive
+                )
+                if packet_type == proto.PUBLISH:
+                    msg = proto.parse_publish(flags, body, protocol)
+                    self.publish(msg['topic'], msg['payload'], min(msg['qos'], 1),
+                                 msg['retain'], msg['properties'])
+                    if msg['qos'] == 1:
+                        writer.write(proto.build_ack(proto.PUBACK, msg['packet_id'], protocol))
+                    elif msg['qos'] == 2:
+                        writer.write(proto.build_ack(proto.PUBREC, msg['packet_id'], protocol))
+                elif packet_type == proto.PUBREL:
+                    writer.write(proto.build_ack(proto.PUBCOMP, proto.parse_packet_id(body), protocol))
+                elif packet_type == proto.PUBACK:
+                    session.acked(proto.parse_packet_id(body))
+                elif packet_type == proto.SUBSCRIBE:
+                    packet_id, topics = proto.parse_subscribe(body, protocol)
+                    granted = [self.subscribe(session, f, q) for f, q in topics]
+                    writer.write(proto.build_suback(packet_id, granted, protocol))
+                    for topic_filter, _ in topics:
+                        self.send_retained(session, topic_filter)
+                elif packet_type == proto.UNSUBSCRIBE:
+                    packet_id, topics = proto.parse_unsubscribe(body, protocol)
+                    for topic_filter in topics:
+                        self.unsubscribe(session, topic_filter)
+                    writer.write(proto.build_unsuback(packet_id, len(topics), protocol))
+                elif packet_type == proto.PINGREQ:
+                    writer.write(proto.pack_packet(proto.PINGRESP, 0))
+                elif packet_type == proto.DISCONNECT:
+                    # MQTT 5 断开时可更新会话过期时间，设为 0 表示结束持久会话
+                    if protocol == proto.MQTT_V5 and len(body) > 1:
+                        properties, _ = proto.decode_properties(body, 1)
+                        if proto.PROP_SESSION_EXPIRY in properties:
+                            session.expiry = session_expiry(protocol, False, properties)
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except proto.ProtocolError as e:
+            print(f"[本地代理] 协议错误: {e}")
+        finally:
+            if session is not None:
+                session.unbind(writer)
+                self.detach(session)
+            writer.close()
+
+
+class _TcpSession(Session):
+    """TCP 连接对应的会话，支持持久会话离线排队"""
+
+    def __init__(self, broker: LocalBroker, client_id: str, clean: bool, protocol: int, expiry=_BY_CLEAN):
+        super().__init__(client_id, clean, expiry)
+        self.broker = broker
+        self.protocol = protocol
+        self.writer = None
+        self.loop = None
+        self.inflight = {}          # 报文标识符 -> 报文
+        self.queue = deque(maxlen=broker.max_queued)
+        self._ids = itertools.count(1)
+
+    def bind(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+
+    def unbind(self, writer):
+        if self.writer is writer:
+            self.writer = None
+
+    def kick(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            self.loop.call_soon_threadsafe(writer.close)
+
+    def adopt(self, old_session):
+        if isinstance(old_session, _TcpSession):
+            self.inflight = old_session.inflight
+            self.queue.extend(old_session.queue)
+            self._ids = old_session._ids
+
+    def resume(self):
+        """重连后重发未确认消息并投递离线队列，离线期间已过期的消息丢弃，其余按剩余时间更新过期属性"""
+        for packet in self.inflight.values():
+            self.writer.write(bytes([packet[0] | 0x08]) + packet[1:])
+        now = time.monotonic()
+        while self.queue:
+            topic, payload, qos, retain, properties, queued_at = self.queue.popleft()
+            expiry = properties.get(proto.PROP_MESSAGE_EXPIRY) if properties else None
+            if expiry:
+                remaining = expiry - int(now - queued_at)
+                if remaining <= 0:
+                    self.broker.stats['dropped'] += 1
+                    continue
+                properties = {**properties, proto.PROP_MESSAGE_EXPIRY: remaining}
+            self._send(topic, payload, qos, retain, properties)
+
+    def _enqueue(self, topic, payload, qos, retain, properties):
+        """离线排队 (仅持久会话的 QoS>0 消息)，记录入队时间以便计算过期"""
+        if qos > 0 and self.persistent:
+            self.queue.append((topic, payload, qos, retain, properties, time.monotonic()))
+
+    def acked(self, packet_id: int):
+        self.inflight.pop(packet_id, None)
+
+    def deliver(self, topic, payload, qos, retain, properties):
+        if self.loop is None:
+            self._enqueue(topic, bytes(payload), qos, retain, properties)
+            return
+        args = (topic, bytes(payload), qos, retain, properties)
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._send(*args)
+        else:
+            self.loop.call_soon_threadsafe(self._send, *args)
+
+    def _send(self, topic, payload, qos, retain, properties):
+        if self.writer is None:
+            self._enqueue(topic, payload, qos, retain, properties)
+            return
+        # 慢消费者: 写缓冲超限时丢弃 QoS 0 消息
+        if qos == 0 and self.writer.transport.get_write_buffer_size() > self.broker.max_write_buffer:
+            self.broker.stats['dropped'] += 1
+            return
+        packet_id = None
+        if qos > 0:
+            packet_id = next(self._ids) % 65535 + 1
+        packet = proto.build_publish(topic, payload, qos, packet_id, retain,
+                                     protocol=self.protocol, properties=properties)
+        if packet_id is not None:
+            self.inflight[packet_id] = packet
+        self.writer.write(packet)
+
+
+class LoopbackMqttClient(Session):
+    """
+    进程内回环客户端
+
+    接口与 MqttClient 保持一致 (connect / publish / subscribe / unsubscribe /
+    disconnect / connected)，消息直接经 LocalBroker 路由，不经过网络。
+    回调在发布方线程中同步执行。
+    """
+
+    def __init__(self, config: dict, broker: LocalBroker = None):
+        clean = config.get('clean', True)
+        super().__init__(config.get('client_id') or f'loopback_{id(self):x}', clean, session_expiry(
+            config.get('protocol', proto.MQTT_V311), clean,
+            {proto.PROP_SESSION_EXPIRY: config['session_expiry']} if config.get('session_expiry') else None
+        ))
+        self.config = config
+        self.broker = broker or get_default_broker()
+        self.connected = False
+        self.message_callback = None
+        self.metrics_callback = None
+        self.on_connected = None
+        self.session_present = False
+        # 回环投递是同步的，不存在等待确认的消息
+        self.inflight_count = 0
+
+    def kick(self):
+        self.connected = False
+
+    def deliver(self, topic, payload, qos, retain, properties):
+        if self.metrics_callback:
+            self.metrics_callback('receive', topic, None)
+        max_payload = self.config.get('max_payload')
+        if max_payload and len(payload) > max_payload:
+            if self.metrics_callback:
+                self.metrics_callback('dropped', topic, None)
+            return
+        if self.connected and self.message_callback:
+            if self.config.get('raw_payload'):
+                # 所有订阅者共享同一份只读 payload，不复制
+                self.message_callback(topic, memoryview(payload))
+            else:
+                self.message_callback(topic, bytes(payload).decode('utf-8'))
+
+    def connect(self, wait: bool = True):
+        """连接到本地代理 (总是立即完成，wait 仅为与 MqttClient 保持一致)"""
+        self.session_present = self.broker.attach(self)
+        self.connected = True
+        if self.on_connected:
+            self.on_connected(self)
+        return self
+
+    def publish(self, topic: str, message, qos: int = None, retain: bool = False, expiry: int = None):
+        """发布消息，expiry 为消息过期时间 (秒)"""
+        if not self.connected:
+            print("[错误] 客户端未连接")
+            return
+        if qos is None:
+            qos = self.config.get('qos', 1)
+        if isinstance(message, (dict, list)):
+            payload = json.dumps(message, ensure_ascii=False)
+        elif isinstance(message, (bytes, bytearray)):
+            payload = message
+        else:
+            payload = str(message)
+        properties = {proto.PROP_MESSAGE_EXPIRY: int(expiry)} if expiry else None
+        self.broker.publish(topic, payload, qos, retain, properties)
+        if self.metrics_callback:
+            self.metrics_callback('publish', topic, None)
+
+    def subscribe(self, topics, callback=None):
+        """订阅主题"""
+        if not self.connected:
+            print("[错误] 客户端未连接")
+            return
+        self.message_callback = callback
+        if isinstance(topics, str):
+            topics = [topics]
+        for topic_filter in topics:
+            self.broker.subscribe(self, topic_filter, self.config.get('qos', 1))
+            self.broker.send_retained(self, topic_filter)
+
+    def unsubscribe(self, topics):
+        """取消订阅"""
+        if isinstance(topics, str):
+            topics = [topics]
+        for topic_filter in topics:
+            self.broker.unsubscribe(self, topic_filter)
+
+    def disconnect(self, keep_session: bool = False):
+        """断开连接，持久会话默认随之结束 (与 MqttClient 一致)"""
+        self.connected = False
+        if not keep_session:
+            self.expiry = 0
+        self.broker.detach(self)
+
+
+_default_broker = None
+_default_lock = threading.Lock()
+
+
+def get_default_broker() -> LocalBroker:
+    """返回进程级共享的本地代理实例"""
+    global _default_broker
+    with _default_lock:
+        if _default_broker is None:
+            _default_broker = LocalBroker()
+        return _default_broker
+
+
+def run_fanout_bench(clients: int, messages: int, shared: bool = False):
+    """扇出压测: clients 个回环订阅者，发布 messages 条消息"""
+    broker = LocalBroker()
+    received = [0]
+
+    def on_message(topic, message):
+        received[0] += 1
+
+    subscribers = []
+    topic_filter = '$share/bench/todo/sync' if shared else 'todo/+'
+    for i in range(clients):
+        client = LoopbackMqttClient({'client_id': f'bench_{i}', 'qos': 1}, broker).connect()
+        client.subscribe(topic_filter, on_message)
+        subscribers.append(client)
+
+    publisher = LoopbackMqttClient({'client_id': 'bench_pub', 'qos': 1}, broker).connect()
+    payload = json.dumps({'event': 'task_updated', 'data': {'id': 1, 'title': 'bench'}})
+    start = time.perf_counter()
+    for _ in range(messages):
+        publisher.publish('todo/sync', payload)
+    elapsed = time.perf_counter() - start
+
+    print(f"[压测] 订阅者: {clients}, 消息: {messages}, 共享订阅: {shared}")
+    print(f"[压测] 投递: {received[0]} 条, 耗时: {elapsed:.3f}s, "
+          f"吞吐: {received[0] / elapsed:,.0f} 条/秒")
+    return received[0], elapsed
+
+
+# ============== 使用示例 ==============
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地 MQTT 代理')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--bench', type=int, metavar='CLIENTS', help='运行扇出压测')
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--shared', action='store_true', help='压测使用共享订阅')
+    args = parser.parse_args()
+
+    if args.bench:
+        run_fanout_bench(args.bench, args.messages, args.shared)
+    else:
+        try:
+            asyncio.run(LocalBroker().serve_forever(args.host, args.port))
+        except KeyboardInterrupt:
+            print("[本地代理] 已停止")
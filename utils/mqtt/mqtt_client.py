@@ -8,13 +8,26 @@ MQTT 客户端 - Python
 - 普通连接 (tcp://host:1883)
 - TLS/SSL 连接 (ssl://host:8883)
 - EMQX Cloud 等云服务
+- MQTT 3.1.1 / 5.0，持久会话 (clean=False)，消息过期时间 (5.0)
 """
 
 import ssl
 import json
+import logging
+import threading
 import time
 import random
-from paho.mqtt.client import Client, CallbackAPIVersion
+from paho.mqtt.client import Client, CallbackAPIVersion, MQTTv311, MQTTv5
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+try:
+    from utils.mqtt.mqtt_protocol import preview_payload
+except ImportError:
+    from mqtt_protocol import preview_payload
+
+# 消息内容只在 DEBUG 级别以截断预览的形式输出
+logger = logging.getLogger(__name__)
 
 # ============== 配置区域 ==============
 CONFIG = {
@@ -25,10 +38,17 @@ CONFIG = {
     'password': '',  # 密码（如果需要）
     'topic': 'test/topic',
     'qos': 1,
+    # 会话
+    'protocol': MQTTv311,  # MQTTv311 (4) 或 MQTTv5 (5)
+    'clean': True,         # False 为持久会话: 断线期间 QoS 1 订阅的消息由代理保存，重连后补发
+    'session_expiry': 0,   # 持久会话在断开后保留的秒数 (仅 MQTT 5)
     # TLS 配置
     'use_tls': False,
     'ca_cert': None,  # CA 证书路径
     'insecure': False,  # 是否跳过证书验证
+    # 消息处理
+    'raw_payload': False,  # True 时回调收到 memoryview (不解码、不复制)，否则为 str
+    'max_payload': None,   # 超过此字节数的消息直接丢弃，None 为不限
 }
 # =====================================
 
@@ -39,16 +59,33 @@ class MqttClient:
     def __init__(self, config: dict):
         self.config = config
         # paho-mqtt 2.x 需要指定 CallbackAPIVersion
+        self.protocol = config.get('protocol', MQTTv311)
+        client_args = {}
+        if self.protocol != MQTTv5:
+            # 3.1.1 的会话标志在构造时指定，5.0 在连接时指定 (clean_start)
+            client_args['clean_session'] = config.get('clean', True)
         self.client = Client(
             callback_api_version=CallbackAPIVersion.VERSION2,
-            client_id=config['client_id']
+            client_id=config['client_id'],
+            protocol=self.protocol,
+            **client_args
         )
         self.connected = False
+        # 最近一次连接时代理是否保留了之前的会话 (订阅仍有效，离线消息会补发)
+        self.session_present = False
+        # 指标回调: metrics_callback(kind, topic, seconds)，kind 为 publish / ack / receive / dropped
+        self.metrics_callback = None
+        # 连接 (含自动重连) 成功后回调 on_connected(client)，适合在此订阅主题
+        self.on_connected = None
+        # mid -> (发布时间, MQTTMessageInfo)；发布线程与网络线程都会访问，由 _inflight_lock 保护
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
         
         # 设置回调
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
         
         # 设置认证信息
         if config.get('username'):
@@ -90,7 +127,14 @@ class MqttClient:
         
         if rc_value == 0:
             self.connected = True
-            print(f"[已连接] 连接到代理: {self.config['broker']}:{self.config['port']}")
+            self.session_present = bool(getattr(flags, 'session_present', False))
+            print(f"[已连接] 连接到代理: {self.config['broker']}:{self.config['port']}"
+                  f"{' (恢复会话)' if self.session_present else ''}")
+            if self.on_connected:
+                try:
+                    self.on_connected(self)
+                except Exception as e:
+                    print(f"[连接回调错误] {e}")
         else:
             error_msgs = {
                 1: "协议版本不正确",
@@ -104,25 +148,89 @@ class MqttClient:
     def _on_disconnect(self, client, userdata, disconnect_flags, rc, properties=None):
         """断开回调"""
         self.connected = False
+        # 未确认的 QoS>0 消息由 paho 在重连后重发，确认后照常移除，这里只清理已确认的残留
+        self._prune_inflight()
         rc_value = rc.value if hasattr(rc, 'value') else rc
         print(f"[已断开] 连接已关闭, 返回码: {rc_value}")
     
+    def _prune_inflight(self):
+        """移除 paho 已标记为发送完成、但确认回调未能匹配到的记录"""
+        with self._inflight_lock:
+            for mid in [mid for mid, (_, info) in self._inflight.items() if info.is_published()]:
+                del self._inflight[mid]
+    
+    @property
+    def inflight_count(self) -> int:
+        """等待代理确认的 QoS>0 消息数"""
+        self._prune_inflight()
+        return len(self._inflight)
+    
+    def _emit_metric(self, kind, topic=None, seconds=None):
+        if self.metrics_callback:
+            try:
+                self.metrics_callback(kind, topic, seconds)
+            except Exception as e:
+                print(f"[指标错误] {e}")
+    
+    def _on_publish(self, client, userdata, mid, rc=None, properties=None):
+        """发布确认回调 (QoS 1 收到 PUBACK)"""
+        with self._inflight_lock:
+            entry = self._inflight.pop(mid, None)
+        if entry is not None:
+            self._emit_metric('ack', seconds=time.perf_counter() - entry[0])
+    
     def _on_message(self, client, userdata, msg):
         """消息回调"""
-        payload = msg.payload.decode('utf-8')
-        print(f"[收到消息] 主题: {msg.topic}, 消息: {payload}")
+        self._emit_metric('receive', msg.topic)
+        max_payload = self.config.get('max_payload')
+        if max_payload and len(msg.payload) > max_payload:
+            self._emit_metric('dropped', msg.topic)
+            logger.warning("[消息过大] 主题: %s, %d 字节 (上限 %d)，已丢弃", msg.topic, len(msg.payload), max_payload)
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[收到消息] 主题: %s, 消息: %s", msg.topic, preview_payload(msg.payload))
         
         # 如果有自定义回调，调用它
         if hasattr(self, 'message_callback') and self.message_callback:
-            self.message_callback(msg.topic, payload)
+            if self.config.get('raw_payload'):
+                self.message_callback(msg.topic, memoryview(msg.payload))
+            else:
+                self.message_callback(msg.topic, msg.payload.decode('utf-8'))
+    
+    def _connect_args(self) -> dict:
+        """MQTT 5 的会话参数: clean_start 与会话过期时间"""
+        if self.protocol != MQTTv5:
+            return {}
+        properties = None
+        if self.config.get('session_expiry'):
+            properties = Properties(PacketTypes.CONNECT)
+            properties.SessionExpiryInterval = int(self.config['session_expiry'])
+        return {'clean_start': self.config.get('clean', True), 'properties': properties}
     
-    def connect(self):
-        """连接到 MQTT 代理"""
+    def connect(self, wait: bool = True):
+        """
+        连接到 MQTT 代理
+        
+        Args:
+            wait: 是否等待连接建立 (最多 5 秒)；为 False 时在后台线程中连接并自动重连，
+                  连接结果通过 on_connected 回调得知
+        """
+        if not wait:
+            self.client.connect_async(
+                self.config['broker'],
+                self.config['port'],
+                keepalive=60,
+                **self._connect_args()
+            )
+            self.client.loop_start()
+            return self
+        
         try:
             self.client.connect(
                 self.config['broker'], 
                 self.config['port'], 
-                keepalive=60
+                keepalive=60,
+                **self._connect_args()
             )
             self.client.loop_start()
             # 等待连接建立
@@ -135,14 +243,16 @@ class MqttClient:
         
         return self
     
-    def publish(self, topic: str, message, qos: int = None):
+    def publish(self, topic: str, message, qos: int = None, retain: bool = False, expiry: int = None):
         """
         发布消息
         
         Args:
             topic: 主题
-            message: 消息内容（字符串或字典）
+            message: 消息内容（字符串、字典或 bytes）
             qos: 服务质量等级 (0, 1, 2)
+            retain: 是否为保留消息
+            expiry: 消息过期时间 (秒)，代理不再投递过期消息 (仅 MQTT 5)
         """
         if not self.connected:
             print("[错误] 客户端未连接")
@@ -154,13 +264,29 @@ class MqttClient:
         # 处理消息
         if isinstance(message, (dict, list)):
             payload = json.dumps(message, ensure_ascii=False)
+        elif isinstance(message, (bytes, bytearray)):
+            payload = message
         else:
             payload = str(message)
         
-        result = self.client.publish(topic, payload, qos=qos)
+        start = time.perf_counter()
+        properties = None
+        if expiry and self.protocol == MQTTv5:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.MessageExpiryInterval = int(expiry)
+        # mid 由 paho 在 publish 内分配，无法事先登记；确认可能先于下面的登记到达 (确认回调在 paho 的锁内执行，
+        # 这里不能持有 _inflight_lock 调用 publish，否则锁顺序相反会死锁)，登记后若已确认则立即移除
+        result = self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
         
         if result.rc == 0:
-            print(f"[已发布] 主题: {topic}, 消息: {payload}")
+            if qos > 0:
+                with self._inflight_lock:
+                    self._inflight[result.mid] = (start, result)
+                    if result.is_published():
+                        del self._inflight[result.mid]
+            self._emit_metric('publish', topic)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[已发布] 主题: %s, 消息: %s", topic, preview_payload(payload))
         else:
             print(f"[发布失败] 错误码: {result.rc}")
     
@@ -214,15 +340,29 @@ class MqttClient:
         else:
             print(f"[取消订阅失败] 错误码: {result}")
     
-    def disconnect(self):
-        """断开连接"""
+    def disconnect(self, keep_session: bool = False):
+        """
+        断开连接
+        
+        Args:
+            keep_session: 是否保留持久会话；默认在断开时结束会话 (MQTT 5)，
+                          代理不再为已退出的客户端保存离线消息
+        """
+        properties = None
+        if self.protocol == MQTTv5 and not keep_session and self.config.get('session_expiry'):
+            properties = Properties(PacketTypes.DISCONNECT)
+            properties.SessionExpiryInterval = 0
+        self.client.disconnect(properties=properties)
         self.client.loop_stop()
-        self.client.disconnect()
+        with self._inflight_lock:
+            self._inflight.clear()
         print("[已断开] 客户端已断开连接")
 
 
 # ============== 使用示例 ==============
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    
     # 示例1: 普通连接
     print("=== 普通连接示例 ===")
     mqtt_client = MqttClient(CONFIG)
@@ -0,0 +1,467 @@
+"""
+MQTT 协议编解码 - Python
+
+纯标准库实现的 MQTT 3.1.1 / 5.0 报文编解码，供本地代理 (local_broker.py)
+等不依赖 paho 的组件复用。
+
+支持:
+- CONNECT / CONNACK / PUBLISH / PUBACK / SUBSCRIBE / SUBACK
+- UNSUBSCRIBE / UNSUBACK / PINGREQ / PINGRESP / DISCONNECT
+- MQTT 5 属性 (Properties) 的解析与编码
+- 主题过滤器匹配 (+ / # 通配符, $share 共享订阅)
+"""
+
+import struct
+
+# ============== 报文类型 ==============
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# 协议级别
+MQTT_V311 = 4
+MQTT_V5 = 5
+
+# 剩余长度上限 (规范规定的 4 字节变长整数上限)
+MAX_REMAINING_LENGTH = 268435455
+
+# MQTT 5 属性标识 -> 数据类型
+_PROPERTY_TYPES = {
+    0x01: 'byte',       # Payload Format Indicator
+    0x02: 'int32',      # Message Expiry Interval
+    0x03: 'str',        # Content Type
+    0x08: 'str',        # Response Topic
+    0x09: 'bin',        # Correlation Data
+    0x0B: 'varint',     # Subscription Identifier
+    0x11: 'int32',      # Session Expiry Interval
+    0x12: 'str',        # Assigned Client Identifier
+    0x13: 'int16',      # Server Keep Alive
+    0x15: 'str',        # Authentication Method
+    0x16: 'bin',        # Authentication Data
+    0x17: 'byte',       # Request Problem Information
+    0x18: 'int32',      # Will Delay Interval
+    0x19: 'byte',       # Request Response Information
+    0x1A: 'str',        # Response Information
+    0x1C: 'str',        # Server Reference
+    0x1F: 'str',        # Reason String
+    0x21: 'int16',      # Receive Maximum
+    0x22: 'int16',      # Topic Alias Maximum
+    0x23: 'int16',      # Topic Alias
+    0x24: 'byte',       # Maximum QoS
+    0x25: 'byte',       # Retain Available
+    0x26: 'pair',       # User Property
+    0x27: 'int32',      # Maximum Packet Size
+    0x28: 'byte',       # Wildcard Subscription Available
+    0x29: 'byte',       # Subscription Identifier Available
+    0x2A: 'byte',       # Shared Subscription Available
+}
+
+# 常用属性标识
+PROP_MESSAGE_EXPIRY = 0x02
+PROP_SESSION_EXPIRY = 0x11
+PROP_TOPIC_ALIAS = 0x23
+PROP_USER_PROPERTY = 0x26
+
+
+class ProtocolError(Exception):
+    """报文格式错误"""
+
+
+# ============== 基础编码 ==============
+
+def encode_varint(value: int) -> bytes:
+    """编码变长整数 (剩余长度 / 属性长度)"""
+    if value < 0 or value > MAX_REMAINING_LENGTH:
+        raise ProtocolError(f'变长整数越界: {value}')
+    out = bytearray()
+    while True:
+        byte = value % 128
+        value //= 128
+        if value:
+            byte |= 0x80
+        out.append(byte)
+        if not value:
+            return bytes(out)
+
+
+def decode_varint(buf, offset: int = 0):
+    """从缓冲区解码变长整数，返回 (值, 新偏移)"""
+    multiplier = 1
+    value = 0
+    for _ in range(4):
+        if offset >= len(buf):
+            raise ProtocolError('变长整数不完整')
+        byte = buf[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, offset
+        multiplier *= 128
+    raise ProtocolError('变长整数超过 4 字节')
+
+
+def pack_str(value) -> bytes:
+    """编码 UTF-8 字符串 (2 字节长度前缀)"""
+    data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    return struct.pack('!H', len(data)) + data
+
+
+def unpack_bin(buf, offset: int):
+    """解码带长度前缀的二进制数据，返回 (bytes, 新偏移)"""
+    if offset + 2 > len(buf):
+        raise ProtocolError('字符串长度不完整')
+    (length,) = struct.unpack_from('!H', buf, offset)
+    offset += 2
+    if offset + length > len(buf):
+        raise ProtocolError('字符串内容不完整')
+    return bytes(buf[offset:offset + length]), offset + length
+
+
+def unpack_str(buf, offset: int):
+    """解码 UTF-8 字符串，返回 (str, 新偏移)"""
+    data, offset = unpack_bin(buf, offset)
+    return data.decode('utf-8'), offset
+
+
+def pack_packet(packet_type: int, flags: int, body: bytes = b'') -> bytes:
+    """组装完整报文: 固定头 + 剩余长度 + 报文体"""
+    return bytes([(packet_type << 4) | (flags & 0x0F)]) + encode_varint(len(body)) + body
+
+
+# ============== MQTT 5 属性 ==============
+
+def encode_properties(properties) -> bytes:
+    """编码属性字典 {属性标识: 值}，User Property 的值为 [(k, v), ...]"""
+    if not properties:
+        return b'\x00'
+    out = bytearray()
+    for prop_id, value in properties.items():
+        kind = _PROPERTY_TYPES.get(prop_id)
+        if kind is None:
+            raise ProtocolError(f'未知属性: {prop_id:#x}')
+        if kind == 'pair':
+            for key, val in value:
+                out.append(prop_id)
+                out += pack_str(key) + pack_str(val)
+            continue
+        out.append(prop_id)
+        if kind == 'byte':
+            out.append(value)
+        elif kind == 'int16':
+            out += struct.pack('!H', value)
+        elif kind == 'int32':
+            out += struct.pack('!I', value)
+        elif kind == 'varint':
+            out += encode_varint(value)
+        else:
+            out += pack_str(value)
+    return encode_varint(len(out)) + bytes(out)
+
+
+def decode_properties(buf, offset: int):
+    """解码属性块，返回 (属性字典, 新偏移)"""
+    length, offset = decode_varint(buf, offset)
+    end = offset + length
+    if end > len(buf):
+        raise ProtocolError('属性长度越界')
+    properties = {}
+    while offset < end:
+        prop_id = buf[offset]
+        offset += 1
+        kind = _PROPERTY_TYPES.get(prop_id)
+        if kind is None:
+            raise ProtocolError(f'未知属性: {prop_id:#x}')
+        if kind == 'byte':
+            value = buf[offset]
+            offset += 1
+        elif kind == 'int16':
+            (value,) = struct.unpack_from('!H', buf, offset)
+            offset += 2
+        elif kind == 'int32':
+            (value,) = struct.unpack_from('!I', buf, offset)
+            offset += 4
+        elif kind == 'varint':
+            value, offset = decode_varint(buf, offset)
+        elif kind == 'bin':
+            value, offset = unpack_bin(buf, offset)
+        elif kind == 'str':
+            value, offset = unpack_str(buf, offset)
+        else:
+            key, offset = unpack_str(buf, offset)
+            val, offset = unpack_str(buf, offset)
+            properties.setdefault(prop_id, []).append((key, val))
+            continue
+        properties[prop_id] = value
+    return properties, end
+
+
+# ============== 报文构造 ==============
+
+def build_connect(client_id: str, keepalive: int = 60, username: str = None,
+                  password: str = None, clean: bool = True,
+                  protocol: int = MQTT_V311, properties=None) -> bytes:
+    """构造 CONNECT 报文"""
+    flags = 0x02 if clean else 0x00
+    if username:
+        flags |= 0x80
+        if password is not None:
+            flags |= 0x40
+    body = pack_str('MQTT') + bytes([protocol, flags]) + struct.pack('!H', keepalive)
+    if protocol == MQTT_V5:
+        body += encode_properties(properties)
+    body += pack_str(client_id)
+    if username:
+        body += pack_str(username)
+        if password is not None:
+            body += pack_str(password)
+    return pack_packet(CONNECT, 0, body)
+
+
+def build_connack(session_present: bool, return_code: int = 0,
+                  protocol: int = MQTT_V311, properties=None) -> bytes:
+    """构造 CONNACK 报文"""
+    body = bytes([1 if session_present else 0, return_code])
+    if protocol == MQTT_V5:
+        body += encode_properties(properties)
+    return pack_packet(CONNACK, 0, body)
+
+
+def build_publish(topic: str, payload, qos: int = 0, packet_id: int = None,
+                  retain: bool = False, dup: bool = False,
+                  protocol: int = MQTT_V311, properties=None) -> bytes:
+    """构造 PUBLISH 报文，payload 可为 bytes / bytearray / memoryview"""
+    flags = (qos << 1) | (0x08 if dup else 0) | (0x01 if retain else 0)
+    header = pack_str(topic)
+    if qos > 0:
+        header += struct.pack('!H', packet_id)
+    if protocol == MQTT_V5:
+        header += encode_properties(properties)
+    remaining = len(header) + len(payload)
+    return bytes([(PUBLISH << 4) | flags]) + encode_varint(remaining) + header + bytes(payload)
+
+
+def build_ack(packet_type: int, packet_id: int, protocol: int = MQTT_V311,
+              reason_code: int = 0) -> bytes:
+    """构造 PUBACK / PUBREC / PUBCOMP / PUBREL 报文"""
+    flags = 0x02 if packet_type == PUBREL else 0
+    body = struct.pack('!H', packet_id)
+    if protocol == MQTT_V5 and reason_code:
+        body += bytes([reason_code])
+    return pack_packet(packet_type, flags, body)
+
+
+def build_subscribe(packet_id: int, topics, protocol: int = MQTT_V311) -> bytes:
+    """构造 SUBSCRIBE 报文，topics 为 [(过滤器, qos), ...]"""
+    body = struct.pack('!H', packet_id)
+    if protocol == MQTT_V5:
+        body += b'\x00'
+    for topic_filter, qos in topics:
+        body += pack_str(topic_filter) + bytes([qos])
+    return pack_packet(SUBSCRIBE, 0x02, body)
+
+
+def build_suback(packet_id: int, granted, protocol: int = MQTT_V311) -> bytes:
+    """构造 SUBACK 报文"""
+    body = struct.pack('!H', packet_id)
+    if protocol == MQTT_V5:
+        body += b'\x00'
+    return pack_packet(SUBACK, 0, body + bytes(granted))
+
+
+def build_unsubscribe(packet_id: int, topics, protocol: int = MQTT_V311) -> bytes:
+    """构造 UNSUBSCRIBE 报文"""
+    body = struct.pack('!H', packet_id)
+    if protocol == MQTT_V5:
+        body += b'\x00'
+    for topic_filter in topics:
+        body += pack_str(topic_filter)
+    return pack_packet(UNSUBSCRIBE, 0x02, body)
+
+
+def build_unsuback(packet_id: int, count: int, protocol: int = MQTT_V311) -> bytes:
+    """构造 UNSUBACK 报文"""
+    body = struct.pack('!H', packet_id)
+    if protocol == MQTT_V5:
+        body += b'\x00' + bytes(count)
+    return pack_packet(UNSUBACK, 0, body)
+
+
+# ============== 报文解析 ==============
+
+def parse_connect(body):
+    """解析 CONNECT 报文体，返回字段字典"""
+    name, offset = unpack_str(body, 0)
+    if name not in ('MQTT', 'MQIsdp'):
+        raise ProtocolError(f'未知协议名: {name}')
+    protocol = body[offset]
+    flags = body[offset + 1]
+    (keepalive,) = struct.unpack_from('!H', body, offset + 2)
+    offset += 4
+    properties = {}
+    if protocol == MQTT_V5:
+        properties, offset = decode_properties(body, offset)
+    client_id, offset = unpack_str(body, offset)
+    if flags & 0x04:
+        # 遗嘱消息: 本实现仅跳过
+        if protocol == MQTT_V5:
+            _, offset = decode_properties(body, offset)
+        _, offset = unpack_bin(body, offset)
+        _, offset = unpack_bin(body, offset)
+    username = password = None
+    if flags & 0x80:
+        username, offset = unpack_str(body, offset)
+    if flags & 0x40:
+        password, offset = unpack_str(body, offset)
+    return {
+        'protocol': protocol,
+        'clean': bool(flags & 0x02),
+        'keepalive': keepalive,
+        'client_id': client_id,
+        'username': username,
+        'password': password,
+        'properties': properties,
+    }
+
+
+def parse_publish(flags: int, body, protocol: int = MQTT_V311):
+    """解析 PUBLISH 报文，payload 以 memoryview 返回以避免拷贝"""
+    qos = (flags >> 1) & 0x03
+    topic, offset = unpack_str(body, 0)
+    packet_id = None
+    if qos > 0:
+        (packet_id,) = struct.unpack_from('!H', body, offset)
+        offset += 2
+    properties = {}
+    if protocol == MQTT_V5:
+        properties, offset = decode_properties(body, offset)
+    return {
+        'topic': topic,
+        'payload': memoryview(body)[offset:],
+        'qos': qos,
+        'retain': bool(flags & 0x01),
+        'dup': bool(flags & 0x08),
+        'packet_id': packet_id,
+        'properties': properties,
+    }
+
+
+def parse_packet_id(body) -> int:
+    """读取报文体开头的报文标识符"""
+    (packet_id,) = struct.unpack_from('!H', body, 0)
+    return packet_id
+
+
+def parse_subscribe(body, protocol: int = MQTT_V311):
+    """解析 SUBSCRIBE 报文，返回 (报文标识符, [(过滤器, qos), ...])"""
+    packet_id = parse_packet_id(body)
+    offset = 2
+    if protocol == MQTT_V5:
+        _, offset = decode_properties(body, offset)
+    topics = []
+    while offset < len(body):
+        topic_filter, offset = unpack_str(body, offset)
+        topics.append((topic_filter, body[offset] & 0x03))
+        offset += 1
+    return packet_id, topics
+
+
+def parse_unsubscribe(body, protocol: int = MQTT_V311):
+    """解析 UNSUBSCRIBE 报文，返回 (报文标识符, [过滤器, ...])"""
+    packet_id = parse_packet_id(body)
+    offset = 2
+    if protocol == MQTT_V5:
+        _, offset = decode_properties(body, offset)
+    topics = []
+    while offset < len(body):
+        topic_filter, offset = unpack_str(body, offset)
+        topics.append(topic_filter)
+    return packet_id, topics
+
+
+def parse_suback(body, protocol: int = MQTT_V311):
+    """解析 SUBACK 报文，返回 (报文标识符, [授予的 qos, ...])"""
+    packet_id = parse_packet_id(body)
+    offset = 2
+    if protocol == MQTT_V5:
+        _, offset = decode_properties(body, offset)
+    return packet_id, list(body[offset:])
+
+
+def parse_connack(body, protocol: int = MQTT_V311):
+    """解析 CONNACK 报文，返回 (会话是否存在, 返回码, 属性)"""
+    properties = {}
+    if protocol == MQTT_V5 and len(body) > 2:
+        properties, _ = decode_properties(body, 2)
+    return bool(body[0] & 0x01), body[1], properties
+
+
+async def read_packet(reader):
+    """从 asyncio StreamReader 读取一个完整报文，返回 (类型, 标志, 报文体)"""
+    first = await reader.readexactly(1)
+    multiplier = 1
+    length = 0
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise ProtocolError('剩余长度超过 4 字节')
+    body = await reader.readexactly(length) if length else b''
+    return first[0] >> 4, first[0] & 0x0F, body
+
+
+# ============== 主题匹配 ==============
+
+def split_shared(topic_filter: str):
+    """拆分共享订阅 $share/<group>/<filter>，返回 (分组, 过滤器)"""
+    if topic_filter.startswith('$share/'):
+        parts = topic_filter.split('/', 2)
+        if len(parts) != 3 or not parts[1] or not parts[2]:
+            raise ProtocolError(f'共享订阅格式错误: {topic_filter}')
+        return parts[1], parts[2]
+    return None, topic_filter
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """判断主题是否匹配过滤器 (支持 + 和 #)"""
+    _, topic_filter = split_shared(topic_filter)
+    if topic.startswith('$') and topic_filter[:1] in ('+', '#'):
+        return False
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+# ============== 日志 ==============
+
+def preview_payload(payload, limit: int = 200) -> str:
+    """消息预览: 只解码前 limit 字节，避免日志中出现完整的大消息"""
+    if isinstance(payload, str):
+        text = payload[:limit]
+        size = len(payload.encode('utf-8')) if len(payload) <= limit else None
+    else:
+        size = len(payload)
+        text = bytes(payload[:limit]).decode('utf-8', 'replace')
+    if size is not None and size <= limit:
+        return text
+    return f'{text}... ({size} 字节)' if size is not None else f'{text}...'
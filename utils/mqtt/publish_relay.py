@@ -0,0 +1,428 @@
+"""
+MQTT 发布中继 (sidecar) - Python
+
+本机所有后端工作进程经 Unix socket 连接中继进程，自身不连接代理:
+- 发布: 工作进程把消息写入 socket，中继经少量连接 (pool_size) 批量发布
+- 订阅: 中继用一条连接订阅后端关心的主题，收到的消息经 socket 扇出给所有工作进程
+工作进程数增加时，到代理的连接数 (pool_size + 1) 和 TLS 握手次数保持不变。
+
+运行: python publish_relay.py --socket /tmp/todo-mqtt-relay.sock --broker localhost --topic 'todo/#'
+后端: flask --app backend/app.py mqtt-relay (读取 config.py 中的 EMQX_CONFIG)
+
+- 同一主题总由同一条连接发送，保证主题内的消息顺序
+- 每条连接一个发送队列，积压的消息合并为一次写入 (publish_batch)
+- 与代理断开后自动重连，未发出的批次重连后重发；订阅连接按 clean / session_expiry 保留会话
+- 发送队列满时丢弃新消息并计数 (工作进程不会被中继阻塞)
+- 工作进程读取过慢 (socket 积压超过 MAX_FRAME) 时跳过该进程并计数，不影响其他进程
+
+帧格式 (大端，两个方向相同): 4 字节帧长度 | 2 字节主题长度 | 1 字节 qos | 1 字节 retain |
+              4 字节消息过期秒数 (0 为不过期) | 主题 | payload
+"""
+
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+try:
+    from utils.mqtt import mqtt_protocol as proto
+    from utils.mqtt.async_mqtt_client import AsyncMqttClient
+except ImportError:
+    import mqtt_protocol as proto
+    from async_mqtt_client import AsyncMqttClient
+
+FRAME_HEADER = struct.Struct('!IHBBI')
+# 帧长度之后的头部字节数
+_HEADER_REST = FRAME_HEADER.size - 4
+MAX_FRAME = 16 * 1024 * 1024
+DEFAULT_SOCKET = '/tmp/todo-mqtt-relay.sock'
+
+
+def encode_frame(topic: str, payload: bytes, qos: int = 0, retain: bool = False,
+                 expiry: int = None) -> bytes:
+    """编码一条待发布消息"""
+    topic_bytes = topic.encode('utf-8')
+    length = _HEADER_REST + len(topic_bytes) + len(payload)
+    return (FRAME_HEADER.pack(length, len(topic_bytes), qos, int(retain), expiry or 0)
+            + topic_bytes + payload)
+
+
+async def read_frame(reader):
+    """读取一帧，返回 (主题, payload, qos, retain, expiry)；连接关闭时抛出 IncompleteReadError"""
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length, topic_length, qos, retain, expiry = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME or topic_length > length - _HEADER_REST:
+        raise ValueError(f'帧长度无效: {length}')
+    if qos > 1:
+        raise ValueError(f'不支持的 QoS: {qos}')
+    body = await reader.readexactly(length - _HEADER_REST)
+    return (body[:topic_length].decode('utf-8'), body[topic_length:], qos, bool(retain),
+            expiry or None)
+
+
+class PublishRelay:
+    """
+    中继服务端: Unix socket 接收工作进程的消息，经连接池批量发布到代理；
+    订阅 topics 并把收到的消息扇出给所有已连接的工作进程
+    """
+
+    def __init__(self, config: dict, socket_path: str = DEFAULT_SOCKET, pool_size: int = 2,
+                 batch_max: int = 100, queue_size: int = 10000, topics=None):
+        self.config = config
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.batch_max = batch_max
+        self.queue_size = queue_size
+        self.topics = list(topics or [])
+        self.stats = {'workers': 0, 'received': 0, 'published': 0, 'batches': 0,
+                      'dropped': 0, 'reconnects': 0, 'delivered': 0, 'fanout_dropped': 0}
+        self._clients = [None] * pool_size
+        self._queues = []
+        self._workers = set()
+
+    async def _open(self, name, options: dict):
+        """建立一条到代理的连接，失败时退避重试"""
+        delay = 0.5
+        while True:
+            client = AsyncMqttClient({
+                **self.config,
+                'client_id': f"{self.config['client_id']}_{name}",
+                **options,
+            })
+            try:
+                return await client.connect()
+            except ConnectionError as e:
+                print(f"[中继] 连接 {name} 失败: {e}，{delay:.1f} 秒后重试")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _connect(self, index: int):
+        """建立 (或重建) 第 index 条发布连接"""
+        client = await self._open(index, {
+            # 只发布不订阅，无需持久会话
+            'clean': True,
+            'session_expiry': 0,
+            # 至少能容纳一个批次，避免批量发布时等待
+            'max_inflight': max(self.config.get('max_inflight', 20), self.batch_max),
+        })
+        self._clients[index] = client
+        return client
+
+    async def _connect_subscriber(self):
+        """建立 (或重建) 订阅连接；代理保留了会话时无需重新订阅"""
+        while True:
+            client = await self._open('sub', {'raw_payload': True})
+            if client.session_present:
+                return client
+            try:
+                await client.subscribe(self.topics)
+                return client
+            except ConnectionError:
+                self.stats['reconnects'] += 1
+
+    async def _subscriber(self, client):
+        """把订阅到的消息扇出给工作进程，断开后重连"""
+        while True:
+            # 连接关闭后 messages() 取完已收到的消息才结束
+            async for topic, payload in client.messages():
+                self._fan_out(topic, payload)
+            self.stats['reconnects'] += 1
+            client = await self._connect_subscriber()
+
+    def _fan_out(self, topic: str, payload: bytes):
+        frame = encode_frame(topic, payload)
+        for writer in self._workers:
+            # 工作进程读取跟不上时跳过它，避免中继内存无限增长
+            if writer.transport.get_write_buffer_size() > MAX_FRAME:
+                self.stats['fanout_dropped'] += 1
+                continue
+            writer.write(frame)
+            self.stats['delivered'] += 1
+
+    async def _sender(self, index: int):
+        queue = self._queues[index]
+        client = self._clients[index]
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_max and not queue.empty():
+                batch.append(queue.get_nowait())
+            while True:
+                try:
+                    if client is None or not client.connected:
+                        raise ConnectionError('连接已关闭')
+                    await client.publish_batch(batch)
+                    break
+                except ConnectionError:
+                    self.stats['reconnects'] += 1
+                    client = await self._connect(index)
+            self.stats['published'] += len(batch)
+            self.stats['batches'] += 1
+
+    async def _handle_worker(self, reader, writer):
+        self.stats['workers'] += 1
+        self._workers.add(writer)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                topic = frame[0]
+                self.stats['received'] += 1
+                # 同一主题固定分配到同一连接
+                queue = self._queues[zlib.crc32(topic.encode('utf-8')) % self.pool_size]
+                try:
+                    queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    self.stats['dropped'] += 1
+        except asyncio.IncompleteReadError:
+            pass
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"[中继] 无效的帧，断开工作进程: {e}")
+        finally:
+            self.stats['workers'] -= 1
+            self._workers.discard(writer)
+            writer.close()
+
+    async def serve(self, ready: threading.Event = None):
+        """连接代理并开始监听 Unix socket"""
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.pool_size)]
+        await asyncio.gather(*(self._connect(i) for i in range(self.pool_size)))
+        tasks = [asyncio.create_task(self._sender(i)) for i in range(self.pool_size)]
+        if self.topics:
+            subscriber = await self._connect_subscriber()
+            tasks.append(asyncio.create_task(self._subscriber(subscriber)))
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_worker, self.socket_path)
+        print(f"[中继] 已连接 {self.pool_size} 条到 {self.config['broker']}:{self.config['port']}，"
+              f"订阅 {', '.join(self.topics) or '无'}，监听 {self.socket_path}")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                while True:
+                    await asyncio.sleep(60)
+                    print(f"[中继] {json.dumps(self.stats)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def run(self):
+        """阻塞运行，Ctrl+C 退出"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print(f"[中继] 已停止 {json.dumps(self.stats)}")
+
+
+class RelayPublisher:
+    """
+    工作进程侧的客户端，publish / subscribe 接口与 MqttClient 一致
+
+    消息写入 Unix socket 即返回 (不等待代理确认)；中继不可用时丢弃消息。
+    connect() 后由后台线程接收中继扇出的消息，断开后自动重连并再次调用 on_connected。
+    订阅在本地按主题过滤: 中继订阅的主题由中继配置决定。线程安全。
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.socket_path = config.get('socket', DEFAULT_SOCKET)
+        self.timeout = config.get('timeout', 0.5)
+        self.metrics_callback = None
+        self.message_callback = None
+        self.on_connected = None
+        # 会话由中继持有，工作进程每次连接都视为新会话
+        self.session_present = False
+        self.inflight_count = 0
+        self.connected = False
+        self._filters = []
+        self._sock = None
+        self._lock = threading.Lock()
+        self._reader = None
+        self._stopped = False
+
+    def connect(self, wait: bool = True):
+        """连接中继并启动接收线程，失败时由接收线程重试"""
+        self._stopped = False
+        if wait:
+            with self._lock:
+                self._open()
+        if self._reader is None or not self._reader.is_alive():
+            self._reader = threading.Thread(target=self._read_loop, daemon=True)
+            self._reader.start()
+        return self
+
+    def _open(self):
+        if self._sock is not None:
+            return True
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return False
+        self._sock = sock
+        self.connected = True
+        return True
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self.connected = False
+
+    def _read_loop(self):
+        """接收中继扇出的消息；连接断开后退避重连"""
+        delay = 0.5
+        while not self._stopped:
+            with self._lock:
+                self._open()
+                sock = self._sock
+            if sock is None:
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+                continue
+            delay = 0.5
+            if self.on_connected:
+                try:
+                    self.on_connected(self)
+                except Exception as e:
+                    print(f"[连接回调错误] {e}")
+            try:
+                self._receive(sock)
+            except (OSError, ValueError, UnicodeDecodeError):
+                pass
+            with self._lock:
+                if self._sock is sock:
+                    self._close()
+
+    def _receive(self, sock):
+        buffer = bytearray()
+        while not self._stopped:
+            try:
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                if self._sock is not sock:
+                    return
+                continue
+            if not chunk:
+                return
+            buffer += chunk
+            while len(buffer) >= FRAME_HEADER.size:
+                length, topic_length = FRAME_HEADER.unpack_from(buffer)[:2]
+                if length > MAX_FRAME or topic_length > length - _HEADER_REST:
+                    raise ValueError(f'帧长度无效: {length}')
+                end = 4 + length
+                if len(buffer) < end:
+                    break
+                topic = bytes(buffer[FRAME_HEADER.size:FRAME_HEADER.size + topic_length]).decode('utf-8')
+                payload = bytes(buffer[FRAME_HEADER.size + topic_length:end])
+                del buffer[:end]
+                self._dispatch(topic, payload)
+
+    def _dispatch(self, topic: str, payload: bytes):
+        if not self.message_callback or not any(proto.topic_matches(f, topic) for f in self._filters):
+            return
+        self._emit_metric('receive', topic)
+        max_payload = self.config.get('max_payload')
+        if max_payload and len(payload) > max_payload:
+            self._emit_metric('dropped', topic)
+            return
+        try:
+            if self.config.get('raw_payload'):
+                self.message_callback(topic, memoryview(payload))
+            else:
+                self.message_callback(topic, payload.decode('utf-8'))
+        except Exception as e:
+            print(f"[回调错误] {e}")
+
+    def subscribe(self, topics, callback=None):
+        """
+        订阅主题 (只在本地过滤中继转发的消息)
+
+        Args:
+            topics: 主题字符串或主题列表
+            callback: 消息回调函数 callback(topic, message)
+        """
+        if isinstance(topics, str):
+            topics = [topics]
+        if callback is not None:
+            self.message_callback = callback
+        self._filters = list(dict.fromkeys(self._filters + list(topics)))
+
+    def unsubscribe(self, topics):
+        if isinstance(topics, str):
+            topics = [topics]
+        self._filters = [f for f in self._filters if f not in topics]
+
+    def publish(self, topic: str, message, qos: int = None, retain: bool = False, expiry: int = None):
+        """发布消息 (字符串、字典或 bytes)，expiry 为消息过期时间 (秒)；中继只支持 QoS 0 / 1"""
+        if qos is None:
+            qos = self.config.get('qos', 1)
+        if qos not in (0, 1):
+            raise ValueError(f'不支持的 QoS: {qos} (仅支持 0 / 1)')
+        if isinstance(message, (dict, list)):
+            payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        elif isinstance(message, (bytes, bytearray)):
+            payload = bytes(message)
+        else:
+            payload = str(message).encode('utf-8')
+        frame = encode_frame(topic, payload, qos, retain, expiry)
+        with self._lock:
+            if not self._open():
+                self._emit_metric('dropped', topic)
+                return False
+            try:
+                self._sock.sendall(frame)
+            except OSError:
+                # 可能只写出了半帧，必须断开，由中继丢弃残帧
+                self._close()
+                self._emit_metric('dropped', topic)
+                return False
+        self._emit_metric('publish', topic)
+        return True
+
+    def _emit_metric(self, kind, topic):
+        if self.metrics_callback:
+            try:
+                self.metrics_callback(kind, topic, None)
+            except Exception as e:
+                print(f"[指标回调错误] {e}")
+
+    def disconnect(self):
+        self._stopped = True
+        with self._lock:
+            self._close()
+
+
+# ============== 使用示例 ==============
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description='MQTT 发布中继')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--broker', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--batch-max', type=int, default=100)
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--ca-cert')
+    parser.add_argument('--mqtt5', action='store_true', help='使用 MQTT 5 (转发消息过期时间)')
+    parser.add_argument('--topic', action='append', default=[], help='订阅并扇出给工作进程的主题 (可重复)')
+    args = parser.parse_args()
+
+    PublishRelay({
+        'broker': args.broker,
+        'port': args.port,
+        'client_id': f'mqtt_relay_{socket.gethostname()}_{random.randint(0, 1000)}',
+        'qos': 1,
+        'protocol': proto.MQTT_V5 if args.mqtt5 else proto.MQTT_V311,
+        'use_tls': args.tls,
+        'ca_cert': args.ca_cert,
+    }, args.socket, args.pool_size, args.batch_max, topics=args.topic).run()